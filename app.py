@@ -2,40 +2,79 @@ import streamlit as st
 import datetime
 import calendar
 import random
-import json
+import re
 import os
-import pandas as pd
+import html
 import time
-# --- Mood Elf Game Imports ---
-from PIL import Image
-import base64 
-import io
+import contextlib
+import functools
+# pandas, NumPy and Pillow (core.columnar, core.pixels, core.assets) take most of
+# the startup time: only the pages that draw charts or images import them
+# --- Storage ---
+from core.diary import MAX_DATE_KEY, MIN_DATE_KEY, calculate_streak, entries_between
+from core.archive import ARCHIVE_CACHE_BUDGET_BYTES
+from core.store import JsonDiaryStore
+from core.compact_format import CompactCodec
+from core.journal_log import JSON_CODEC
+from core.registry import REGISTRY_FILE, UserRegistry, migrate_flat_layout
+from core.user_cache import USER_CACHE_BUDGET_BYTES, UserStateCache
+from core.sqlite_store import SqliteDiaryStore
+from core.write_behind import WriteBehindStore
+from core.concurrency import changed_elsewhere
+from core.user_state import load_user_state, save_user_state
+# --- Journal Logic ---
+from core.advice import diary_response, mood_advice
+from core import elf
+from core.elf import ELF_EVOLUTION_THRESHOLD, MAX_DAILY_POTION_ENTRIES, create_initial_elf_state
+# --- Analytics ---
+from core.rollups import period_start
+from core.lexicon import get_emotion_matcher, is_cjk
+from core.sentiment import backfill, get_sentiment_scorer
+from core.search import highlight_terms
+# --- Metrics ---
+from core.metrics import Metrics, approx_size, thread_written_bytes, user_label
 
 # -------------------- 0. Mood Elf Helper Functions (for Pet Game) --------------------
 
-@st.cache_data
-def get_base64_image(image_path, cache_identifier): 
-    """Converts image to Base64 for CSS background, uses cache_identifier to force reload."""
-    try:
-        # Uses relative path to the image
-        full_path = image_path 
-        with open(full_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode()
-    except FileNotFoundError:
-        return None
+@st.cache_resource
+def get_assets():
+    """Pet images and the potion sprite sheet, encoded at display size once per process.
 
-@st.cache_data
-def load_pet_image(image_path):
-    """Loads pet images using PIL (for robustness)."""
-    try:
-        return Image.open(image_path)
-    except FileNotFoundError:
-        return None
+    Served as PNG bytes from a byte-budgeted LRU cache; an image edited on
+    disk is picked up by its content hash.
+    """
+    from core.assets import ASSET_CACHE_BUDGET_BYTES, AssetPipeline, ByteCache
+
+    assets = AssetPipeline(ByteCache(ASSET_CACHE_BUDGET_BYTES))
+    for pet_type, path in PET_MAPPING.items():
+        assets.add_image(f"pet_{pet_type}", path, PET_IMAGE_WIDTH)
+    assets.add_sprite_sheet("potions", POTION_MAPPING, (POTION_IMAGE_SIZE, POTION_IMAGE_SIZE))
+    assets.build_all()
+    return assets
 
 # -------------------- 1. GLOBAL CONSTANTS AND MAPPINGS --------------------
 
 POINTS_PER_ENTRY = 10 
-MAX_DAILY_POTION_ENTRIES = 5 # Max potions granted per day
+
+# Storage backend: "json" (one file per user) or "sqlite" (one WAL database)
+STORAGE_BACKEND = os.environ.get("MOOD_JOURNAL_STORAGE", "json")
+# JSON backend: user files in hashed shard directories under DATA_DIR, plus the user registry
+DATA_DIR = os.environ.get("MOOD_JOURNAL_DATA_DIR", "user_data")
+LEGACY_DATA_DIR = "." # Where flat diary_<name>.* files were written before; moved on startup
+SQLITE_DB_PATH = os.environ.get("MOOD_JOURNAL_DB", "mood_journal.db")
+SAVE_FLUSH_DELAY_SECONDS = 0.5 # Max time a save waits in the write-behind queue
+# "compact": binary snapshots with coded moods/tags (core.compact_format); "json": pretty-printed JSON
+STORAGE_FORMAT = os.environ.get("MOOD_JOURNAL_FORMAT", "json")
+# >0: sessions only hold the entries of the last N months; older ones are read on demand
+DIARY_WINDOW_MONTHS = int(os.environ.get("MOOD_JOURNAL_WINDOW_MONTHS", "0"))
+# >0: years that ended more than N days ago move to compressed per-year archives (JSON backend)
+ARCHIVE_AFTER_DAYS = int(os.environ.get("MOOD_JOURNAL_ARCHIVE_AFTER_DAYS", "0"))
+# Set to a path to export Prometheus metrics (core.metrics) there; unset, nothing is measured
+METRICS_FILE = os.environ.get("MOOD_JOURNAL_METRICS_FILE", "")
+METRICS_WRITE_INTERVAL_SECONDS = 10 # Min time between two writes of the metrics file
+# "1": opening the app with ?profile=1 profiles one rerun and shows its top functions
+PROFILING_ENABLED = os.environ.get("MOOD_JOURNAL_PROFILING", "0") == "1"
+PROFILE_TOP_FUNCTIONS = 25
 
 st.set_page_config(page_title="🌸 Personalized Mood Journal Pro", layout="centered")
 
@@ -52,11 +91,21 @@ MOOD_MAPPING = {
 MOOD_SCORES = {
     "😀": 5, "🤩": 4, "😌": 3, "😴": 2, "😢": 1, "😡": 1, "😥": 1
 }
+# Year-in-pixels colors
+MOOD_COLORS = {
+    "😀": "#f5b83d", "🤩": "#f27d52", "😌": "#7cc5a1", "😴": "#a99ccf",
+    "😢": "#5d8ac7", "😡": "#d9534f", "😥": "#8fa3ad",
+}
 
 # --- Mood Elf Game Mappings ---
-ELF_EVOLUTION_THRESHOLD = 30 # Pet evolution threshold
-ELF_INITIAL_POTIONS = 5 # User request: 5 potions initially
 ELF_IMAGE_DIR = "images"
+PET_IMAGE_WIDTH = 250 # Display sizes the assets are pre-encoded at
+POTION_IMAGE_SIZE = 50
+
+# Keyword lexicon (emotion -> language -> term -> weight) used for diary replies
+EMOTION_LEXICON_PATH = os.path.join("data", "emotion_lexicon.json")
+# Results shown per search
+SEARCH_RESULT_LIMIT = 20
 
 # Potion name to file path mapping (lowercase)
 POTION_MAPPING = {
@@ -81,33 +130,6 @@ PET_MAPPING = {
     "Anxious": os.path.join(ELF_IMAGE_DIR, "pet_anxious.png"),
 }
 
-# Helper: Emoji to internal pet name (lowercase)
-EMOJI_TO_ELF_NAME = {
-    "😀": "happy", "😢": "sad", "😡": "angry", "😌": "calm", 
-    "🤩": "excited", "😴": "tired", "😥": "anxious",
-}
-
-# --- Response Texts (English) ---
-EMOTION_RESPONSES = {
-    "tired": "You sound tired 😴. Rest is productive too — take time to recharge.",
-    "bored": "Boredom might mean your heart craves something new 🎨. Try doing something creative today!",
-    "calm": "That’s wonderful 🌿. Calmness is peace speaking softly to your soul.",
-    "guilty": "Guilt shows you care 🌱. Reflect gently and forgive yourself.",
-    "anxious": "Anxiety can be heavy 😥. Breathe slowly — you’re safe and doing your best.",
-    "happy": "Yay! So happy for you! 😄🎈 Let your joy shine and share your smile today!",
-    "sad": f"It’s okay to feel sad 💧. Emotions flow and fade — here’s a little cheer-up joke for you:\n\n**{random.choice(['Why did the scarecrow win an award? Because he was outstanding in his field 🌾', 'I told my computer I felt sad — it gave me a byte of comfort 💻', 'Did you hear about the depressed coffee? It got mugged ☕'])}**",
-    "lonely": "Loneliness is heavy 🫶. You’re not alone — I’m here listening.",
-    "angry": "It’s alright to feel upset 😔. Let it out — expression is healing.",
-}
-
-GENERAL_RESPONSES = [
-    "Thank you for sharing your entry ✍️. Remember, small steps lead to big changes.",
-    "Your feelings are valid. Take a moment to focus on your breath and find peace. 🌬️",
-    "It takes courage to write down your thoughts. We're here to listen to your journey! 🫂",
-    "Keep up the habit of reflection! Every day is a new story waiting to unfold. 🌿",
-    "Well done on making an entry today! You are prioritizing your well-being. 😊",
-]
-
 DAILY_PROMPTS = [
     "What is one thing that made you feel proud or accomplished today?",
     "If you could give yesterday's self one piece of advice, what would it be?",
@@ -163,240 +185,149 @@ FORTUNE_SLIPS = (
 
 # -------------------- 2. HELPER FUNCTIONS (Data & Streak) --------------------
 
-def get_user_data_file(user_name):
-    """Generates a unique file name based on user name."""
-    if not user_name:
+@st.cache_resource
+def get_metrics():
+    """Process-wide metrics; only created when METRICS_FILE is set."""
+    return Metrics()
+
+def timed(fn):
+    """Records the wall time of every call of `fn` in the metrics, under its name.
+
+    Decided when `fn` is defined: with metrics off, `fn` itself is returned.
+    """
+    if not METRICS_FILE:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with get_metrics().time("call_seconds", function=fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+@st.cache_resource
+def get_store():
+    """Returns the process-wide storage backend selected by STORAGE_BACKEND.
+
+    Saves go through a write-behind queue so disk latency stays off the rerun.
+    JSON diaries are parsed once per process and shared by every session of
+    a user (core.user_cache); their old years can be archived (core.archive).
+    Users are looked up in the registry (core.registry).
+    """
+    if STORAGE_BACKEND == "sqlite":
+        backend = SqliteDiaryStore(SQLITE_DB_PATH)
+    else:
+        if STORAGE_FORMAT == "compact":
+            codec = CompactCodec(MOOD_MAPPING.values(), ACTIVITY_TAGS)
+        else:
+            codec = JSON_CODEC
+        registry = UserRegistry(os.path.join(DATA_DIR, REGISTRY_FILE))
+        migrate_flat_layout(LEGACY_DATA_DIR, DATA_DIR, registry)
+        backend = JsonDiaryStore(
+            DATA_DIR,
+            cache=UserStateCache(USER_CACHE_BUDGET_BYTES),
+            codec=codec,
+            archive_after_days=ARCHIVE_AFTER_DAYS or None,
+            archive_cache=UserStateCache(ARCHIVE_CACHE_BUDGET_BYTES),
+            registry=registry,
+        )
+    observer = get_metrics() if METRICS_FILE else None
+    return WriteBehindStore(backend, flush_delay=SAVE_FLUSH_DELAY_SECONDS, observer=observer)
+
+def diary_window_start(today):
+    """First date key of the loading window, or None to load the whole diary."""
+    if DIARY_WINDOW_MONTHS <= 0:
         return None
-    safe_name = user_name.strip().lower().replace(" ", "_")
-    return f"diary_{safe_name}.json"
-
-def create_initial_elf_state():
-    """Initializes the Mood Elf state for a new user or on first run (MODIFIED)."""
-    mood_keys = POTION_MAPPING.keys()
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    return {
-        # Initial potion count is 5 for each (user request)
-        'available_potions': {e: ELF_INITIAL_POTIONS for e in mood_keys}, 
-        # Evolution counts start at 0
-        'emotion_counts': {e: 0 for e in mood_keys},
-        'total_feeds': 0,
-        'evolution_threshold': ELF_EVOLUTION_THRESHOLD,
-        'evolved': False,
-        # Daily potion logging
-        'daily_potion_count': 0, 
-        'last_potion_date': today_str
-    }
+    year, month = divmod(today.year * 12 + today.month - DIARY_WINDOW_MONTHS, 12)
+    return datetime.date(year, month + 1, 1).isoformat()
 
+@timed
 def load_diary(user_name):
-    """Loads diary data for the specified user."""
-    data_file = get_user_data_file(user_name)
-    if not data_file: return
-    
-    if os.path.exists(data_file):
-        try:
-            with open(data_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                st.session_state.diary = data.get("diary", {})
-                st.session_state.total_points = data.get("total_points", 0)
-                
-                loaded_date = data.get("fortune_date")
-                today_str = datetime.date.today().strftime("%Y-%m-%d")
-                
-                if loaded_date == today_str:
-                    st.session_state.fortune_drawn = True
-                    st.session_state.fortune_result = data.get("fortune_result", None)
-                else:
-                    st.session_state.fortune_drawn = False
-                    st.session_state.fortune_result = None
-            # --- Mood Elf Game State Loading (Initialization) ---
-            st.session_state.elf_state = data.get("elf_state", None)
-            if not st.session_state.elf_state:
-                st.session_state.elf_state = create_initial_elf_state()
-            
-            # --- Check and reset daily potion limit ---
-            last_potion_date = st.session_state.elf_state.get('last_potion_date', '1900-01-01')
-            if last_potion_date != datetime.date.today().strftime("%Y-%m-%d"):
-                st.session_state.elf_state['daily_potion_count'] = 0
-                st.session_state.elf_state['last_potion_date'] = datetime.date.today().strftime("%Y-%m-%d")
-                
-        except json.JSONDecodeError:
-            st.session_state.diary = {}
-            st.session_state.elf_state = create_initial_elf_state()
-    else:
-        st.session_state.diary = {}
-        st.session_state.elf_state = create_initial_elf_state()
-
-def save_diary():
-    """Saves diary and state data for the current user."""
-    user_name = st.session_state.get("user_name")
-    data_file = get_user_data_file(user_name)
-    if not data_file: return
-
-    data_to_save = {
-        "diary": st.session_state.diary,
-        "total_points": st.session_state.total_points,
-        "user_name": user_name,
-        "fortune_drawn": st.session_state.get("fortune_drawn", False),
-        "fortune_result": st.session_state.get("fortune_result", None),
-        "fortune_date": datetime.date.today().strftime("%Y-%m-%d"),
-        # --- Mood Elf Game State Saving ---
-        "elf_state": st.session_state.elf_state
-    }
-    with open(data_file, "w", encoding="utf-8") as f:
-        json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-
-def calculate_streak(diary):
-    """Calculates the current consecutive logging streak."""
-    if not diary: return 0
-    logged_dates = set(
-        datetime.datetime.strptime(d, "%Y-%m-%d").date() 
-        for d in diary.keys()
-    )
+    """Loads diary data for the specified user from the storage backend."""
+    if not user_name: return
+    store = get_store()
     today = datetime.date.today()
-    streak = 0
-    day_to_check = today
-    if day_to_check in logged_dates:
-        streak = 1
-        day_to_check -= datetime.timedelta(days=1)
-    elif (day_to_check - datetime.timedelta(days=1)) in logged_dates:
-        streak = 1
-        day_to_check -= datetime.timedelta(days=2) 
-    else:
-        return 0
-    while day_to_check in logged_dates:
-        streak += 1
-        day_to_check -= datetime.timedelta(days=1)
-    return streak
+    for key, value in load_user_state(store, user_name, today, diary_window_start(today)).items():
+        st.session_state[key] = value
+    # Flush queued saves when this session goes away
+    store.flush_when_released(st.session_state.diary, user_name)
+    st.session_state.diary_memory_bytes = st.session_state.diary.memory_bytes()
+
+@timed
+def save_diary(changed_dates=()):
+    """Saves state data for the current user, plus the diary entries in `changed_dates`."""
+    user_name = st.session_state.get("user_name")
+    if not user_name: return
+    save_user_state(get_store(), user_name, st.session_state, datetime.date.today(), changed_dates)
+    st.session_state.diary_memory_bytes = st.session_state.diary.memory_bytes()
+
+@st.cache_resource(max_entries=64)
+@timed
+def get_diary_columns(user_name, content_version, _diary):
+    """Columnar NumPy view of a diary, built once per (user, content version)."""
+    from core.columnar import DiaryColumns
 
+    return DiaryColumns.from_summaries(_diary.summaries(), list(MOOD_MAPPING.values()), ACTIVITY_TAGS)
+
+def diary_columns(diary):
+    return get_diary_columns(diary.user_name, diary.content_version, diary)
+
+@timed
 def get_diary_response(text):
-    """Generates response based on keywords or random general."""
-    text_lower = text.lower()
-    for keyword, reply in EMOTION_RESPONSES.items():
-        if keyword in text_lower:
-            return reply
-    return random.choice(GENERAL_RESPONSES)
+    """Generates response based on lexicon keyword matches or random general."""
+    try:
+        matcher = get_emotion_matcher(EMOTION_LEXICON_PATH)
+    except FileNotFoundError:
+        matcher = None
+    return diary_response(text, matcher)
+
+@timed
+def score_text_sentiment(entry, text):
+    """Text sentiment for a journal entry; reuses the stored result if the text is unchanged."""
+    try:
+        return get_sentiment_scorer(EMOTION_LEXICON_PATH).score_entry(entry, text)
+    except FileNotFoundError:
+        return None
 
+@timed
 def analyze_recent_mood_for_advice(diary):
-    # ... (Mood advice logic remains the same - English only texts are fine)
-    if not diary:
-        return "👋 Time to start your first entry and unlock personalized advice!"
-    today = datetime.date.today()
-    one_week_ago = today - datetime.timedelta(days=7)
-    recent_scores = []
-    for date_str, entry in diary.items():
-        entry_date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-        if one_week_ago <= entry_date < today:
-            recent_scores.append(entry.get('score', 3))
-    if not recent_scores:
-        return "🤔 Need a week of data for personalized advice. Keep logging!"
-    df = pd.Series(recent_scores)
-    avg_score = df.mean()
-    if avg_score <= 2.5:
-        low_moods = [entry['mood'] for date_str, entry in diary.items() 
-                     if one_week_ago <= datetime.datetime.strptime(date_str, "%Y-%m-%d").date() < today and entry.get('score', 3) <= 2]
-        if low_moods:
-            most_common_low_mood = pd.Series(low_moods).mode()[0]
-            if most_common_low_mood in ["😢", "😥"]:
-                return f"😥 Recent Mood Alert: You've often felt sad/anxious. **Challenge:** Try a 10-minute mindfulness exercise today."
-            elif most_common_low_mood in ["😴"]:
-                return f"😴 Recent Mood Alert: You've often felt tired. **Challenge:** Aim for 30 minutes of light physical activity today."
-            elif most_common_low_mood in ["😡"]:
-                return f"😡 Recent Mood Alert: You've often felt angry. **Challenge:** Write down 3 things you are grateful for before bed."
-            else:
-                return f"📉 Recent Mood Alert: Your average mood score is low. **Challenge:** Reach out to a friend or loved one today."
-    elif avg_score >= 4.0:
-        return "✨ Great Job! Your recent mood trend is excellent! **Advice:** Share your joy—compliment someone today!"
-    else:
-        return "⚖️ Your mood is balanced. **Advice:** Keep exploring your activities! Try adding one new tag today."
+    return mood_advice(diary, datetime.date.today())
 
 
-# -------------------- 3. MOOD ELF GAME LOGIC (Integrated - MODIFIED) --------------------
+# -------------------- 3. MOOD ELF GAME LOGIC (rules in core.elf) --------------------
 
 def get_elf_evolution_type():
-    """Determines the pet's evolution type based on the most fed potion (MODIFIED)."""
-    elf_state = st.session_state.elf_state
-    
-    if not elf_state['evolved']:
-        return "EGG"
+    return elf.evolution_type(st.session_state.elf_state)
 
-    # Find the emotion with the maximum feed count
-    max_feed_count = -1
-    evolution_type = "Happy" # Default Pet Type
-
-    for emotion, count in elf_state['emotion_counts'].items():
-        if count > max_feed_count:
-            max_feed_count = count
-            # Convert lowercase emotion name to Capitalized name for image lookup
-            evolution_type = emotion.capitalize() 
-    
-    # If all counts are 0, it should be EGG, but this function only runs if evolved is True.
-    # We keep a default pet for safety if the evolved flag is somehow wrongly set.
-    if max_feed_count == 0:
-        return "Happy" 
-        
-    return evolution_type
+def notify_elf(message, icon):
+    """Queues a toast for the elf page; shown by the feed panel on its next run.
 
+    Feeding runs in a button callback ahead of a fragment rerun, where
+    displaying elements directly is not supported.
+    """
+    st.session_state.setdefault("elf_notices", []).append((message, icon))
 
 def feed_mood_elf(emotion):
-    """Core logic to feed the elf and check for evolution (MODIFIED)."""
-    elf_state = st.session_state.elf_state
-    
-    if elf_state['evolved']:
-        st.toast('The Mood Elf has already evolved! No more feeding allowed.', icon="✨")
-        return
-
-    # Ensure emotion name is lowercase for dictionary lookup
-    emotion_name = emotion.lower()
-    
-    if elf_state['available_potions'][emotion_name] > 0:
-        elf_state['available_potions'][emotion_name] -= 1
-        elf_state['emotion_counts'][emotion_name] += 1
-        elf_state['total_feeds'] += 1
-        st.toast(f"Successfully fed {emotion_name.capitalize()} Potion! 🧪", icon="😋")
-    else:
-        st.toast(f"❌ {emotion_name.capitalize()} Potion ran out! Log your mood to get more.", icon="😔")
-        
-    if elf_state['total_feeds'] >= elf_state['evolution_threshold']:
-        elf_state['evolved'] = True
-        st.balloons()
-        
-    st.session_state.elf_state = elf_state
+    """Feeds the elf and saves its state; queues the notices for the feed panel."""
+    already_evolved = st.session_state.elf_state["evolved"]
+    notices, evolved_now = elf.feed(st.session_state.elf_state, emotion)
+    for message, icon in notices:
+        notify_elf(message, icon)
+    if already_evolved:
+        return # Nothing changed
+    if evolved_now:
+        st.session_state.elf_celebrate = True
     save_diary() # Save the updated elf state
 
 def grant_mood_potion(mood_emoji):
-    """Grants a potion based on mood, checks daily limit (NEW FUNCTIONALITY)."""
-    elf_state = st.session_state.elf_state
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    
-    # Daily reset check (safety)
-    if elf_state.get('last_potion_date') != today_str:
-        elf_state['daily_potion_count'] = 0
-        elf_state['last_potion_date'] = today_str
-
-    if elf_state['daily_potion_count'] < MAX_DAILY_POTION_ENTRIES:
-        mood_name = EMOJI_TO_ELF_NAME.get(mood_emoji)
-        if mood_name:
-            elf_state['available_potions'][mood_name] += 1
-            elf_state['daily_potion_count'] += 1
-            st.session_state.potion_granted_today = True # Mark as granted
-            return mood_name.capitalize(), True
-    
-    return None, False
+    """Grants a potion for the logged mood, within the daily limit."""
+    potion_name, granted = elf.grant_potion(st.session_state.elf_state, mood_emoji, datetime.date.today())
+    if granted:
+        st.session_state.potion_granted_today = True
+    return potion_name, granted
 
 def reset_mood_elf():
-    """Resets the Mood Elf's evolution state only (NEW FUNCTION)."""
-    elf_state = st.session_state.elf_state
-    
-    # Preserve potion counts, but reset feed counts
-    emotion_keys = POTION_MAPPING.keys()
-    
-    st.session_state.elf_state.update({
-        'emotion_counts': {e: 0 for e in emotion_keys},
-        'total_feeds': 0,
-        'evolved': False,
-    })
-    
-    st.toast("Mood Elf has been reset to an Egg! Potions remain the same.", icon="🥚")
+    for message, icon in elf.reset_evolution(st.session_state.elf_state):
+        notify_elf(message, icon)
     save_diary()
 
 
@@ -424,18 +355,29 @@ def initialize_session_state():
         
     # --- Mood Elf Game State Initialization ---
     if "elf_state" not in st.session_state:
-        st.session_state.elf_state = create_initial_elf_state()
+        st.session_state.elf_state = create_initial_elf_state(datetime.date.today())
     
     if "potion_granted_today" not in st.session_state:
         st.session_state.potion_granted_today = False
 
     # Ensure daily count is reset on a new day
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    if st.session_state.elf_state.get('last_potion_date') != today_str:
-        st.session_state.elf_state['daily_potion_count'] = 0
-        st.session_state.elf_state['last_potion_date'] = today_str
+    elf.reset_daily_potions(st.session_state.elf_state, datetime.date.today())
+
+def refresh_if_saved_elsewhere():
+    """Reloads the user's data if another tab or server process saved it since (core.concurrency).
+
+    Checked on every rerun: one small read of the stored version.
+    """
+    sync = st.session_state.get("sync")
+    if sync is None or not changed_elsewhere(get_store().version(st.session_state.user_name), sync):
+        return
+    load_diary(st.session_state.user_name)
+    if METRICS_FILE:
+        get_metrics().inc("session_refreshes_total")
+    st.toast("Updated with changes from another tab or device.", icon="🔄")
 
-initialize_session_state() 
+initialize_session_state()
+refresh_if_saved_elsewhere()
 
 # -------------------- 5. STYLES (Retained from Journal Pro) --------------------
 
@@ -502,6 +444,41 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 
+# --- Month grid: one component instead of a button + markdown per day ---
+CALENDAR_CSS = """
+.cal-nav { display: flex; justify-content: space-between; align-items: center; margin-bottom: 6px; }
+.cal-nav button { border: 1px solid #ccc; border-radius: 5px; background: white; padding: 4px 12px; cursor: pointer; }
+.cal-nav span { font-weight: bold; color: #4b3f37; }
+.cal-grid { display: grid; grid-template-columns: repeat(7, 1fr); gap: 4px; }
+.cal-head { text-align: center; font-weight: bold; color: #6d5f56; }
+.cal-day { text-align: center; padding: 5px; border: 1px solid #ccc; border-radius: 5px; cursor: pointer; background: white; }
+.cal-day:hover { background: #f3ede7; }
+.cal-day.today { border: 2px solid #c9b9a8; }
+.cal-day.selected { background: #efe6dc; }
+.cal-mood { font-size: 1.5em; }
+"""
+
+CALENDAR_JS = """
+export default function({ parentElement, data, setTriggerValue }) {
+    let root = parentElement.querySelector(".cal-root");
+    if (!root) {
+        root = document.createElement("div");
+        root.className = "cal-root";
+        parentElement.appendChild(root);
+    }
+    root.innerHTML = data;
+    root.onclick = (event) => {
+        const day = event.target.closest("[data-date]");
+        const nav = event.target.closest("[data-nav]");
+        if (day) setTriggerValue("clicked", day.getAttribute("data-date"));
+        else if (nav) setTriggerValue("nav", nav.getAttribute("data-nav"));
+    };
+}
+"""
+
+mood_calendar = st.components.v2.component("mood_calendar", css=CALENDAR_CSS, js=CALENDAR_JS)
+
+
 # -------------------- 6. PAGE FUNCTIONS (English) --------------------
 
 def render_onboarding_page():
@@ -579,7 +556,7 @@ def render_fortune_draw_page():
 def render_date_page():
     user = st.session_state.user_name
     points = st.session_state.total_points
-    current_streak = calculate_streak(st.session_state.diary) 
+    current_streak = calculate_streak(st.session_state.diary, datetime.date.today()) 
     
     st.markdown(f"<div class='title'>🌸 Hi, {user}!</div>", unsafe_allow_html=True)
     st.markdown(f"<div class='subtitle'>🔥 **Streak:** {current_streak} days | ⭐ **Mood Points:** {points} | Select a date to begin your entry.</div>", unsafe_allow_html=True)
@@ -596,7 +573,7 @@ def render_date_page():
     st.session_state.selected_date = selected_date
     st.markdown("---")
     
-    col1, col2, col3, col4 = st.columns(4) 
+    col1, col2, col3, col4, col5, col6 = st.columns(6) 
     date_key = selected_date.strftime("%Y-%m-%d")
     is_logged = date_key in st.session_state.diary
     button_text = "Next ➜ Edit/Choose Mood" if is_logged else "Next ➜ Choose Mood"
@@ -613,6 +590,12 @@ def render_date_page():
     if col4.button("🥚 Mood Elf Game", use_container_width=True):
         st.session_state.page = "mood_elf"
         st.rerun()
+    if col5.button("📈 View Trends", use_container_width=True):
+        st.session_state.page = "trends"
+        st.rerun()
+    if col6.button("🔍 Search Diary", use_container_width=True):
+        st.session_state.page = "search"
+        st.rerun()
 
 
 def render_mood_page():
@@ -667,14 +650,18 @@ def render_journal_page():
             reward_points = POINTS_PER_ENTRY
             st.session_state.total_points += reward_points
             
-        st.session_state.diary[date_key] = {
+        new_entry = {
             "mood": mood_icon, 
             "text": diary_text, 
             "response": response,
             "score": MOOD_SCORES.get(mood_icon, 3),
             "tags": selected_tags
         }
-        save_diary()
+        sentiment = score_text_sentiment(existing_entry, diary_text)
+        if sentiment:
+            new_entry["sentiment"] = sentiment
+        st.session_state.diary[date_key] = new_entry
+        save_diary(changed_dates=[date_key])
         
         st.session_state.page = "action_page"
         st.session_state.last_response = response
@@ -728,41 +715,107 @@ def render_action_page():
         st.session_state.page = "mood_elf"
         st.rerun()
 
+@st.cache_data(max_entries=256)
+@timed
+def month_grid_html(user_name, year, month, content_version, _diary):
+    """HTML of one month's mood grid, built once per (user, year, month, diary content version)."""
+    last_day = calendar.monthrange(year, month)[1]
+    month_entries = entries_between(_diary, f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day:02d}")
+    moods_by_day = {int(date_str[8:]): entry.get("mood", "") for date_str, entry in month_entries.items()}
+    cells = [f"<div class='cal-head'>{d}</div>" for d in ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]]
+    for week in calendar.Calendar(firstweekday=calendar.SUNDAY).monthdayscalendar(year, month):
+        for day in week:
+            if day == 0:
+                cells.append("<div></div>")
+                continue
+            mood = html.escape(moods_by_day.get(day, "") or "•")
+            cells.append(
+                f"<div class='cal-day' data-date='{year}-{month:02d}-{day:02d}'>{day}<br><span class='cal-mood'>{mood}</span></div>"
+            )
+    return (
+        f"<div class='cal-nav'><button data-nav='prev'>◀</button>"
+        f"<span>{calendar.month_name[month]} {year}</span><button data-nav='next'>▶</button></div>"
+        f"<div class='cal-grid'>{''.join(cells)}</div>"
+    )
+
+@st.cache_resource(max_entries=64)
+def get_year_pixels(user_name, year, mode):
+    """The in-memory year image of a user; repainted cell by cell as entries change."""
+    from core.pixels import YearPixels
+
+    return YearPixels(year, mode, MOOD_COLORS)
+
+@timed
+def year_pixels_png(diary, year, mode):
+    """PNG bytes of a year's pixels, brought up to date with the diary content version."""
+    pixels = get_year_pixels(diary.user_name, year, mode)
+    return pixels.png_at(diary.content_version, lambda: entries_between(diary, f"{year}-01-01", f"{year}-12-31"))
+
+def shift_month(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
 def render_calendar_page():
-    year, month = st.session_state.selected_date.year, st.session_state.selected_date.month
+    selected = st.session_state.selected_date
+    year, month = st.session_state.get("calendar_month") or (selected.year, selected.month)
     st.markdown("<div class='title'>📅 Monthly Mood Overview</div>", unsafe_allow_html=True)
     st.markdown(f"<div class='subtitle'>{calendar.month_name[month]} {year}</div>", unsafe_allow_html=True)
-    cal = calendar.monthcalendar(year, month)
-    weekdays = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
-    col_w = st.columns(7)
-    for i, d in enumerate(weekdays):
-        col_w[i].markdown(f"<div style='text-align:center; font-weight:bold; color:#6d5f56;'>{d}</div>", unsafe_allow_html=True)
-    for week in cal:
-        cols = st.columns(7)
-        for i, day in enumerate(week):
-            if day != 0:
-                date_str = f"{year}-{month:02d}-{day:02d}"
-                mood = st.session_state.diary.get(date_str, {}).get("mood", "")
-                display_day = day
-                display_mood = mood or "•"
-                if cols[i].button("", key=f"cal_day_{date_str}", use_container_width=True):
-                    st.session_state.selected_date = datetime.date(year, month, day)
-                    st.session_state.selected_mood_emoji = mood
-                    st.session_state.page = "journal"
-                    st.rerun()
-                cols[i].markdown(
-                    f"""<div style='text-align:center; padding: 5px; border: 1px solid #ccc; border-radius: 5px; margin: 2px;'>
-                        {display_day}<br>
-                        <span style='font-size: 1.5em;'>{display_mood}</span>
-                    </div>""", unsafe_allow_html=True
-                )
-            else:
-                cols[i].markdown("<div style='width: 45px; height: 45px; margin: 2px;'></div>", unsafe_allow_html=True)
+    diary = st.session_state.diary
+    grid = month_grid_html(st.session_state.user_name, year, month, getattr(diary, "content_version", None), diary)
+    # Today / selected-day highlights change daily and per session, so they stay out of the cache
+    marks = {}
+    for date_obj, css_class in ((datetime.date.today(), "today"), (selected, "selected")):
+        marks.setdefault(date_obj.strftime("%Y-%m-%d"), []).append(css_class)
+    for date_key, css_classes in marks.items():
+        grid = grid.replace(f"<div class='cal-day' data-date='{date_key}'>", f"<div class='cal-day {' '.join(css_classes)}' data-date='{date_key}'>")
+    result = mood_calendar(data=grid, key="month_calendar", on_clicked_change=lambda: None, on_nav_change=lambda: None)
+    if result.clicked:
+        date_obj = datetime.date.fromisoformat(result.clicked)
+        st.session_state.selected_date = date_obj
+        st.session_state.selected_mood_emoji = diary.get(result.clicked, {}).get("mood", "")
+        st.session_state.calendar_month = None
+        st.session_state.page = "journal"
+        st.rerun()
+    if result.nav:
+        st.session_state.calendar_month = shift_month(year, month, -1 if result.nav == "prev" else 1)
+        st.rerun()
     st.markdown("---")
+    if st.button("🟧 View Year in Pixels", use_container_width=True):
+        st.session_state.pixels_year = year
+        st.session_state.page = "year_pixels"
+        st.rerun()
     if st.button("⬅ Back to Date Selection", use_container_width=True):
+        st.session_state.calendar_month = None
         st.session_state.page = "date"
         st.rerun()
 
+def render_year_pixels_page():
+    """A whole year of moods as one server-rendered image (NEW PAGE)."""
+    from core.pixels import SCORE_COLORS
+
+    st.markdown("<div class='title'>🟧 Year in Pixels</div>", unsafe_allow_html=True)
+    this_year = datetime.date.today().year
+    first_entry = st.session_state.diary.aggregates.first_entry_date if st.session_state.diary else None
+    first_year = min(int(first_entry[:4]), this_year) if first_entry else this_year
+    years = list(range(this_year, first_year - 1, -1))
+    default_year = st.session_state.get("pixels_year", this_year)
+    col1, col2 = st.columns(2)
+    year = col1.selectbox("Year:", years, index=years.index(default_year) if default_year in years else 0, key="pixels_year_select")
+    mode = col2.radio("Color by:", ["score", "mood"], format_func=str.capitalize, horizontal=True, key="pixels_mode")
+    st.session_state.pixels_year = year
+
+    st.image(year_pixels_png(st.session_state.diary, year, mode), use_container_width=True)
+    if mode == "score":
+        legend = " ".join(f"<span style='color:{color}'>■</span> {score}" for score, color in SCORE_COLORS.items())
+    else:
+        legend = " ".join(f"<span style='color:{MOOD_COLORS[emoji]}'>■</span> {emoji} {name}" for name, emoji in MOOD_MAPPING.items())
+    st.markdown(f"<div style='text-align:center;'>{legend}</div>", unsafe_allow_html=True)
+
+    st.markdown("---")
+    if st.button("📆 Back to Calendar", use_container_width=True):
+        st.session_state.page = "calendar"
+        st.rerun()
+
 def render_insight_page():
     user = st.session_state.user_name
     st.markdown(f"<div class='title'>🔮 {user}'s Fun Insights!</div>", unsafe_allow_html=True)
@@ -774,129 +827,302 @@ def render_insight_page():
             st.rerun()
         return
 
-    all_dates = list(st.session_state.diary.keys())
+    # Counters are maintained on every save, so nothing is recounted here
+    aggregates = st.session_state.diary.aggregates
     
-    first_entry_date = min(all_dates)
-    total_entries = len(all_dates)
+    first_entry_date = aggregates.first_entry_date
+    total_entries = aggregates.total_entries
     st.markdown("---")
     st.markdown(f"### 🎉 Your Journaling Milestones")
     st.markdown(f"**Total Entries:** **{total_entries}** 🥳")
     st.markdown(f"**First Entry:** You started your journey on **{first_entry_date}**!")
 
-    mood_list = [entry['mood'] for entry in st.session_state.diary.values()]
-    top_mood_emoji = pd.Series(mood_list).mode()[0]
+    top_mood_emoji = aggregates.top_mood()
     top_mood_name = next(name for name, emoji in MOOD_MAPPING.items() if emoji == top_mood_emoji)
     st.markdown("---")
     st.markdown(f"### 🥇 Your Top Mood")
     st.markdown(f"Your most common mood so far is **{top_mood_name} {top_mood_emoji}**! Keep exploring your emotions.")
 
-    all_tags = []
-    happy_tags = []
-    for entry in st.session_state.diary.values():
-        tags = entry.get('tags', [])
-        all_tags.extend(tags)
-        if entry.get('mood') == '😀':
-            happy_tags.extend(tags)
+    top_tags = aggregates.top_tags(3)
+    happy_tag_counts = aggregates.top_tags(3, mood='😀')
             
     st.markdown("---")
     
-    if all_tags:
-        top_tags = pd.Series(all_tags).value_counts().head(3)
+    if top_tags:
         st.markdown(f"### 🏷️ Top Activities Logged")
-        for tag, count in top_tags.items():
+        for tag, count in top_tags:
             st.markdown(f"**{tag}** logged **{count}** times.")
     
-    if happy_tags:
+    if happy_tag_counts:
         st.markdown(f"---")
         st.markdown(f"### 🤩 What Makes You Happy?")
-        if happy_tags:
-            happy_tag_counts = pd.Series(happy_tags).value_counts().head(3)
-            for tag, count in happy_tag_counts.items():
+        if happy_tag_counts:
+            for tag, count in happy_tag_counts:
                  st.markdown(f"🎉 **{tag}** made you happy **{count}** times!")
         else:
             st.info("Need more happy entries to analyze!")
 
+    # --- Vectorized analytics over the cached columnar diary ---
+    import numpy as np
+    import pandas as pd
+    from core.columnar import blended_scores, rolling_average, tag_mood_stats
+
+    columns = diary_columns(st.session_state.diary)
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=89)
+    dates, averages = rolling_average(columns, window=7, start_date=start, end_date=today)
+    # Emoji score blended with what the journal text says
+    _, blended = rolling_average(columns, window=7, start_date=start, end_date=today, values=blended_scores(columns))
+    st.markdown("---")
+    st.markdown(f"### 📈 Your Mood Trend (7-day average, last 90 days)")
+    st.line_chart(pd.DataFrame({"Emoji mood": averages, "Emoji + text mood": blended}, index=pd.Index(dates, name="Date")))
+
+    unscored_count = int(np.isnan(columns.sentiments).sum())
+    if unscored_count and os.path.exists(EMOTION_LEXICON_PATH):
+        st.caption(f"{unscored_count} entries have no text mood yet.")
+        if st.button("🧠 Analyze Past Entries", use_container_width=True):
+            with st.spinner("Reading your journal..."):
+                # One range read (windowed diaries don't keep these); backfill()
+                # skips entries whose stored sentiment is still current
+                entries = entries_between(st.session_state.diary, MIN_DATE_KEY, MAX_DATE_KEY)
+                results = backfill(entries, EMOTION_LEXICON_PATH)
+            for date_key, sentiment in results.items():
+                st.session_state.diary[date_key] = dict(entries[date_key], sentiment=sentiment)
+            save_diary(changed_dates=list(results))
+            st.rerun()
+
+    tag_stats = tag_mood_stats(columns)
+    if tag_stats:
+        st.markdown(f"### ⚖️ Average Mood by Activity")
+        for tag, info in sorted(tag_stats.items(), key=lambda item: -item[1]["mean_score"]):
+            st.markdown(f"**{tag}**: average score **{info['mean_score']:.1f}** over **{info['count']}** entries")
+
     st.markdown("---")
     if st.button("⬅ Back to Date Selection", use_container_width=True):
         st.session_state.page = "date"
         st.rerun()
 
-def render_mood_elf_page():
-    """Renders the Mood Elf Game page (NEW PAGE)."""
-    st.markdown("<div class='title'>🥚 Mood Elf Pet Game</div>", unsafe_allow_html=True)
-    st.markdown(f"<div class='subtitle'>Feed the pet with potions to evolve it into your dominant emotion type!</div>", unsafe_allow_html=True)
-    st.markdown("---")
-    
-    elf_state = st.session_state.elf_state
-    
-    col_pet, col_info = st.columns([1, 2])
+def render_trends_page():
+    """Long-range mood trends from the persisted weekly/monthly rollups (NEW PAGE)."""
+    import pandas as pd
+
+    user = st.session_state.user_name
+    st.markdown(f"<div class='title'>📈 {user}'s Mood Trends</div>", unsafe_allow_html=True)
+    st.markdown("<div class='subtitle'>Your mood over the weeks and months.</div>", unsafe_allow_html=True)
+
+    rollups = st.session_state.diary.rollups
+    kind = st.radio("Group by:", ["weekly", "monthly"], format_func=str.capitalize, horizontal=True, key="trend_kind")
+    series = rollups.series(kind)
     
-    # --- Left Column: Pet Image and Status ---
-    with col_pet:
-        pet_type = get_elf_evolution_type()
-        image_path = PET_MAPPING.get(pet_type)
+    if not series:
+        st.warning("You need at least one entry to see your trends!")
+    else:
+        index = pd.Index([period_start(kind, key) for key, _ in series], name="Period")
+        st.markdown("### 🌡️ Average Mood Score")
+        st.line_chart(pd.DataFrame({"Average score": [b["mean_score"] for _, b in series]}, index=index))
         
-        st.markdown(f"### Status: **{pet_type}**")
+        st.markdown("### 📝 Entries Logged")
+        st.bar_chart(pd.DataFrame({"Entries": [b["count"] for _, b in series]}, index=index))
         
-        image_pil = load_pet_image(image_path)
-        if image_pil:
-            st.image(image_pil, caption=f"Total Feeds: {elf_state['total_feeds']}/{elf_state['evolution_threshold']}", width=250)
-            
-        # Progress bar
-        total_feeds = elf_state['total_feeds']
-        progress_percent = min(total_feeds / ELF_EVOLUTION_THRESHOLD, 1.0)
+        st.markdown("### 🎭 Mood Distribution")
+        mood_columns = {f"{emoji} {name}": [b["moods"].get(emoji, 0) for _, b in series] for name, emoji in MOOD_MAPPING.items()}
+        st.bar_chart(pd.DataFrame(mood_columns, index=index))
         
-        if not elf_state['evolved']:
-            st.progress(progress_percent)
-            st.caption(f"Feeds remaining until evolution: **{ELF_EVOLUTION_THRESHOLD - total_feeds}**")
+        latest_key, latest = series[-1]
+        if latest["tags"]:
+            st.markdown(f"### 🏷️ Top Activities in {latest_key}")
+            for tag, count in sorted(latest["tags"].items(), key=lambda item: -item[1])[:3]:
+                st.markdown(f"**{tag}** logged **{count}** times.")
+
+    st.markdown("---")
+    if st.button("⬅ Back to Date Selection", use_container_width=True):
+        st.session_state.page = "date"
+        st.rerun()
+
+def search_snippet(text, query, width=160):
+    """Part of `text` around the first query hit, with the hits in bold."""
+    terms = sorted(highlight_terms(query), key=len, reverse=True)
+    if not text or not terms:
+        return text[:width] if text else ""
+    pattern = re.compile("|".join(re.escape(t) if is_cjk(t[0]) else rf"\b{re.escape(t)}\b" for t in terms), re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 3) if first else 0
+    snippet = text[start:start + width]
+    snippet = pattern.sub(lambda m: f"**{m.group()}**", snippet)
+    return ("..." if start else "") + snippet + ("..." if start + width < len(text) else "")
+
+def render_search_page():
+    """Full-text search over all entries, answered from the persisted search index (NEW PAGE)."""
+    st.markdown("<div class='title'>🔍 Search Your Diary</div>", unsafe_allow_html=True)
+    st.markdown("<div class='subtitle'>Find past entries by words, \"exact phrases\", activities or mood.</div>", unsafe_allow_html=True)
+
+    query = st.text_input("Search for:", key="search_query", placeholder='e.g. run with friends, "long walk"')
+    col1, col2 = st.columns(2)
+    tags = col1.multiselect("Activities (all of):", ACTIVITY_TAGS, key="search_tags")
+    moods = col2.multiselect(
+        "Moods (any of):", list(MOOD_MAPPING.values()),
+        format_func=lambda emoji: f"{emoji} {next(n for n, e in MOOD_MAPPING.items() if e == emoji)}",
+        key="search_moods",
+    )
+    start_key = end_key = None
+    if st.checkbox("Only search a date range", key="search_use_range"):
+        today = datetime.date.today()
+        date_range = st.date_input("Date range:", value=(today - datetime.timedelta(days=365), today), key="search_range")
+        if len(date_range) == 2:
+            start_key, end_key = (d.strftime("%Y-%m-%d") for d in date_range)
+    st.markdown("---")
+
+    if query.strip() or tags or moods:
+        results = st.session_state.diary.search(query, tags=tags, moods=moods, start_key=start_key, end_key=end_key, limit=SEARCH_RESULT_LIMIT)
+        if not results:
+            st.info("No entries found. Try other words or fewer filters.")
         else:
-            st.success("✨ Your Mood Elf has successfully evolved!")
-            
-        st.markdown("---")
-        
-        # Reset Button (NEW)
-        if st.button("🔄 Reset Pet to Egg", use_container_width=True, help="Resets the pet's evolution status but keeps your potions."):
-            reset_mood_elf()
-            st.rerun()
+            st.markdown(f"### 📚 {len(results)} best match{'es' if len(results) != 1 else ''}")
+        for date_key, _ in results:
+            # Only the entries on this result page are read
+            entry = st.session_state.diary.get(date_key)
+            if entry is None:
+                continue
+            tags_text = " · ".join(entry.get("tags", []))
+            st.markdown(f"**{date_key}** {entry.get('mood', '')} {f'_({tags_text})_' if tags_text else ''}")
+            st.markdown(f"> {search_snippet(entry.get('text', ''), query)}")
+            if st.button("✏️ Open this entry", key=f"open_{date_key}"):
+                st.session_state.selected_date = datetime.date.fromisoformat(date_key)
+                st.session_state.selected_mood_emoji = None
+                st.session_state.page = "mood"
+                st.rerun()
 
+    st.markdown("---")
+    if st.button("⬅ Back to Date Selection", use_container_width=True):
+        st.session_state.page = "date"
+        st.rerun()
 
-    # --- Right Column: Potion Inventory and Feed Buttons ---
-    with col_info:
-        st.markdown("### 🧪 Your Potion Inventory")
+# The elf page is split into fragments so a feed click reruns only the panel
+# it changes, not the whole script (styles, session init, other pages' code).
+# Everything a feed changes is in the feed panel; the pet panel only changes
+# when the pet evolves or is reset.
+ELF_FRAGMENTS = ["elf_pet", "elf_feed"]
+
+def feed_and_refresh(emotion):
+    """Feed button callback: updates the state, then reruns the feed panel (and the pet panel if the pet changed)."""
+    pet_type = get_elf_evolution_type()
+    feed_mood_elf(emotion)
+    st.rerun(ELF_FRAGMENTS if get_elf_evolution_type() != pet_type else "elf_feed")
+
+def reset_and_refresh():
+    reset_mood_elf()
+    st.rerun(ELF_FRAGMENTS)
+
+@st.fragment(key="elf_pet")
+def render_elf_pet_panel():
+    """Pet image and evolution status."""
+    elf_state = st.session_state.elf_state
+    pet_type = get_elf_evolution_type()
+    
+    st.markdown(f"### Status: **{pet_type}**")
+    
+    pet_png = get_assets().get(f"pet_{pet_type}")
+    if pet_png:
+        st.image(pet_png, width=PET_IMAGE_WIDTH)
         
-        # Display potion status in a DataFrame
-        df_potions = pd.DataFrame({
-            "Potion Type": [e.capitalize() for e in POTION_MAPPING.keys()],
-            "Stock": [elf_state['available_potions'][e] for e in POTION_MAPPING.keys()],
-            "Times Fed": [elf_state['emotion_counts'][e] for e in POTION_MAPPING.keys()],
-        }).set_index('Potion Type')
+    if elf_state['evolved']:
+        st.success("✨ Your Mood Elf has successfully evolved!")
         
-        st.dataframe(df_potions, use_container_width=True)
+    st.markdown("---")
+    
+    # Reset Button (NEW)
+    st.button("🔄 Reset Pet to Egg", use_container_width=True, help="Resets the pet's evolution status but keeps your potions.", on_click=reset_and_refresh)
+
+@st.fragment(key="elf_feed")
+def render_elf_feed_panel(has_sprites):
+    """Everything a feed changes: notices, progress, potion stock and the feed buttons."""
+    elf_state = st.session_state.elf_state
+    for message, icon in st.session_state.pop("elf_notices", []):
+        st.toast(message, icon=icon)
+    if st.session_state.pop("elf_celebrate", False):
+        st.balloons()
 
+    # Progress bar
+    total_feeds = elf_state['total_feeds']
+    progress_percent = min(total_feeds / ELF_EVOLUTION_THRESHOLD, 1.0)
+    
+    if not elf_state['evolved']:
+        st.progress(progress_percent, text=f"Total Feeds: {total_feeds}/{elf_state['evolution_threshold']}")
+        st.caption(f"Feeds remaining until evolution: **{ELF_EVOLUTION_THRESHOLD - total_feeds}**")
         st.markdown("---")
-        st.markdown("### 🍴 Select Potion to Feed")
 
-        # Display potion image and feed button
-        for emotion in sorted(POTION_MAPPING.keys()):
-            col_img, col_btn = st.columns([0.2, 1])
-            
-            potion_path = POTION_MAPPING.get(emotion)
-            potion_count = elf_state['available_potions'][emotion]
-            
-            with col_img:
-                potion_image = load_pet_image(potion_path) 
-                if potion_image:
-                    st.image(potion_image, width=50)
-
-            with col_btn:
-                st.button(
-                    f"Feed {emotion.capitalize()} Potion ({potion_count} in stock)", 
-                    key=f"feed_{emotion}", 
-                    on_click=feed_mood_elf, 
-                    args=(emotion,), 
-                    disabled=(potion_count == 0 or elf_state['evolved'])
+    render_elf_inventory()
+    st.markdown("---")
+    render_elf_feed_buttons(has_sprites)
+
+def render_elf_inventory():
+    """Potion stock and feed counts."""
+    import pandas as pd
+
+    elf_state = st.session_state.elf_state
+    st.markdown("### 🧪 Your Potion Inventory")
+    
+    # Display potion status in a DataFrame
+    df_potions = pd.DataFrame({
+        "Potion Type": [e.capitalize() for e in POTION_MAPPING.keys()],
+        "Stock": [elf_state['available_potions'][e] for e in POTION_MAPPING.keys()],
+        "Times Fed": [elf_state['emotion_counts'][e] for e in POTION_MAPPING.keys()],
+    }).set_index('Potion Type')
+    
+    st.dataframe(df_potions, use_container_width=True)
+
+def render_elf_feed_buttons(has_sprites):
+    """One feed button per potion, next to its sprite."""
+    elf_state = st.session_state.elf_state
+    sprite_offsets = get_assets().sprite_offsets("potions")
+    st.markdown("### 🍴 Select Potion to Feed")
+
+    # Display potion image and feed button
+    for emotion in sorted(POTION_MAPPING.keys()):
+        col_img, col_btn = st.columns([0.2, 1])
+        
+        potion_count = elf_state['available_potions'][emotion]
+        
+        with col_img:
+            if has_sprites:
+                st.markdown(
+                    f"<div class='potion-sprite' style='background-position: -{sprite_offsets[emotion]}px 0;'></div>",
+                    unsafe_allow_html=True,
                 )
 
+        with col_btn:
+            st.button(
+                f"Feed {emotion.capitalize()} Potion ({potion_count} in stock)", 
+                key=f"feed_{emotion}", 
+                on_click=feed_and_refresh, 
+                args=(emotion,), 
+                disabled=(potion_count == 0 or elf_state['evolved'])
+            )
+
+def render_mood_elf_page():
+    """Renders the Mood Elf Game page (NEW PAGE)."""
+    st.markdown("<div class='title'>🥚 Mood Elf Pet Game</div>", unsafe_allow_html=True)
+    st.markdown(f"<div class='subtitle'>Feed the pet with potions to evolve it into your dominant emotion type!</div>", unsafe_allow_html=True)
+    st.markdown("---")
+    
+    # All potions come from one sprite sheet, sent once per page (not per feed)
+    sheet_uri = get_assets().data_uri("potions")
+    if sheet_uri:
+        st.markdown(
+            f"<style>.potion-sprite {{ width: {POTION_IMAGE_SIZE}px; height: {POTION_IMAGE_SIZE}px; "
+            f"background-image: url('{sheet_uri}'); }}</style>", unsafe_allow_html=True
+        )
+    
+    col_pet, col_info = st.columns([1, 2])
+    
+    # --- Left Column: Pet Image and Status ---
+    with col_pet:
+        render_elf_pet_panel()
+
+    # --- Right Column: Progress, Potion Inventory and Feed Buttons ---
+    with col_info:
+        render_elf_feed_panel(sheet_uri is not None)
+
     st.markdown("---")
     if st.button("⬅ Back to Journal Home", use_container_width=True):
         st.session_state.page = "date"
@@ -904,22 +1130,90 @@ def render_mood_elf_page():
 
 # -------------------- 7. MAIN APP FLOW --------------------
 
+def record_rerun(page, seconds, written_before):
+    """Adds one rerun of `page` to the metrics and writes the metrics file when due."""
+    metrics = get_metrics()
+    user_name = st.session_state.get("user_name")
+    user = user_label(user_name) if user_name else "none"
+    state_bytes = sum(approx_size(st.session_state[key]) for key in st.session_state)
+    metrics.observe("rerun_seconds", seconds, page=page)
+    metrics.set("page_session_state_bytes", state_bytes, page=page)
+    metrics.inc("user_reruns_total", user=user)
+    metrics.inc("user_rerun_seconds_total", seconds, user=user)
+    metrics.set("user_session_state_bytes", state_bytes, user=user)
+    if written_before is not None:
+        written = thread_written_bytes() - written_before
+        metrics.inc("rerun_written_bytes_total", written, page=page)
+        metrics.inc("user_rerun_written_bytes_total", written, user=user)
+    store = get_store()
+    metrics.set("write_behind_pending_updates", store.pending_updates())
+    for name, value in store.metrics.items():
+        metrics.set(f"write_behind_{name}", value)
+    metrics.write(METRICS_FILE, METRICS_WRITE_INTERVAL_SECONDS)
+
+def show_profile(profiler):
+    """The top functions of a profiled rerun, in an expander; ends the ?profile=1 mode."""
+    import io
+    import pstats
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    with st.expander("⏱️ Profile of this rerun", expanded=True):
+        st.code(stream.getvalue(), language=None)
+    del st.query_params["profile"]
+
+@contextlib.contextmanager
+def instrumented_rerun(page):
+    """Measures the rerun of `page` (METRICS_FILE) and profiles it (?profile=1).
+
+    With both off this only checks two settings.
+    """
+    profile = PROFILING_ENABLED and st.query_params.get("profile") == "1"
+    if not METRICS_FILE and not profile:
+        yield
+        return
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    written_before = thread_written_bytes()
+    try:
+        yield
+    finally:
+        # Also reached through st.rerun(), which ends the run with an exception
+        if profiler is not None:
+            profiler.disable()
+        if METRICS_FILE:
+            record_rerun(page, time.perf_counter() - start, written_before)
+    if profiler is not None:
+        show_profile(profiler)
+
 if __name__ == "__main__":
-    if st.session_state.page == "onboarding":
-        render_onboarding_page()
-    elif st.session_state.page == "fortune_draw":
-        render_fortune_draw_page()
-    elif st.session_state.page == "date":
-        render_date_page()
-    elif st.session_state.page == "mood":
-        render_mood_page()
-    elif st.session_state.page == "journal":
-        render_journal_page()
-    elif st.session_state.page == "action_page":
-        render_action_page()
-    elif st.session_state.page == "calendar":
-        render_calendar_page()
-    elif st.session_state.page == "insight":
-        render_insight_page()
-    elif st.session_state.page == "mood_elf":
-        render_mood_elf_page()
\ No newline at end of file
+    with instrumented_rerun(st.session_state.page):
+        if st.session_state.page == "onboarding":
+            render_onboarding_page()
+        elif st.session_state.page == "fortune_draw":
+            render_fortune_draw_page()
+        elif st.session_state.page == "date":
+            render_date_page()
+        elif st.session_state.page == "mood":
+            render_mood_page()
+        elif st.session_state.page == "journal":
+            render_journal_page()
+        elif st.session_state.page == "action_page":
+            render_action_page()
+        elif st.session_state.page == "calendar":
+            render_calendar_page()
+        elif st.session_state.page == "insight":
+            render_insight_page()
+        elif st.session_state.page == "trends":
+            render_trends_page()
+        elif st.session_state.page == "search":
+            render_search_page()
+        elif st.session_state.page == "year_pixels":
+            render_year_pixels_page()
+        elif st.session_state.page == "mood_elf":
+            render_mood_elf_page()
\ No newline at end of file
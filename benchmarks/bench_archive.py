@@ -0,0 +1,67 @@
+"""Cold session load and snapshot rewrite: the whole history vs an archived one.
+
+For synthetic diaries of growing length, times a cold load (a fresh store,
+no cache: read + parse the user file) and a snapshot rewrite (what journal
+compaction does after saves), once with every entry in the user file and
+once with all but the last year moved to per-year archives.
+
+    python -m benchmarks.bench_archive --runs 10
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+
+from benchmarks.harness import measure, report, synthetic_entries
+from core.store import JsonDiaryStore
+
+YEARS = (1, 10, 30)
+
+
+def save(codec, path, doc):
+    with open(path, "wb") as f:
+        f.write(codec.dumps(doc))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def wait_for_compactions():
+    for thread in threading.enumerate():
+        if thread.name == "journal-compaction":
+            thread.join()
+
+
+def main(runs):
+    rows = []
+    with tempfile.TemporaryDirectory() as work:
+        for years in YEARS:
+            entries = synthetic_entries(years)
+            last_year = int(max(entries)[:4])
+            for archived in (False, True):
+                root = os.path.join(work, f"{years}y_{'archived' if archived else 'whole'}")
+                os.makedirs(root)
+                store = JsonDiaryStore(root)
+                store.save("bench", {"total_points": 0}, entries)
+                if archived:
+                    store.archive_after_days = 0
+                    store.archive_old_entries("bench", today=datetime.date(last_year, 1, 1))
+                wait_for_compactions()
+                log = store.journal("bench")
+                log.compact()
+                load_time = measure(lambda: JsonDiaryStore(root).load("bench"), runs=runs, warmup=1)["median"]
+                doc = log.load()
+                rewrite_path = os.path.join(work, "rewrite.json")
+                rewrite_time = measure(lambda: save(log.codec, rewrite_path, doc), runs=runs, warmup=1)["median"]
+                rows.append({"years": years, "layout": "archived" if archived else "whole",
+                             "user file KB": os.path.getsize(log.snapshot_path) / 1024,
+                             "load ms": load_time * 1000, "rewrite ms": rewrite_time * 1000})
+    report(f"Archived history (median of {runs} runs)", rows,
+           ["years", "layout", "user file KB", "load ms", "rewrite ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    main(parser.parse_args().runs)
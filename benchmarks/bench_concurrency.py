@@ -0,0 +1,170 @@
+"""Concurrent saves of one user from several server processes and sessions.
+
+Starts ``--processes`` local processes, each with its own store set up like
+app.py's (write-behind queue; for JSON, the shared user cache and the
+registry) on one temporary data directory. Each process runs ``--sessions``
+sessions on threads, all logged in as the same user, and every session saves
+``--saves`` times: it feeds the elf one potion, earns points and writes an
+entry for a date of its own. Before each save a session polls the stored
+version and reloads when someone else saved (core.concurrency), as the app
+does on every rerun.
+
+Then checks that nothing was lost: every feed, point and entry of every
+session must be in the data. Exits with status 1 if any is missing.
+
+    python -m benchmarks.bench_concurrency --processes 4 --sessions 4 --saves 25
+    python -m benchmarks.bench_concurrency --backend sqlite
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.harness import percentile, report, synthetic_entries
+from core import elf
+from core.concurrency import changed_elsewhere
+from core.registry import REGISTRY_FILE, UserRegistry
+from core.sqlite_store import SqliteDiaryStore
+from core.store import JsonDiaryStore
+from core.user_cache import UserStateCache
+from core.user_state import load_user_state, save_user_state
+from core.write_behind import WriteBehindStore
+
+USER = "Shared User"
+POINTS_PER_SAVE = 10
+# Never run out, never evolve: every feed must count
+START_POTIONS = 10 ** 6
+FIRST_SESSION_DATE = datetime.date(2100, 1, 1)
+
+
+def open_store(backend, root, flush_delay):
+    if backend == "sqlite":
+        backend_store = SqliteDiaryStore(os.path.join(root, "mood_journal.db"))
+    else:
+        backend_store = JsonDiaryStore(root, cache=UserStateCache(),
+                                       registry=UserRegistry(os.path.join(root, REGISTRY_FILE)))
+    return WriteBehindStore(backend_store, flush_delay=flush_delay)
+
+
+def seed(backend, root, years, today):
+    store = open_store(backend, root, flush_delay=0)
+    elf_state = elf.create_initial_elf_state(today)
+    elf_state["available_potions"]["happy"] = START_POTIONS
+    elf_state["evolution_threshold"] = 10 ** 9
+    store.save(USER, {"total_points": 0, "elf_state": elf_state}, synthetic_entries(years))
+    store.close()
+
+
+def session_date(process, session, save, sessions, saves):
+    return (FIRST_SESSION_DATE + datetime.timedelta(days=(process * sessions + session) * saves + save)).isoformat()
+
+
+def worker(process, backend, root, sessions, saves, flush_delay, today):
+    """Runs the sessions of one process; returns (save latencies, reloads)."""
+    store = open_store(backend, root, flush_delay)
+    latencies, reloads, errors = [], [0], []
+
+    def run_session(session):
+        state = load_user_state(store, USER, today)
+        for i in range(saves):
+            if changed_elsewhere(store.version(USER), state["sync"]):
+                state = load_user_state(store, USER, today)
+                reloads[0] += 1
+            elf.feed(state["elf_state"], "happy")
+            state["total_points"] = state.get("total_points", 0) + POINTS_PER_SAVE
+            date_key = session_date(process, session, i, sessions, saves)
+            state["diary"][date_key] = {"mood": "😀", "score": 5, "text": f"process {process} session {session}",
+                                        "tags": []}
+            start = time.perf_counter()
+            save_user_state(store, USER, state, today, [date_key])
+            latencies.append(time.perf_counter() - start)
+
+    def guarded(session):
+        try:
+            run_session(session)
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=guarded, args=(s,)) for s in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    start = time.perf_counter()
+    store.close()
+    return latencies, reloads[0], time.perf_counter() - start, errors
+
+
+def check(backend, root, processes, sessions, saves, today):
+    """[problem] of the stored data after the run; empty if nothing was lost."""
+    store = open_store(backend, root, flush_delay=0)
+    state = load_user_state(store, USER, today)
+    version = store.version(USER)
+    store.close()
+    total = processes * sessions * saves
+    problems = []
+    if state.get("total_points") != total * POINTS_PER_SAVE:
+        problems.append(f"total_points {state.get('total_points')} != {total * POINTS_PER_SAVE}")
+    elf_state = state["elf_state"]
+    if elf_state["total_feeds"] != total:
+        problems.append(f"total_feeds {elf_state['total_feeds']} != {total}")
+    if elf_state["available_potions"]["happy"] != START_POTIONS - total:
+        problems.append(f"happy potions {elf_state['available_potions']['happy']} != {START_POTIONS - total}")
+    diary = state["diary"]
+    missing = [session_date(p, s, i, sessions, saves)
+               for p in range(processes) for s in range(sessions) for i in range(saves)
+               if session_date(p, s, i, sessions, saves) not in diary]
+    if missing:
+        problems.append(f"{len(missing)} of {total} entries missing, e.g. {missing[0]}")
+    if diary.aggregates.total_entries != len(diary):
+        problems.append(f"aggregates count {diary.aggregates.total_entries} entries, the diary has {len(diary)}")
+    return problems, version
+
+
+def main(backend, processes, sessions, saves, years, flush_delay):
+    today = datetime.date.today()
+    with tempfile.TemporaryDirectory() as root:
+        seed(backend, root, years, today)
+        # Spawned, not forked: nothing (locks, caches, connections) is shared but the files
+        context = multiprocessing.get_context("spawn")
+        started = time.perf_counter()
+        with context.Pool(processes) as pool:
+            results = pool.starmap(worker, [(p, backend, root, sessions, saves, flush_delay, today)
+                                            for p in range(processes)])
+        elapsed = time.perf_counter() - started
+        problems, version = check(backend, root, processes, sessions, saves, today)
+
+    latencies = [t for result in results for t in result[0]]
+    rows = [{"process": p, "saves": len(r[0]), "reloads": r[1], "p50 save ms": percentile(r[0], 50) * 1000,
+             "p99 save ms": percentile(r[0], 99) * 1000, "final flush ms": r[2] * 1000}
+            for p, r in enumerate(results)]
+    report(f"{processes} processes x {sessions} sessions x {saves} saves of one user ({backend})", rows,
+           ["process", "saves", "reloads", "p50 save ms", "p99 save ms", "final flush ms"])
+    print(f"\n{len(latencies)} saves in {elapsed:.1f} s; p99 save {percentile(latencies, 99) * 1000:.2f} ms")
+    if version:
+        print(f"Stored version: {version['number']} writes, the last one {'merged' if version['merged'] else 'clean'}")
+    for result in results:
+        for error in result[3]:
+            problems.append(f"session failed: {error}")
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if not problems:
+        print("Nothing lost.")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--saves", type=int, default=25)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--flush-delay", type=float, default=0.05, help="write-behind delay of each process (s)")
+    args = parser.parse_args()
+    main(args.backend, args.processes, args.sessions, args.saves, args.years, args.flush_delay)
@@ -0,0 +1,239 @@
+"""Latency and memory of the core journal operations, checked against a baseline.
+
+For synthetic diaries of 1 to 20 years (benchmarks.harness.synthetic_entries)
+times each operation the app runs on a page - streak, mood advice, the reply
+to an entry, a game of Mood Elf, loading and saving a user - and records the
+peak memory it allocates (tracemalloc). Nothing here imports Streamlit.
+
+Each operation is timed in ``--repeats`` rounds of ``--runs`` runs, the
+rounds interleaved with the other operations, so a burst of machine load
+slows one round rather than all of them. Its time is the median over the
+rounds of each round's fastest run. Its memory is the smallest peak of a
+few calls made with the garbage collector off and no compaction running,
+which is the same from run to run.
+
+The results are compared with ``baseline_core.json``: an operation that got
+slower than the baseline by more than ``--tolerance`` and by more than
+MIN_TIME_DELTA_MS (sub-millisecond operations double on a busy machine), or
+allocates more than ``--memory-tolerance`` and MIN_MEMORY_DELTA_KB more, is
+a regression and the run exits with status 1. Timings depend on the machine:
+record a baseline on the machine that runs the check. Before timing, the
+emotion matcher must score a few fixed texts as expected (`LEXICON_CASES`).
+
+    python -m benchmarks.bench_core                  # check
+    python -m benchmarks.bench_core --save-baseline  # record
+"""
+
+import argparse
+import datetime
+import gc
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+from benchmarks.harness import MOODS, REPO_ROOT, measure, report, synthetic_entries
+from core import elf
+from core.advice import diary_response, mood_advice
+from core.diary import Diary, calculate_streak
+from core.lexicon import get_emotion_matcher
+from core.store import JsonDiaryStore
+from core.user_state import load_user_state, save_user_state
+
+YEARS = (1, 5, 10, 20)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_core.json")
+LEXICON_PATH = os.path.join(REPO_ROOT, "data", "emotion_lexicon.json")
+TIME_TOLERANCE = 1.0
+MEMORY_TOLERANCE = 0.2
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA_MS = 0.5
+MIN_MEMORY_DELTA_KB = 16
+# Calls whose smallest peak is the memory of an operation
+MEMORY_CALLS = 3
+# (text, expected emotion scores) the matcher must reproduce
+LEXICON_CASES = [
+    ("I am exhausted", {"tired": 1.0}),
+    # Listed under es and fr: one term, counted once
+    ("estoy triste", {"sad": 1.0}),
+    ("je suis triste", {"sad": 1.0}),
+    ("I regret it", {"guilty": 0.9}),
+]
+
+
+def peak_kb(fn, calls=MEMORY_CALLS):
+    """Peak memory allocated while running `fn`, in KB: the smallest of `calls` calls.
+
+    tracemalloc counts every thread, and a collection frees memory at a
+    random point: each call starts with no compaction running and the
+    collector off, and the smallest peak drops what a compaction `fn`
+    starts allocates next to it.
+    """
+    peaks = []
+    for _ in range(calls):
+        wait_for_compactions()
+        gc.collect()
+        gc.disable()
+        tracemalloc.start()
+        try:
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+            gc.enable()
+    return min(peaks)
+
+
+def lexicon_problems():
+    """[problem] of the matcher's scores of LEXICON_CASES; empty if all match."""
+    matcher = get_emotion_matcher(LEXICON_PATH)
+    problems = []
+    for text, expected in LEXICON_CASES:
+        scores = matcher.scores(text)
+        if scores != expected:
+            problems.append(f"{text!r} scores {scores}, expected {expected}")
+    return problems
+
+
+def wait_for_compactions():
+    for thread in threading.enumerate():
+        if thread.name == "journal-compaction":
+            thread.join()
+
+
+def elf_game(today):
+    """A new elf, fed every potion it is granted until it evolves."""
+    elf_state = elf.create_initial_elf_state(today)
+    rng = random.Random(0)
+    while not elf_state["evolved"]:
+        day = today + datetime.timedelta(days=elf_state["total_feeds"] // elf.MAX_DAILY_POTION_ENTRIES)
+        elf.grant_potion(elf_state, rng.choice(MOODS), day)
+        stocked = [e for e, n in elf_state["available_potions"].items() if n]
+        elf.feed(elf_state, rng.choice(stocked))
+    return elf.evolution_type(elf_state)
+
+
+def operations(work, years):
+    """[(name, fn)] of the operations to measure on a diary of `years` years."""
+    entries = synthetic_entries(years)
+    today = datetime.date.fromisoformat(max(entries)) + datetime.timedelta(days=1)
+    matcher = get_emotion_matcher(LEXICON_PATH)
+    texts = [entries[d]["text"] for d in sorted(entries)[-30:]]
+    diary = Diary(None, "bench", entries)
+
+    root = os.path.join(work, f"{years}y")
+    os.makedirs(root)
+    JsonDiaryStore(root).save("bench", {"total_points": 0}, entries)
+    wait_for_compactions()
+    store = JsonDiaryStore(root)
+    state = load_user_state(store, "bench", today)
+    state["total_points"] = 0
+    # As after a visit of the trends page: from then on every save updates the rollup log
+    store.rollup_records("bench")
+    # Writing the rollup log compacts it in the background: not during the first operation
+    wait_for_compactions()
+    last_day = max(entries)
+    # Every save changes the entry: an unchanged one is cheaper to save
+    scores = itertools.cycle(range(1, 6))
+
+    def save():
+        state["diary"][last_day] = dict(entries[last_day], score=next(scores))
+        save_user_state(store, "bench", state, today, [last_day])
+
+    return [
+        ("streak", lambda: calculate_streak(Diary(None, "bench", entries), today)),
+        ("mood advice", lambda: mood_advice(diary, today)),
+        ("entry reply x30", lambda: [diary_response(text, matcher) for text in texts]),
+        ("elf game", lambda: elf_game(today)),
+        ("load user", lambda: load_user_state(JsonDiaryStore(root), "bench", today)),
+        ("save entry", save),
+    ]
+
+
+def run(runs, repeats):
+    results = {}
+    with tempfile.TemporaryDirectory() as work:
+        for years in YEARS:
+            ops = operations(work, years)
+            fastest = {name: [] for name, _ in ops}
+            for _ in range(repeats):
+                for name, fn in ops:
+                    # As timeit does: collections triggered by earlier work would land in random runs
+                    gc.collect()
+                    gc.disable()
+                    try:
+                        fastest[name].append(measure(fn, runs=runs, warmup=1)["min"] * 1000)
+                    finally:
+                        gc.enable()
+                    wait_for_compactions()
+            for name, fn in ops:
+                results[f"{name} / {years}y"] = {"ms": statistics.median(fastest[name]),
+                                                 "max_ms": max(fastest[name]), "peak_kb": peak_kb(fn)}
+    return results
+
+
+def regressions(results, baseline, tolerance, memory_tolerance):
+    """[(operation, metric, baseline, now)] of the metrics that got worse than allowed."""
+    found = []
+    for key, now in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, allowed, floor in (("ms", tolerance, MIN_TIME_DELTA_MS),
+                                       ("peak_kb", memory_tolerance, MIN_MEMORY_DELTA_KB)):
+            # Not in a baseline recorded by an older version of this script
+            if metric not in base:
+                continue
+            if now[metric] > base[metric] * (1 + allowed) and now[metric] - base[metric] > floor:
+                found.append((key, metric, base[metric], now[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="runs per round; a round's time is its fastest run")
+    parser.add_argument("--repeats", type=int, default=5, help="rounds; the time is their median")
+    parser.add_argument("--save-baseline", action="store_true", help=f"record the results in {BASELINE_PATH}")
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE, help="allowed slowdown (1.0 = twice as slow)")
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    problems = lexicon_problems()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    results = run(args.runs, args.repeats)
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    rows = [{"operation": key, "ms": now["ms"], "baseline ms": baseline.get(key, {}).get("ms"),
+             "slowest round ms": now["max_ms"], "peak KB": now["peak_kb"],
+             "baseline KB": baseline.get(key, {}).get("peak_kb")}
+            for key, now in results.items()]
+    report(f"Core operations (median of {args.repeats} rounds of {args.runs} runs)", rows,
+           ["operation", "ms", "baseline ms", "slowest round ms", "peak KB", "baseline KB"])
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({k: {m: round(v, 3) for m, v in now.items()} for k, now in results.items()}, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline saved to {BASELINE_PATH}")
+        return
+    found = regressions(results, baseline, args.tolerance, args.memory_tolerance)
+    for key, metric, base, now in found:
+        print(f"REGRESSION {key}: {metric} {base:.2f} -> {now:.2f}")
+    if not baseline:
+        print("\nNo baseline yet: run with --save-baseline to record one.")
+    elif not found:
+        print("\nNo regressions.")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
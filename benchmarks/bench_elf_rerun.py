@@ -0,0 +1,99 @@
+"""Rerun cost of a "Feed ... Potion" click on the Mood Elf page.
+
+Compares a feed click on the page as it was before it was split into
+fragments - the same page with ``st.fragment`` turned off, so every click
+reruns the whole script - with the click now, which reruns only the feed
+panel. Both are driven through streamlit's AppTest, which polls with sleeps
+while the script thread runs: "cpu ms" (process CPU time) is the cost of the
+rerun itself, "wall ms" includes the polling. "elements" and "payload" count
+the elements the run sends and their serialized size.
+
+Usage::
+
+    python -m benchmarks.bench_elf_rerun --runs 30
+"""
+
+import argparse
+import contextlib
+import os
+import time
+
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.harness import REPO_ROOT, app_workdir, measure, report, shared_script_cache
+
+
+def element_payload(node):
+    """(element count, serialized bytes) of the elements under an AppTest node."""
+    count, size = 0, 0
+    children = getattr(node, "children", None)
+    if children:
+        for child in children.values():
+            child_count, child_size = element_payload(child)
+            count += child_count
+            size += child_size
+    elif getattr(node, "proto", None) is not None:
+        count, size = 1, node.proto.ByteSize()
+    return count, size
+
+
+@contextlib.contextmanager
+def without_fragments():
+    """Runs the app as a page without fragments: ``st.fragment`` does nothing and
+    fragment-scoped ``st.rerun(keys)`` calls are dropped, so a click reruns the
+    whole script, as before the page was split."""
+    fragment, rerun = streamlit.fragment, streamlit.rerun
+
+    def plain_fragment(func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+    def app_rerun(scope="app"):
+        if scope in ("app", "fragment"):
+            rerun(scope)
+
+    streamlit.fragment, streamlit.rerun = plain_fragment, app_rerun
+    try:
+        yield
+    finally:
+        streamlit.fragment, streamlit.rerun = fragment, rerun
+
+
+def start_elf_page():
+    at = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=60).run()
+    at.text_input(key="name_input").input("Bench Elf")
+    at.button[0].click().run()
+    at.session_state.page = "mood_elf"
+    elf_state = at.session_state.elf_state
+    # Never run out of potions or evolve while benchmarking
+    elf_state["available_potions"]["happy"] = 10 ** 9
+    elf_state["evolution_threshold"] = 10 ** 9
+    return at.run()
+
+
+def feed_click(runs):
+    """Measures feed clicks on a fresh elf page; returns a report row (without its label)."""
+    at = start_elf_page()
+    click = lambda: at.button(key="feed_happy").click().run()  # noqa: E731
+    wall = measure(click, runs=runs)
+    cpu = measure(click, runs=runs, clock=time.process_time)
+    elements, size = element_payload(at.main)
+    # Write queued saves while the temporary data directory still exists
+    at.session_state.diary.store.flush()
+    return {"cpu ms": cpu["median"] * 1000, "wall ms": wall["median"] * 1000,
+            "elements": elements, "payload KB": size / 1024}
+
+
+def main(runs):
+    rows = []
+    with app_workdir(), shared_script_cache():
+        with without_fragments():
+            rows.append({"rerun": "whole page (before)", **feed_click(runs)})
+        rows.append({"rerun": "feed panel (after)", **feed_click(runs)})
+    report(f"Mood Elf feed click (median of {runs} runs)", rows, ["rerun", "cpu ms", "wall ms", "elements", "payload KB"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    main(parser.parse_args().runs)
@@ -0,0 +1,47 @@
+"""Reading one past entry / one month: parsing the diary file vs the entry file.
+
+Builds synthetic diaries of growing length and times, for each, reading a
+single entry and a month of entries through `JournalLog.load()` (what a row
+read cost before) and through the entry file's date index.
+
+    python -m benchmarks.bench_entry_reads --runs 20
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.harness import measure, report, synthetic_entries
+from core.entry_file import EntryFile
+from core.journal_log import JournalLog
+
+YEARS = (1, 10, 30)
+
+
+def main(runs):
+    rows = []
+    with tempfile.TemporaryDirectory() as work:
+        for years in YEARS:
+            entries = synthetic_entries(years)
+            snapshot = os.path.join(work, f"diary_{years}y.json")
+            with open(snapshot, "w", encoding="utf-8") as f:
+                json.dump({"total_points": 0, "diary": entries}, f, ensure_ascii=False, indent=4)
+            entry_file = EntryFile(os.path.join(work, f"diary_{years}y.entries"))
+            entry_file.rebuild({"total_points": 0}, entries, journal_position=(0, 0))
+            date_key = "2000-03-15"
+            for label, read in (
+                ("entry, parse file", lambda: JournalLog(snapshot).load()["diary"][date_key]),
+                ("entry, entry file", lambda: entry_file.get(date_key)),
+                ("month, entry file", lambda: entry_file.between("2000-03-01", "2000-03-31")),
+            ):
+                timing = measure(read, runs=runs)
+                rows.append({"years": years, "file MB": os.path.getsize(snapshot) / 2 ** 20,
+                             "read": label, "median ms": timing["median"] * 1000})
+    report(f"Past-entry reads (median of {runs} runs)", rows, ["years", "file MB", "read", "median ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    main(parser.parse_args().runs)
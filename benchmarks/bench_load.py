@@ -0,0 +1,177 @@
+"""Rerun latency of many concurrent sessions, each going through the whole app flow.
+
+Runs N sessions at once in one process, one thread each, like the Streamlit
+server does with its sessions. Each session is driven through streamlit's
+AppTest: onboarding -> fortune draw -> date -> mood -> journal save ->
+calendar -> insights -> Mood Elf feeding, then the loop from the date page
+again for ``--rounds`` rounds. Every session logs in as its own user, seeded
+with a synthetic diary of ``--years`` years (benchmarks.harness).
+
+Reports the p50/p95/p99 wall time of the reruns of each page function, the
+peak RSS of the process and how much it wrote (``wchar`` of /proc/self/io:
+bytes passed to write(), so Linux only). Data goes to a temporary directory
+with the app's default storage settings.
+
+    python -m benchmarks.bench_load --sessions 16 --years 5 --rounds 3
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import resource
+import threading
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.harness import (
+    REPO_ROOT, app_workdir, concurrent_app_tests, percentile, report, shared_script_cache, synthetic_entries,
+)
+from core.registry import REGISTRY_FILE, UserRegistry
+from core.store import JsonDiaryStore
+
+# app.py's defaults (MOOD_JOURNAL_DATA_DIR), relative to the working directory
+DATA_DIR = "user_data"
+FEEDS_PER_ROUND = 3
+
+
+def seed_user(user_name, years, seed):
+    """Saves a diary of `years` years that ends yesterday for `user_name`."""
+    entries = synthetic_entries(years, seed)
+    shift = datetime.date.today() - datetime.timedelta(days=1) - datetime.date.fromisoformat(max(entries))
+    entries = {(datetime.date.fromisoformat(d) + shift).isoformat(): e for d, e in entries.items()}
+    registry = UserRegistry(os.path.join(DATA_DIR, REGISTRY_FILE))
+    JsonDiaryStore(DATA_DIR, registry=registry).save(user_name, {"total_points": 0}, entries)
+
+
+def page_function(page):
+    """The app.py function that renders `page` (the value of st.session_state.page)."""
+    return f"render_{page}" if page.endswith("_page") else f"render_{page}_page"
+
+
+def written_bytes():
+    """Bytes this process has passed to write() so far, or None off Linux."""
+    try:
+        with open("/proc/self/io") as f:
+            return int(dict(line.split(": ") for line in f.read().splitlines())["wchar"])
+    except OSError:
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Session:
+    """One simulated user; records the wall time of each rerun under the page it rendered."""
+
+    def __init__(self, user_name, samples):
+        self.user_name = user_name
+        self.samples = samples
+        self.at = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=120)
+
+    def rerun(self, action, label=None):
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            raise RuntimeError(f"{self.user_name}: {self.at.exception[0].message}")
+        self.samples[label or page_function(self.at.session_state.page)].append(elapsed)
+
+    def click(self, label):
+        """Clicks the first button whose label contains `label`."""
+        button = next(b for b in self.at.button if label in (b.label or ""))
+        self.rerun(lambda: button.click().run())
+
+    def run(self, rounds):
+        at = self.at
+        self.rerun(at.run)
+        at.text_input(key="name_input").input(self.user_name)
+        self.click("Start Journaling")
+        self.click("Draw Your Destiny")
+        self.click("Start Journaling for Today")
+        for i in range(rounds):
+            self.click("Next")
+            self.click("Happy")
+            at.text_area(key="diary_text_area").input(f"Round {i}: a calm walk, then dinner with friends.")
+            at.multiselect(key="activity_tags").set_value(["Exercise 🏋️", "Socializing 👥"])
+            self.click("Save & Get Reflection")
+            self.click("Go to Calendar")
+            self.click("Back to Date Selection")
+            self.click("View Fun Insights")
+            self.click("Back to Date Selection")
+            self.click("Mood Elf Game")
+            # Never evolve: feeding stays possible whatever the rounds
+            at.session_state.elf_state["evolution_threshold"] = 10 ** 9
+            for _ in range(FEEDS_PER_ROUND):
+                button = at.button(key="feed_happy")
+                self.rerun(lambda: button.click().run(), label="render_elf_feed_panel (fragment)")
+            # After a fragment rerun AppTest only holds the fragment's elements, so
+            # the page's "Back to Journal Home" button can't be clicked: do what it does
+            at.session_state.page = "date"
+            self.rerun(at.run)
+
+    def flush(self):
+        """Writes the queued saves (while the temporary data directory still exists)."""
+        if "diary" in self.at.session_state:
+            self.at.session_state.diary.store.flush()
+
+
+def main(sessions, years, rounds):
+    # Session threads read st.session_state outside a script run, which streamlit warns about
+    # (a filter: streamlit resets its loggers' levels when it loads its config)
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(
+        lambda record: "missing ScriptRunContext" not in record.getMessage())
+    samples = collections.defaultdict(list)
+    errors = []
+    with app_workdir(), shared_script_cache(), concurrent_app_tests():
+        users = [f"Load User {i}" for i in range(sessions)]
+        for i, user_name in enumerate(users):
+            seed_user(user_name, years, seed=i)
+        seeded_rss = peak_rss_mb()
+        written_before = written_bytes()
+
+        start_together = threading.Barrier(sessions)
+
+        def drive(user_name):
+            session = Session(user_name, samples)
+            start_together.wait()
+            try:
+                session.run(rounds)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                session.flush()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=(u,), name=f"session-{u}") for u in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        written_after = written_bytes()
+
+    if errors:
+        raise errors[0]
+    rows = [{"page": page, "reruns": len(times), "p50 ms": percentile(times, 50) * 1000,
+             "p95 ms": percentile(times, 95) * 1000, "p99 ms": percentile(times, 99) * 1000}
+            for page, times in sorted(samples.items())]
+    report(f"Rerun wall time, {sessions} concurrent sessions x {rounds} rounds, {years}-year diaries",
+           rows, ["page", "reruns", "p50 ms", "p95 ms", "p99 ms"])
+    print(f"\nTotal time: {elapsed:.1f} s for {sum(len(t) for t in samples.values())} reruns")
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB (after seeding the diaries: {seeded_rss:.0f} MB)")
+    if written_before is not None:
+        print(f"Written by the sessions: {(written_after - written_before) / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+    main(args.sessions, args.years, args.rounds)
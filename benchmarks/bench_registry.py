@@ -0,0 +1,57 @@
+"""Onboarding lookup and user listing: flat data directory vs registry + shards.
+
+Creates N users (an empty journal each) in both layouts and times, for each,
+`exists()` of a known and of an unknown name and listing every user.
+
+    python -m benchmarks.bench_registry --runs 20
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+
+from benchmarks.harness import measure, report
+from core.registry import REGISTRY_FILE, UserRegistry, migrate_flat_layout
+from core.store import JsonDiaryStore
+
+USERS = (1000, 10000)
+
+
+def make_flat_users(root, n):
+    os.makedirs(root)
+    for i in range(n):
+        open(os.path.join(root, f"diary_user_{i}.journal"), "w").close()
+
+
+def main(runs):
+    rows = []
+    with tempfile.TemporaryDirectory() as work:
+        for n in USERS:
+            flat_root = os.path.join(work, f"flat_{n}")
+            make_flat_users(flat_root, n)
+            # The sharded copy is made the way existing installations get it
+            migrate_source, sharded_root = os.path.join(work, f"migrate_{n}"), os.path.join(work, f"sharded_{n}")
+            make_flat_users(migrate_source, n)
+            registry = UserRegistry(os.path.join(sharded_root, REGISTRY_FILE))
+            migrate_flat_layout(migrate_source, sharded_root, registry)
+
+            for layout, root, store in (("flat", flat_root, JsonDiaryStore(flat_root)),
+                                        ("registry", sharded_root, JsonDiaryStore(sharded_root, registry=registry))):
+                # A different user every run, so the registry's in-memory cache never answers
+                names = (f"user {i}" for i in itertools.count())
+                known = measure(lambda: store.exists(next(names)), runs=runs)["median"]
+                unknown = measure(lambda: store.exists("nobody here"), runs=runs)["median"]
+                listing = measure(store.user_names, runs=runs)["median"]
+                largest_dir = max(len(files) for _, _, files in os.walk(root))
+                rows.append({"users": n, "layout": layout, "exists ms": known * 1000,
+                             "unknown ms": unknown * 1000, "list ms": listing * 1000,
+                             "largest dir": largest_dir})
+    report(f"User lookups (median of {runs} runs)", rows,
+           ["users", "layout", "exists ms", "unknown ms", "list ms", "largest dir"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    main(parser.parse_args().runs)
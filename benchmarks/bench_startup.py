@@ -0,0 +1,102 @@
+"""Cold start: from a new Python process to the first paint of the onboarding page.
+
+Each run starts a fresh interpreter with ``-X importtime`` that does the first
+script run of app.py through AppTest (in a temporary working directory).
+Streamlit and AppTest are imported, and a trivial script run, before the
+clock starts, so what is timed is what app.py itself costs a new server
+process. Reports the median process wall time and first run, and the
+modules the first run imported, heaviest first.
+
+Fails (exit status 1) when the first run takes longer than ``--budget-ms``
+or imports one of HEAVY_MODULES, which only the chart and image pages need.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import REPO_ROOT, report
+
+HEAVY_MODULES = ("pandas", "numpy", "PIL")
+FIRST_PAINT_BUDGET_MS = 500
+MARKER = "--- first run ---"
+
+CHILD_SCRIPT = f"""
+import os, sys, time
+from streamlit.testing.v1 import AppTest
+from benchmarks.harness import REPO_ROOT, app_workdir
+
+# Streamlit's own lazy imports happen here, not in the timed run
+AppTest.from_string("import streamlit as st\\nst.write('warm up')").run()
+with app_workdir():
+    at = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=120)
+    print({MARKER!r}, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    at.run()
+    print(time.perf_counter() - start)
+    assert not at.exception, at.exception
+"""
+
+
+def parse_importtime(stderr):
+    """Imports after MARKER in ``-X importtime`` output.
+
+    Returns ([(module, cumulative us)] of the top-level imports, set of every module imported).
+    """
+    imports, modules = [], set()
+    for line in stderr.split(MARKER, 1)[1].splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        # Nested imports are indented under the module that imported them
+        if not name.startswith("  "):
+            imports.append((name.strip(), int(cumulative)))
+    return imports, modules
+
+
+def cold_start():
+    """(process seconds, first run seconds, parse_importtime() result) of one fresh process."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT], cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    process = time.perf_counter() - start
+    return process, float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main(runs, budget_ms):
+    results = [cold_start() for _ in range(runs)]
+    process = statistics.median(r[0] for r in results)
+    first_run = statistics.median(r[1] for r in results)
+    imports, modules = results[-1][2]
+    imports = sorted(imports, key=lambda item: -item[1])
+    report("Imports of the first run (last process)", [{"module": m, "ms": us / 1000} for m, us in imports[:15]],
+           ["module", "ms"])
+    print(f"\nProcess start to first paint: {process * 1000:.0f} ms (median of {runs})")
+    print(f"First script run: {first_run * 1000:.0f} ms, of which imports {sum(us for _, us in imports) / 1000:.0f} ms "
+          f"(budget {budget_ms} ms)")
+
+    failures = []
+    if first_run * 1000 > budget_ms:
+        failures.append(f"first run over budget: {first_run * 1000:.0f} ms > {budget_ms} ms")
+    heavy = sorted({m.split(".")[0] for m in modules} & set(HEAVY_MODULES))
+    if heavy:
+        failures.append(f"heavy modules imported before first paint: {', '.join(heavy)}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=int, default=FIRST_PAINT_BUDGET_MS)
+    args = parser.parse_args()
+    main(args.runs, args.budget_ms)
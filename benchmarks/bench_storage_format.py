@@ -0,0 +1,58 @@
+"""Snapshot size and load/save time: pretty-printed JSON vs the compact format.
+
+For synthetic diaries of growing length, saves a snapshot with each codec
+(encode + write + fsync, as journal compaction does) and loads it back
+(read + decode, as a cold session load does).
+
+    python -m benchmarks.bench_storage_format --runs 10
+"""
+
+import argparse
+import os
+import tempfile
+
+from benchmarks.harness import MOODS, TAGS, measure, report, synthetic_entries
+from core.compact_format import CompactCodec
+from core.journal_log import JSON_CODEC
+
+YEARS = (1, 5, 10)
+
+
+def save(codec, path, doc):
+    with open(path, "wb") as f:
+        f.write(codec.dumps(doc))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load(codec, path):
+    with open(path, "rb") as f:
+        return codec.loads(f.read())
+
+
+def main(runs):
+    codecs = {"json": JSON_CODEC, "compact": CompactCodec(MOODS, TAGS)}
+    rows = []
+    with tempfile.TemporaryDirectory() as work:
+        for years in YEARS:
+            doc = {"total_points": 100, "diary": synthetic_entries(years)}
+            results = {}
+            for name, codec in codecs.items():
+                path = os.path.join(work, f"diary_{years}y{codec.suffix}")
+                save_time = measure(lambda: save(codec, path, doc), runs=runs, warmup=1)["median"]
+                load_time = measure(lambda: load(codec, path), runs=runs, warmup=1)["median"]
+                assert load(codec, path) == doc
+                results[name] = (os.path.getsize(path), save_time, load_time)
+                rows.append({"years": years, "format": name, "size KB": results[name][0] / 1024,
+                             "save ms": save_time * 1000, "load ms": load_time * 1000})
+            json_result, compact_result = results["json"], results["compact"]
+            rows.append({"years": years, "format": "reduction",
+                         **{column: f"{1 - c / j:.0%}" for column, j, c in
+                            zip(("size KB", "save ms", "load ms"), json_result, compact_result)}})
+    report(f"Snapshot formats (median of {runs} runs)", rows, ["years", "format", "size KB", "save ms", "load ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    main(parser.parse_args().runs)
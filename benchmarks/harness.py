@@ -0,0 +1,169 @@
+"""Small timing and reporting helpers shared by the benchmark scripts."""
+
+import contextlib
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same values as MOOD_MAPPING / ACTIVITY_TAGS in app.py
+MOODS = ["😀", "😢", "😡", "😌", "🤩", "😴", "😥"]
+TAGS = ["Work 💻", "Exercise 🏋️", "Socializing 👥", "Food 🍕", "Family ❤️", "Hobbies 🎨",
+        "Rest 🛋️", "Study 📚", "Travel ✈️", "Nature 🏞️", "Money 💰"]
+_SENTENCES = [
+    "Work was busy and the meeting ran late.", "I went for a long walk by the river.",
+    "Dinner with my family was lovely.", "I could not sleep well last night.",
+    "The project deadline is making me anxious.", "Finally finished the book I was reading.",
+    "Felt a bit lonely this evening.", "Had coffee with an old friend and laughed a lot.",
+    "The weather was grey and I stayed in.", "I am proud of how I handled a hard conversation.",
+    "Spent too much money on things I did not need.", "Tried a new recipe and it turned out great.",
+]
+_RESPONSES = ["That sounds like a good day! 😊", "Take care of yourself tonight. 🌙",
+              "It's okay to feel this way.", "Keep going, you're doing great!"]
+# Random words from the sentences compress about as well as real journal text (~4x with zlib)
+_WORDS = sorted({word.strip(".").lower() for sentence in _SENTENCES for word in sentence.split()})
+
+
+def synthetic_entries(years, seed=0):
+    """A diary with one entry a day for `years` years, in the app's entry format."""
+    rng = random.Random(seed)
+    start = datetime.date(2000, 1, 1)
+    entries = {}
+    for i in range(365 * years):
+        mood = rng.choice(MOODS)
+        entry = {
+            "mood": mood,
+            "text": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(20, 80))),
+            "response": rng.choice(_RESPONSES),
+            "score": MOODS.index(mood) % 5 + 1,
+            "tags": rng.sample(TAGS, rng.randint(0, 3)),
+        }
+        if rng.random() < 0.5:
+            entry["sentiment"] = {"sentiment": round(rng.uniform(-1, 1), 3), "version": "bench"}
+        entries[(start + datetime.timedelta(days=i)).isoformat()] = entry
+    return entries
+
+
+def measure(fn, runs=20, warmup=2, clock=time.perf_counter):
+    """Calls `fn` warmup + runs times; returns timing stats (seconds) of the timed runs.
+
+    Pass ``clock=time.process_time`` to count CPU time of all threads instead
+    of wall time (e.g. when a test driver sleeps while polling).
+    """
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(runs):
+        start = clock()
+        fn()
+        samples.append(clock() - start)
+    return {
+        "runs": runs,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+    }
+
+
+def percentile(samples, p):
+    """The `p`-th percentile (0-100) of `samples`, by the nearest-rank method."""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def report(title, rows, columns):
+    """Prints `rows` (list of dicts) as an aligned table of `columns`."""
+    print(f"\n{title}")
+    widths = {c: max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    print("  ".join("-" * widths[c] for c in columns))
+    for row in rows:
+        print("  ".join(_fmt(row.get(c)).ljust(widths[c]) for c in columns))
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return "" if value is None else str(value)
+
+
+@contextlib.contextmanager
+def shared_script_cache():
+    """Makes AppTest reuse one compiled script across runs, like the real server.
+
+    AppTest builds a fresh ScriptCache on every run, so each run recompiles
+    app.py (AST rewrite + compile), which would swamp what is measured.
+    """
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    shared = ScriptCache()
+    modules = (app_test, local_script_runner)
+    for module in modules:
+        module.ScriptCache = lambda: shared
+    try:
+        yield shared
+    finally:
+        for module in modules:
+            module.ScriptCache = ScriptCache
+
+
+@contextlib.contextmanager
+def concurrent_app_tests():
+    """Lets AppTests run in several threads at once, sharing one runtime like a server's sessions.
+
+    Each AppTest run installs a mock Runtime and a config patch, and removes
+    them when it ends - under the feet of the runs still going in other
+    threads. Here the first runtime installed serves every run, and the
+    config patch is applied once around them all.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import patch_config_options
+
+    originals = {name: Runtime.__dict__[name] for name in ("instance", "exists")}
+    shared = []
+
+    def instance(cls):
+        if not shared:
+            shared.append(originals["instance"].__func__(cls))
+        return shared[0]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: bool(shared) or cls._instance is not None)
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        app_test.patch_config_options = patch_config_options
+        for name, method in originals.items():
+            setattr(Runtime, name, method)
+
+
+@contextlib.contextmanager
+def app_workdir():
+    """A temporary working directory that sees the repo's data/ and images/.
+
+    The app resolves data paths relative to the working directory and writes
+    user files there, so benchmarks never touch the real ones.
+    """
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory() as work:
+        for name in ("data", "images"):
+            source = os.path.join(REPO_ROOT, name)
+            if os.path.exists(source):
+                os.symlink(source, os.path.join(work, name))
+        os.chdir(work)
+        sys.path.insert(0, REPO_ROOT)
+        try:
+            yield work
+        finally:
+            sys.path.remove(REPO_ROOT)
+            os.chdir(previous)
@@ -0,0 +1 @@
+"""Streamlit-free building blocks for the Mood Journal app (storage, indexes, analytics)."""
@@ -0,0 +1,90 @@
+"""Reflection replies to journal entries and advice from the recent mood trend."""
+
+import datetime
+import random
+from collections import Counter
+
+from core.diary import entries_between
+
+# --- Response Texts (English) ---
+EMOTION_RESPONSES = {
+    "tired": "You sound tired 😴. Rest is productive too — take time to recharge.",
+    "bored": "Boredom might mean your heart craves something new 🎨. Try doing something creative today!",
+    "calm": "That’s wonderful 🌿. Calmness is peace speaking softly to your soul.",
+    "guilty": "Guilt shows you care 🌱. Reflect gently and forgive yourself.",
+    "anxious": "Anxiety can be heavy 😥. Breathe slowly — you’re safe and doing your best.",
+    "happy": "Yay! So happy for you! 😄🎈 Let your joy shine and share your smile today!",
+    "sad": f"It’s okay to feel sad 💧. Emotions flow and fade — here’s a little cheer-up joke for you:\n\n**{random.choice(['Why did the scarecrow win an award? Because he was outstanding in his field 🌾', 'I told my computer I felt sad — it gave me a byte of comfort 💻', 'Did you hear about the depressed coffee? It got mugged ☕'])}**",
+    "lonely": "Loneliness is heavy 🫶. You’re not alone — I’m here listening.",
+    "angry": "It’s alright to feel upset 😔. Let it out — expression is healing.",
+}
+
+GENERAL_RESPONSES = [
+    "Thank you for sharing your entry ✍️. Remember, small steps lead to big changes.",
+    "Your feelings are valid. Take a moment to focus on your breath and find peace. 🌬️",
+    "It takes courage to write down your thoughts. We're here to listen to your journey! 🫂",
+    "Keep up the habit of reflection! Every day is a new story waiting to unfold. 🌿",
+    "Well done on making an entry today! You are prioritizing your well-being. 😊",
+]
+
+
+def diary_response(text, matcher=None, rng=random):
+    """The reply to a journal entry: the response of its strongest emotion, or a general one.
+
+    `matcher` is an EmotionMatcher (core.lexicon); without one, the first
+    EMOTION_RESPONSES keyword found in the text wins.
+    """
+    if matcher:
+        # Highest summed weight wins; ties keep the EMOTION_RESPONSES order
+        emotion = matcher.best_emotion(text, allowed=list(EMOTION_RESPONSES))
+        if emotion:
+            return EMOTION_RESPONSES[emotion]
+    else:
+        text_lower = text.lower()
+        for keyword, reply in EMOTION_RESPONSES.items():
+            if keyword in text_lower:
+                return reply
+    return rng.choice(GENERAL_RESPONSES)
+
+
+def recent_mood_summary(diary, today, days=7, low_score=2):
+    """(average score, most common low mood) over the `days` before today.
+
+    Only the entries of the window are read. Ties between low moods go to the
+    smallest emoji. Returns (None, None) when there are no entries in the window.
+    """
+    start_key = (today - datetime.timedelta(days=days)).isoformat()
+    end_key = (today - datetime.timedelta(days=1)).isoformat()
+    entries = entries_between(diary, start_key, end_key).values()
+    if not entries:
+        return None, None
+    scores = [entry.get("score", 3) for entry in entries]
+    low_moods = Counter(entry.get("mood") for entry, score in zip(entries, scores) if score <= low_score)
+    low_moods.pop(None, None)
+    if not low_moods:
+        return sum(scores) / len(scores), None
+    best = max(low_moods.values())
+    return sum(scores) / len(scores), min(m for m, c in low_moods.items() if c == best)
+
+
+def mood_advice(diary, today):
+    """Advice from the last week of moods in `diary` (a Diary or a plain dict of entries)."""
+    if not diary:
+        return "👋 Time to start your first entry and unlock personalized advice!"
+    avg_score, most_common_low_mood = recent_mood_summary(diary, today)
+    if avg_score is None:
+        return "🤔 Need a week of data for personalized advice. Keep logging!"
+    if avg_score <= 2.5:
+        if most_common_low_mood:
+            if most_common_low_mood in ["😢", "😥"]:
+                return f"😥 Recent Mood Alert: You've often felt sad/anxious. **Challenge:** Try a 10-minute mindfulness exercise today."
+            elif most_common_low_mood in ["😴"]:
+                return f"😴 Recent Mood Alert: You've often felt tired. **Challenge:** Aim for 30 minutes of light physical activity today."
+            elif most_common_low_mood in ["😡"]:
+                return f"😡 Recent Mood Alert: You've often felt angry. **Challenge:** Write down 3 things you are grateful for before bed."
+            else:
+                return f"📉 Recent Mood Alert: Your average mood score is low. **Challenge:** Reach out to a friend or loved one today."
+    elif avg_score >= 4.0:
+        return "✨ Great Job! Your recent mood trend is excellent! **Advice:** Share your joy—compliment someone today!"
+    else:
+        return "⚖️ Your mood is balanced. **Advice:** Keep exploring your activities! Try adding one new tag today."
@@ -0,0 +1,110 @@
+"""Insight counters kept up to date entry by entry and persisted with the user data.
+
+`InsightAggregates` holds what the insight page shows: mood counts, tag
+counts, mood x tag co-occurrence counts, the first entry date and the total
+number of entries. `apply()` moves one entry from its old to its new value in
+O(number of tags), so creating, editing or overwriting an entry never rescans
+the diary. `verify()` rebuilds the counters from the raw entries and reports
+any drift.
+"""
+
+from collections import Counter
+
+
+class InsightAggregates:
+
+    def __init__(self, mood_counts=None, tag_counts=None, mood_tag_counts=None,
+                 first_entry_date=None, total_entries=0):
+        self.mood_counts = Counter(mood_counts or {})
+        self.tag_counts = Counter(tag_counts or {})
+        self.mood_tag_counts = {m: Counter(c) for m, c in (mood_tag_counts or {}).items()}
+        self.first_entry_date = first_entry_date
+        self.total_entries = total_entries
+
+    # --- Construction / persistence ---
+
+    @classmethod
+    def from_stats(cls, stats):
+        """Builds aggregates from a full recount (`compute_stats` / `DiaryStore.stats`)."""
+        return cls(stats["mood_counts"], stats["tag_counts"], stats["mood_tag_counts"],
+                   stats["first_entry_date"], stats["total_entries"])
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("mood_counts"), data.get("tag_counts"), data.get("mood_tag_counts"),
+                   data.get("first_entry_date"), data.get("total_entries", 0))
+
+    def to_dict(self):
+        return {
+            "mood_counts": dict(self.mood_counts),
+            "tag_counts": dict(self.tag_counts),
+            "mood_tag_counts": {m: dict(c) for m, c in self.mood_tag_counts.items()},
+            "first_entry_date": self.first_entry_date,
+            "total_entries": self.total_entries,
+        }
+
+    # --- Incremental updates ---
+
+    def apply(self, date_key, old_entry, new_entry):
+        """Replaces `old_entry` with `new_entry` at `date_key` (either may be None).
+
+        When the first entry is removed `first_entry_date` becomes None; the
+        caller, which owns the date index, sets the next one.
+        """
+        if old_entry is not None:
+            self._count(old_entry, -1)
+            self.total_entries -= 1
+            if new_entry is None and date_key == self.first_entry_date:
+                self.first_entry_date = None
+        if new_entry is not None:
+            self._count(new_entry, +1)
+            self.total_entries += 1
+            if self.first_entry_date is None or date_key < self.first_entry_date:
+                self.first_entry_date = date_key
+
+    def _count(self, entry, delta):
+        mood = entry.get("mood")
+        tags = entry.get("tags", [])
+        _bump(self.mood_counts, mood, delta)
+        mood_tags = self.mood_tag_counts.setdefault(mood, Counter())
+        for tag in tags:
+            _bump(self.tag_counts, tag, delta)
+            _bump(mood_tags, tag, delta)
+        if not mood_tags:
+            del self.mood_tag_counts[mood]
+
+    # --- Queries ---
+
+    def top_mood(self):
+        """Most common mood emoji; ties go to the smallest emoji, like Series.mode()."""
+        if not self.mood_counts:
+            return None
+        return min(self.mood_counts.items(), key=lambda item: (-item[1], item[0]))[0]
+
+    def top_tags(self, n, mood=None):
+        """[(tag, count)] of the n most logged tags, optionally only for one mood."""
+        counts = self.tag_counts if mood is None else self.mood_tag_counts.get(mood, Counter())
+        return counts.most_common(n)
+
+    # --- Consistency check ---
+
+    def verify(self, stats):
+        """Compares against a full recount; returns the names of mismatched fields."""
+        rebuilt = InsightAggregates.from_stats(stats)
+        mismatched = []
+        for name in ("mood_counts", "tag_counts", "first_entry_date", "total_entries"):
+            if getattr(self, name) != getattr(rebuilt, name):
+                mismatched.append(name)
+        if _non_empty(self.mood_tag_counts) != _non_empty(rebuilt.mood_tag_counts):
+            mismatched.append("mood_tag_counts")
+        return mismatched
+
+
+def _bump(counter, key, delta):
+    counter[key] += delta
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _non_empty(nested):
+    return {k: +c for k, c in nested.items() if +c}
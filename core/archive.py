@@ -0,0 +1,156 @@
+"""Cold storage: old diary entries in immutable, compressed per-year archives.
+
+Most sessions only touch recent entries, yet the user file holds the whole
+history. With archiving on, every entry of a year that ended long enough ago
+is moved out of the user file into ``archive_<name>_<year>.mjd`` (the compact
+format of core.compact_format). The user file then keeps the recent entries
+and the running aggregates, which still count every entry.
+
+Archived years are contiguous: all entries up to the last archived year live
+in archives, so `YearArchives.boundary()` splits every date range into a cold
+and a hot part. Archive files are never modified in place. Saving an entry
+of an archived year writes a new version of that year's file.
+
+Decoded years are cached process-wide, keyed by file stamp, and handed out
+as read-only mappings. The list of archived years is cached too, keyed by the
+stamp of ``archive_<name>.years``: whichever process archives a new year
+rewrites that marker, so the others see the new boundary on their next read.
+"""
+
+import copy
+import datetime
+import glob
+import json
+import os
+import threading
+from types import MappingProxyType
+
+from core.journal_log import fsync_dir
+from core.user_cache import SharedUserState
+
+# Decoded archive years shared by all sessions of a process
+ARCHIVE_CACHE_BUDGET_BYTES = 32 * 1024 * 1024
+ARCHIVE_SUFFIX = ".mjd"
+YEARS_SUFFIX = ".years"
+
+
+def archive_cutoff_year(today, archive_after_days):
+    """The last year whose entries are all older than `archive_after_days`."""
+    return (today - datetime.timedelta(days=archive_after_days)).year - 1
+
+
+class YearArchives:
+    """The archive files of one user in `root`."""
+
+    def __init__(self, root, key, codec, cache):
+        self.root = root
+        self.key = key
+        self.codec = codec  # a CompactCodec
+        self.cache = cache  # a UserStateCache, keyed by archive path
+        self._years = None
+        self._years_stamp = None  # of the marker file when _years was globbed
+        self._lock = threading.Lock()
+
+    def path(self, year):
+        return os.path.join(self.root, f"archive_{self.key}_{year}{ARCHIVE_SUFFIX}")
+
+    def marker_path(self):
+        return os.path.join(self.root, f"archive_{self.key}{YEARS_SUFFIX}")
+
+    def years(self):
+        """Archived years, oldest first (globbed again once another process archived a year)."""
+        stamp = self._marker_stamp()
+        with self._lock:
+            if self._years is None or stamp != self._years_stamp:
+                prefix = f"archive_{self.key}_"
+                years = (os.path.basename(p)[len(prefix):-len(ARCHIVE_SUFFIX)]
+                         for p in glob.glob(os.path.join(self.root, prefix + "[0-9]*" + ARCHIVE_SUFFIX)))
+                # Not archive_<key>_2020_2021.mjd, which belongs to user "<key>_2020"
+                self._years = sorted(int(year) for year in years if len(year) == 4 and year.isdigit())
+                self._years_stamp = stamp
+            return list(self._years)
+
+    def _marker_stamp(self):
+        try:
+            stat = os.stat(self.marker_path())
+        except FileNotFoundError:
+            return None
+        # The marker is replaced, never modified: a new inode is a new version
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def boundary(self):
+        """First date key after the archived years, or None if nothing is archived."""
+        years = self.years()
+        return f"{years[-1] + 1:04d}-01-01" if years else None
+
+    def year_entries(self, year):
+        """{date: entry} of an archived year, read-only and shared (empty if not archived)."""
+        path = self.path(year)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return MappingProxyType({})
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        state = self.cache.get(path, stamp)
+        if state is None:
+            with open(path, "rb") as f:
+                entries = self.codec.loads(f.read()).get("diary", {})
+            state = SharedUserState({}, MappingProxyType(entries), stamp,
+                                    stat.st_size * self.codec.parsed_size_factor)
+            self.cache.put(path, state)
+        return state.entries
+
+    # --- Reads (entries are copies, sessions may edit them) ---
+
+    def get(self, date_key):
+        return copy.deepcopy(self.year_entries(int(date_key[:4])).get(date_key))
+
+    def between(self, start_key, end_key):
+        rows = {}
+        for year in self.years():
+            if f"{year:04d}" < start_key[:4] or f"{year:04d}" > end_key[:4]:
+                continue
+            entries = self.year_entries(year)
+            rows.update((d, copy.deepcopy(entries[d])) for d in sorted(entries) if start_key <= d <= end_key)
+        return rows
+
+    def dates(self):
+        return [d for year in self.years() for d in sorted(self.year_entries(year))]
+
+    def all_entries(self):
+        """[read-only {date: entry}] per archived year, oldest first."""
+        return [self.year_entries(year) for year in self.years()]
+
+    # --- Writes ---
+
+    def write_year(self, year, entries):
+        """Writes a new version of a year's archive."""
+        path = self.path(year)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.codec.dumps({"diary": entries}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(path)
+        years = self.years()
+        if year not in years:
+            # After the archive file, so a process that sees the new marker finds the year
+            marker_path = self.marker_path()
+            with open(marker_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(json.dumps(sorted(years + [year])))
+            os.replace(marker_path + ".tmp", marker_path)
+
+    def update(self, entries):
+        """Applies changed entries (None = deleted) of archived years."""
+        by_year = {}
+        for date_key, entry in entries.items():
+            by_year.setdefault(int(date_key[:4]), {})[date_key] = entry
+        for year, changes in by_year.items():
+            merged = dict(self.year_entries(year))
+            for date_key, entry in changes.items():
+                if entry is None:
+                    merged.pop(date_key, None)
+                else:
+                    merged[date_key] = entry
+            self.write_year(year, merged)
@@ -0,0 +1,167 @@
+"""Pre-encoded image assets served from a byte-budgeted in-process cache.
+
+Source images (the elf pets and potions) are resized once to the size they
+are displayed at and encoded as PNG; pages then only copy bytes. Several
+small images can be packed into one sprite sheet so a page sends a single
+image and positions each sprite with CSS.
+
+Every cached value is keyed by the asset name plus the content hash of its
+source file(s). `AssetPipeline.get()` re-stats the sources on each call and
+only re-reads and re-hashes a file whose size or mtime changed, so editing an
+image on disk swaps in the new version without manual cache busting.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Encoded pet images and the potion sprite sheet of one process
+ASSET_CACHE_BUDGET_BYTES = 4 * 1024 * 1024
+
+
+class ByteCache:
+    """Thread-safe LRU cache of bytes values bounded by their total size."""
+
+    def __init__(self, budget_bytes=ASSET_CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.metrics["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.metrics["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """Stores `value`; values larger than the whole budget are not cached."""
+        if len(value) > self.budget_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size_bytes -= len(old)
+            self._items[key] = value
+            self.size_bytes += len(value)
+            while self.size_bytes > self.budget_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.metrics["evictions"] += 1
+
+    def discard(self, predicate):
+        """Drops every entry whose key matches `predicate` (stale asset versions)."""
+        with self._lock:
+            for key in [k for k in self._items if predicate(k)]:
+                self.size_bytes -= len(self._items.pop(key))
+
+
+def _fit(image, size):
+    """`image` scaled to fit `size` (width, height), centered on a transparent canvas."""
+    image = image.convert("RGBA")
+    image.thumbnail(size, Image.LANCZOS)
+    canvas = Image.new("RGBA", size, (0, 0, 0, 0))
+    canvas.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+    return canvas
+
+
+def _encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def resize_to_width(path, width):
+    """PNG bytes of the image at `path` scaled to `width` (aspect kept)."""
+    with Image.open(path) as image:
+        height = max(1, round(image.height * width / image.width))
+        return _encode_png(image.convert("RGBA").resize((width, height), Image.LANCZOS))
+
+
+def build_sprite_sheet(paths, cell):
+    """Packs images side by side into one PNG.
+
+    `paths` maps sprite names to files; each sprite is fitted into a `cell`
+    (width, height) box, in the order of `paths` (see `sprite_offsets`).
+    """
+    sheet = Image.new("RGBA", (cell[0] * len(paths), cell[1]), (0, 0, 0, 0))
+    for i, path in enumerate(paths.values()):
+        with Image.open(path) as image:
+            sheet.paste(_fit(image, cell), (i * cell[0], 0))
+    return _encode_png(sheet)
+
+
+class AssetPipeline:
+    """Named image assets, each either one resized image or a sprite sheet."""
+
+    def __init__(self, cache=None):
+        self.cache = cache or ByteCache()
+        self._specs = {}    # name -> ("image", path, width) | ("sprites", {sprite: path}, cell)
+        self._hashes = {}   # path -> ((size, mtime_ns), content hash)
+        self._lock = threading.Lock()
+
+    def add_image(self, name, path, width):
+        self._specs[name] = ("image", path, width)
+
+    def add_sprite_sheet(self, name, paths, cell):
+        self._specs[name] = ("sprites", dict(paths), tuple(cell))
+
+    def build_all(self):
+        """Encodes every registered asset now (call once at startup)."""
+        for name in self._specs:
+            self.get(name)
+
+    def get(self, name):
+        """PNG bytes of an asset, or None if a source file is missing."""
+        kind, source, size = self._specs[name]
+        paths = [source] if kind == "image" else list(source.values())
+        try:
+            version = "-".join(self._content_hash(p) for p in paths)
+        except FileNotFoundError:
+            return None
+        key = (name, version)
+        data = self.cache.get(key)
+        if data is None:
+            if kind == "image":
+                data = resize_to_width(source, size)
+            else:
+                data = build_sprite_sheet(source, size)
+            # Older versions of this asset can never be requested again
+            self.cache.discard(lambda k: k[0] == name and k[1] != version)
+            self.cache.put(key, data)
+        return data
+
+    def sprite_offsets(self, name):
+        """{sprite: x offset in pixels} within a sprite sheet."""
+        _, source, cell = self._specs[name]
+        return {sprite: i * cell[0] for i, sprite in enumerate(source)}
+
+    def data_uri(self, name):
+        data = self.get(name)
+        return None if data is None else "data:image/png;base64," + base64.b64encode(data).decode()
+
+    def _content_hash(self, path):
+        stat = os.stat(path)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            known = self._hashes.get(path)
+            if known and known[0] == fingerprint:
+                return known[1]
+        with open(path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+        with self._lock:
+            self._hashes[path] = (fingerprint, digest)
+        return digest
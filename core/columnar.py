@@ -0,0 +1,130 @@
+"""Columnar (NumPy) view of a diary for vectorized analytics.
+
+`DiaryColumns` stores one row per entry, sorted by date:
+
+* ``ordinals`` - int32 date ordinals
+* ``scores``   - float32 mood scores
+* ``moods``    - int8 index into `mood_emojis` (-1 for unknown moods)
+* ``tags``     - uint32 bitmask over `tag_names` (bit i = tag_names[i])
+* ``sentiments`` - float32 text sentiment in [-1, 1], NaN where unscored
+
+Building it is a single pass over the entry summaries; the app caches it per
+(user, diary content version) so analytics over many years of daily entries only
+pay for NumPy operations.
+"""
+
+import datetime
+
+import numpy as np
+
+
+class DiaryColumns:
+
+    def __init__(self, ordinals, scores, moods, tags, sentiments, mood_emojis, tag_names):
+        self.ordinals = ordinals
+        self.scores = scores
+        self.moods = moods
+        self.tags = tags
+        self.sentiments = sentiments
+        self.mood_emojis = list(mood_emojis)
+        self.tag_names = list(tag_names)
+
+    @classmethod
+    def from_summaries(cls, summaries, mood_emojis, tag_names):
+        """Builds the columns from Diary.summaries() rows: (date, mood, score, tags, sentiment)."""
+        mood_code = {m: i for i, m in enumerate(mood_emojis)}
+        tag_bit = {t: 1 << i for i, t in enumerate(tag_names)}
+        n = len(summaries)
+        ordinals = np.empty(n, dtype=np.int32)
+        scores = np.empty(n, dtype=np.float32)
+        moods = np.empty(n, dtype=np.int8)
+        tags = np.zeros(n, dtype=np.uint32)
+        sentiments = np.full(n, np.nan, dtype=np.float32)
+        for i, (date_key, mood, score, entry_tags, sentiment) in enumerate(summaries):
+            ordinals[i] = datetime.date.fromisoformat(date_key).toordinal()
+            scores[i] = score
+            moods[i] = mood_code.get(mood, -1)
+            bits = 0
+            for tag in entry_tags:
+                bits |= tag_bit.get(tag, 0)
+            tags[i] = bits
+            if sentiment is not None:
+                sentiments[i] = sentiment
+        return cls(ordinals, scores, moods, tags, sentiments, mood_emojis, tag_names)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def window(self, start_date, end_date):
+        """Row slice for start_date <= date <= end_date (binary search)."""
+        lo = np.searchsorted(self.ordinals, start_date.toordinal(), side="left")
+        hi = np.searchsorted(self.ordinals, end_date.toordinal(), side="right")
+        return slice(lo, hi)
+
+    def tag_matrix(self, rows=slice(None)):
+        """Boolean (entries x tags) matrix unpacked from the bitmasks."""
+        bits = np.arange(len(self.tag_names), dtype=np.uint32)
+        return ((self.tags[rows, None] >> bits) & 1).astype(bool)
+
+
+def blended_scores(columns, text_weight=0.3):
+    """Emoji score blended with the text sentiment (mapped onto 1-5).
+
+    Entries without a sentiment keep their emoji score.
+    """
+    text_scores = 3 + 2 * columns.sentiments
+    blended = (1 - text_weight) * columns.scores + text_weight * text_scores
+    return np.where(np.isnan(columns.sentiments), columns.scores, blended).astype(np.float32)
+
+
+def rolling_average(columns, window=7, start_date=None, end_date=None, values=None):
+    """Calendar-day rolling mean of the score (or of `values`, one per row).
+
+    Returns (dates, averages). Days without an entry don't count towards the
+    mean; averages are NaN where the whole window is empty.
+    """
+    values = columns.scores if values is None else values
+    if not len(columns):
+        return [], np.array([], dtype=np.float64)
+    start = start_date.toordinal() if start_date else int(columns.ordinals[0])
+    end = end_date.toordinal() if end_date else int(columns.ordinals[-1])
+    rows = slice(
+        np.searchsorted(columns.ordinals, start - window + 1, side="left"),
+        np.searchsorted(columns.ordinals, end, side="right"),
+    )
+    span = end - start + window
+    offsets = columns.ordinals[rows] - (start - window + 1)
+    sums = np.bincount(offsets, weights=values[rows], minlength=span)
+    counts = np.bincount(offsets, minlength=span).astype(np.float64)
+    kernel = np.ones(window)
+    window_sums = np.convolve(sums, kernel, mode="valid")
+    window_counts = np.convolve(counts, kernel, mode="valid")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        averages = window_sums / window_counts
+    dates = [datetime.date.fromordinal(o) for o in range(start, end + 1)]
+    return dates, averages
+
+
+def tag_mood_stats(columns):
+    """Per-tag statistics: {tag: {"count", "mean_score", "mood_counts"}}.
+
+    Computed with one matrix product of the tag matrix and the one-hot mood
+    matrix; tags that were never logged are left out.
+    """
+    matrix = columns.tag_matrix().astype(np.float64)
+    counts = matrix.sum(axis=0)
+    score_sums = matrix.T @ columns.scores.astype(np.float64)
+    valid = columns.moods >= 0
+    one_hot = np.zeros((len(columns), len(columns.mood_emojis)))
+    one_hot[np.nonzero(valid)[0], columns.moods[valid]] = 1
+    co_counts = matrix.T @ one_hot
+    stats = {}
+    for i, tag in enumerate(columns.tag_names):
+        if not counts[i]:
+            continue
+        stats[tag] = {
+            "count": int(counts[i]),
+            "mean_score": float(score_sums[i] / counts[i]),
+            "mood_counts": {m: int(c) for m, c in zip(columns.mood_emojis, co_counts[i]) if c},
+        }
+    return stats
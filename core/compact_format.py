@@ -0,0 +1,241 @@
+"""Compact binary snapshot format for user documents (``diary_<name>.mjd``).
+
+A JSON snapshot repeats every date key, mood emoji, tag name and stored
+response string in full, pretty-printed. The compact format stores the
+entries column by column instead:
+
+* dates as day-ordinal deltas,
+* moods, tags and response strings as small integer codes into tables
+  stored once in the file (seeded from the app's moods and tags, so their
+  codes are stable),
+* entry texts back to back,
+
+and compresses the whole body with zlib. Entry keys other than the five
+common ones (e.g. ``sentiment``), a score that isn't a number (e.g. None)
+and the top-level fields are kept as JSON inside the compressed body, so any
+document round-trips exactly.
+
+Layout: ``MAGIC``, then a little-endian u16 schema version and u32 body
+length, then the zlib-compressed body. The body is a sequence of sections,
+each a u32 length followed by its bytes, in the order of `SECTIONS`.
+Readers refuse schema versions they don't know (`CompactFormatError`).
+
+`CompactCodec` plugs into `JournalLog` as the snapshot codec. A user who
+still has a JSON snapshot is migrated on first load (see `JournalLog`).
+"""
+
+import datetime
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"MJDC"
+SCHEMA_VERSION = 1
+HEADER = struct.Struct("<4sHI")  # magic, schema version, body length
+SECTION_LENGTH = struct.Struct("<I")
+# Level 1 is ~3x faster to write than zlib's default 6, for files ~20% larger
+COMPRESSION_LEVEL = 1
+SECTIONS = ("meta", "ordinals", "presence", "moods", "scores", "tag_counts", "tags",
+            "responses", "text_lengths", "texts", "extras")
+
+# Presence bits: which of the common keys an entry has
+HAS_MOOD, HAS_TEXT, HAS_RESPONSE, HAS_SCORE, HAS_TAGS, FLOAT_SCORE = 1, 2, 4, 8, 16, 32
+COMMON_KEYS = ("mood", "text", "response", "score", "tags")
+
+
+class CompactFormatError(ValueError):
+    """The file is not a compact snapshot this version can read."""
+
+
+def _pack(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _coder(table):
+    """A function giving the code of a value in `table` (a list), appending new values."""
+    codes = {value: i for i, value in enumerate(table)}
+
+    def code(value):
+        i = codes.get(value)
+        if i is None:
+            i = codes[value] = len(table)
+            table.append(value)
+        return i
+    return code
+
+
+def encode_document(doc, moods=(), tags=(), level=COMPRESSION_LEVEL):
+    """Compact bytes of a user document ({fields..., "diary": {date: entry}})."""
+    entries = doc.get("diary", {})
+    mood_table, tag_table, response_table = list(moods), list(tags), [""]
+    mood_code, tag_code, response_code = _coder(mood_table), _coder(tag_table), _coder(response_table)
+    ordinals, presence, mood_codes, scores = [], [], [], []
+    tag_counts, tag_codes, response_codes, text_lengths, texts, extras = [], [], [], [], [], []
+    previous = 0
+    for i, date_key in enumerate(sorted(entries)):
+        entry = entries[date_key]
+        ordinal = datetime.date.fromisoformat(date_key).toordinal()
+        ordinals.append(ordinal - previous)
+        previous = ordinal
+        bits = 0
+        if "mood" in entry:
+            bits |= HAS_MOOD
+        mood_codes.append(mood_code(entry.get("mood")))
+        text = entry.get("text")
+        if text is not None:
+            bits |= HAS_TEXT
+        text_lengths.append(len(text or ""))
+        texts.append(text or "")
+        if "response" in entry:
+            bits |= HAS_RESPONSE
+        response_codes.append(response_code(entry.get("response")))
+        score = entry.get("score")
+        numeric_score = isinstance(score, (int, float)) and not isinstance(score, bool)
+        if numeric_score:
+            bits |= HAS_SCORE | (FLOAT_SCORE if isinstance(score, float) else 0)
+        scores.append(score if numeric_score else 0)
+        entry_tags = entry.get("tags", [])
+        if "tags" in entry:
+            bits |= HAS_TAGS
+        tag_counts.append(len(entry_tags))
+        tag_codes.extend(tag_code(tag) for tag in entry_tags)
+        presence.append(bits)
+        extra = {k: v for k, v in entry.items() if k not in COMMON_KEYS}
+        if "score" in entry and not numeric_score:
+            # No HAS_SCORE bit: the score column holds a placeholder
+            extra["score"] = score
+        if extra or (text is None and "text" in entry):
+            extras.append([i, extra, "text" in entry])
+    meta = {
+        "fields": {k: v for k, v in doc.items() if k != "diary"},
+        "count": len(ordinals),
+        "moods": mood_table,
+        "tags": tag_table,
+        "responses": response_table,
+    }
+    sections = [
+        json.dumps(meta, ensure_ascii=False).encode("utf-8"),
+        _pack("i", ordinals),
+        _pack("B", presence),
+        _pack("H", mood_codes),
+        _pack("d", scores),
+        _pack("H", tag_counts),
+        _pack("H", tag_codes),
+        _pack("I", response_codes),
+        _pack("I", text_lengths),
+        "".join(texts).encode("utf-8"),
+        json.dumps(extras, ensure_ascii=False).encode("utf-8"),
+    ]
+    body = b"".join(SECTION_LENGTH.pack(len(s)) + s for s in sections)
+    return HEADER.pack(MAGIC, SCHEMA_VERSION, len(body)) + zlib.compress(body, level)
+
+
+def decode_document(data):
+    """The user document stored in compact bytes."""
+    if len(data) < HEADER.size:
+        raise CompactFormatError("file is too short")
+    magic, version, body_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CompactFormatError("not a compact diary snapshot")
+    if version != SCHEMA_VERSION:
+        raise CompactFormatError(f"unsupported schema version {version}")
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error as e:
+        raise CompactFormatError(f"corrupt body: {e}") from e
+    if len(body) != body_length:
+        raise CompactFormatError("body length does not match the header")
+    sections, position = {}, 0
+    for name in SECTIONS:
+        (length,) = SECTION_LENGTH.unpack_from(body, position)
+        position += SECTION_LENGTH.size
+        sections[name] = body[position:position + length]
+        position += length
+
+    meta = json.loads(sections["meta"])
+    mood_table, tag_table, response_table = meta["moods"], meta["tags"], meta["responses"]
+    ordinals = _unpack("i", sections["ordinals"])
+    presence = _unpack("B", sections["presence"])
+    mood_codes = _unpack("H", sections["moods"])
+    scores = _unpack("d", sections["scores"])
+    tag_counts = _unpack("H", sections["tag_counts"])
+    tag_codes = _unpack("H", sections["tags"])
+    response_codes = _unpack("I", sections["responses"])
+    text_lengths = _unpack("I", sections["text_lengths"])
+    texts = sections["texts"].decode("utf-8")  # lengths are in characters
+    if not len(ordinals) == len(presence) == len(scores) == meta["count"]:
+        raise CompactFormatError("column lengths do not match")
+
+    entries = {}
+    fromordinal = datetime.date.fromordinal
+    common = HAS_MOOD | HAS_TEXT | HAS_RESPONSE | HAS_SCORE | HAS_TAGS
+    ordinal = tag_position = text_position = 0
+    for i, bits in enumerate(presence):
+        ordinal += ordinals[i]
+        text_end = text_position + text_lengths[i]
+        tag_end = tag_position + tag_counts[i]
+        if bits == common:
+            # Fast path: what the app writes
+            entry = {
+                "mood": mood_table[mood_codes[i]],
+                "text": texts[text_position:text_end],
+                "response": response_table[response_codes[i]],
+                "score": int(scores[i]),
+                "tags": [tag_table[code] for code in tag_codes[tag_position:tag_end]],
+            }
+        else:
+            entry = {}
+            if bits & HAS_MOOD:
+                entry["mood"] = mood_table[mood_codes[i]]
+            if bits & HAS_TEXT:
+                entry["text"] = texts[text_position:text_end]
+            if bits & HAS_RESPONSE:
+                entry["response"] = response_table[response_codes[i]]
+            if bits & HAS_SCORE:
+                entry["score"] = scores[i] if bits & FLOAT_SCORE else int(scores[i])
+            if bits & HAS_TAGS:
+                entry["tags"] = [tag_table[code] for code in tag_codes[tag_position:tag_end]]
+        text_position, tag_position = text_end, tag_end
+        entries[fromordinal(ordinal).isoformat()] = entry
+    keys = list(entries)
+    for i, extra, had_text in json.loads(sections["extras"]):
+        entry = entries[keys[i]]
+        entry.update(extra)
+        if had_text and "text" not in entry:
+            entry["text"] = None
+
+    doc = meta["fields"]
+    doc["diary"] = entries
+    return doc
+
+
+class CompactCodec:
+    """Snapshot codec for JournalLog: compact binary ``.mjd`` files."""
+
+    suffix = ".mjd"
+    # ~6x smaller than the JSON snapshot, which parses to ~4x its size
+    parsed_size_factor = 24
+
+    def __init__(self, moods=(), tags=(), level=COMPRESSION_LEVEL):
+        self.moods = list(moods)
+        self.tags = list(tags)
+        self.level = level
+
+    def dumps(self, doc):
+        return encode_document(doc, self.moods, self.tags, self.level)
+
+    def loads(self, data):
+        return decode_document(data)
@@ -0,0 +1,190 @@
+"""Sessions and server processes that save the same user at the same time.
+
+Every tab keeps its own copy of a user's state and saves it whole, so two
+tabs (or two replicas behind a load balancer) used to overwrite each other's
+potions and points. Three pieces keep concurrent saves from losing data:
+
+* `FileLock` - a per-user advisory lock (``fcntl.flock`` on a ``.lock`` file),
+  so a save's check-and-write is atomic across threads *and* processes.
+  There is no global lock: users never wait for each other.
+* A version, stored with the data as the ``version`` field and, for cheap
+  polling, in a small ``.version`` file next to it::
+
+      {"number": 12, "writer": "<session>:<seq>", "merged": false}
+
+  `number` counts the writes, `writer` names the save that made the last
+  one, and `merged` says it had to be merged with a save it didn't know of.
+* Optimistic saves: a save carries the version it started from and the
+  fields as that session last saw them (its *base*). If the stored version
+  is another one, the store merges instead of overwriting: `merge_fields`
+  for the fields; entries are per date, so the other session's dates are
+  kept and a date both saved ends up with the later save.
+
+Sessions watch the version (`changed_elsewhere`) and reload lazily, on their
+next rerun, once someone else wrote.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process are serialized there
+    fcntl = None
+
+LOCK_SUFFIX = ".lock"
+VERSION_SUFFIX = ".version"
+
+
+class FileLock:
+    """Advisory lock on `path`: exclusive for writers, shared for readers.
+
+    Reentrant within a thread; a nested hold keeps the outer hold's mode, so
+    take the exclusive lock first when a block both reads and writes. Use
+    `get_lock()` for one instance per path, or reentrancy doesn't apply.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # Where flock is missing: readers and writers alike take this
+        self._thread_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def hold(self, shared=False):
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        if fcntl is None:
+            with self._thread_lock:
+                self._local.depth = 1
+                try:
+                    yield
+                finally:
+                    self._local.depth = 0
+            return
+        # One descriptor per hold: flock locks of two descriptors conflict even
+        # within a process, so threads are serialized too. Closing unlocks.
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            self._local.depth = 1
+            try:
+                yield
+            finally:
+                self._local.depth = 0
+        finally:
+            os.close(fd)
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_lock(path):
+    """Returns the process-wide FileLock for `path`."""
+    with _locks_lock:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = FileLock(path)
+        return lock
+
+
+def new_session_id():
+    return uuid.uuid4().hex[:12]
+
+
+def same_version(stored, base):
+    """True if `stored` is the version `base` was read or written as (None = never versioned)."""
+    stored, base = stored or {}, base or {}
+    return stored.get("writer") == base.get("writer") and bool(stored.get("merged")) == bool(base.get("merged"))
+
+
+def next_version(stored, writer, merged):
+    """The version of a write by `writer` that follows `stored`."""
+    return {"number": (stored or {}).get("number", 0) + 1, "writer": writer, "merged": merged}
+
+
+def versioned_fields(fields, base, stored, stored_fields):
+    """The fields an optimistic save writes, with their version after `stored`.
+
+    If someone else saved since `base` (the stored version is another one)
+    they are merged with `stored_fields()`, which is only called then.
+    Call with the user's lock held.
+    """
+    writer = fields["version"]["writer"]
+    merged = not same_version(stored, base["version"])
+    if merged:
+        fields = merge_fields(base["fields"], fields, stored_fields())
+    return dict(fields, version=next_version(stored, writer, merged))
+
+
+def merge_fields(base, mine, theirs):
+    """Three-way merge of top-level fields that `mine` and `theirs` both changed from `base`.
+
+    A field one side left as it was in `base` takes the other side's value.
+    When both changed it: numbers add up both changes (two tabs feeding the
+    elf spend two potions), dicts are merged key by key, anything else is
+    `mine`. Fields `base` doesn't hold can't be merged and become None, for
+    the reader to rebuild (e.g. aggregates of the entries).
+    """
+    merged = dict(theirs)
+    for key, value in mine.items():
+        merged[key] = merge_value(base[key], value, theirs.get(key)) if key in base else None
+    return merged
+
+
+def merge_value(base, mine, theirs):
+    if mine == base:
+        return theirs
+    if theirs == base or theirs is None:
+        return mine
+    if _is_number(mine) and _is_number(theirs) and (base is None or _is_number(base)):
+        return theirs + (mine - (base or 0))
+    if isinstance(mine, dict) and isinstance(theirs, dict) and isinstance(base or {}, dict):
+        base = base or {}
+        merged = dict(theirs)
+        for key, value in mine.items():
+            merged[key] = merge_value(base.get(key), value, theirs.get(key))
+        return merged
+    return mine
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def read_version(path):
+    """The version stored in a ``.version`` file, or None."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_version(path, version):
+    """Replaces a ``.version`` file atomically (call with the user's lock held)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(version))
+    os.replace(tmp_path, path)
+
+
+def changed_elsewhere(version, sync):
+    """True if the stored `version` holds a save the session of `sync` hasn't loaded.
+
+    The session's own saves don't count, unless they were merged with
+    someone else's. See core.user_state for `sync`.
+    """
+    if version is None or same_version(version, sync["loaded"]):
+        return False
+    own = (version.get("writer") or "").startswith(sync["session"] + ":")
+    return not own or bool(version.get("merged"))
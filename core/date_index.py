@@ -0,0 +1,100 @@
+"""Sorted index of logged dates (as ordinals) for streaks and range lookups."""
+
+import bisect
+import calendar
+import datetime
+
+
+def to_ordinal(date_key):
+    return datetime.date.fromisoformat(date_key).toordinal()
+
+
+def to_key(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+
+class DateIndex:
+    """Sorted, de-duplicated list of logged date ordinals.
+
+    Range queries are two bisects plus a slice (O(log n + k)). The current
+    streak is cached per day and only recomputed after the index changes;
+    recomputing is itself O(log n), see `run_length`.
+    """
+
+    def __init__(self, date_keys=()):
+        self._ordinals = sorted({to_ordinal(k) for k in date_keys})
+        self._streak_cache = None  # (today ordinal, streak)
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def __contains__(self, ordinal):
+        i = bisect.bisect_left(self._ordinals, ordinal)
+        return i < len(self._ordinals) and self._ordinals[i] == ordinal
+
+    def add(self, date_key):
+        ordinal = to_ordinal(date_key)
+        i = bisect.bisect_left(self._ordinals, ordinal)
+        if i == len(self._ordinals) or self._ordinals[i] != ordinal:
+            self._ordinals.insert(i, ordinal)
+            self._streak_cache = None
+
+    def remove(self, date_key):
+        ordinal = to_ordinal(date_key)
+        i = bisect.bisect_left(self._ordinals, ordinal)
+        if i < len(self._ordinals) and self._ordinals[i] == ordinal:
+            del self._ordinals[i]
+            self._streak_cache = None
+
+    def first(self):
+        """Oldest logged date key, or None."""
+        return to_key(self._ordinals[0]) if self._ordinals else None
+
+    # --- Range queries ---
+
+    def ordinals_between(self, start_ordinal, end_ordinal):
+        lo = bisect.bisect_left(self._ordinals, start_ordinal)
+        hi = bisect.bisect_right(self._ordinals, end_ordinal, lo)
+        return self._ordinals[lo:hi]
+
+    def keys_between(self, start_key, end_key):
+        """Logged date keys with start_key <= date <= end_key, oldest first."""
+        return [to_key(o) for o in self.ordinals_between(to_ordinal(start_key), to_ordinal(end_key))]
+
+    def last_days(self, n, end_date):
+        """Logged date keys in the n days ending at `end_date` (inclusive)."""
+        end = end_date.toordinal()
+        return [to_key(o) for o in self.ordinals_between(end - n + 1, end)]
+
+    def month(self, year, month):
+        """Logged date keys of one calendar month."""
+        first = datetime.date(year, month, 1).toordinal()
+        return [to_key(o) for o in self.ordinals_between(first, first + calendar.monthrange(year, month)[1] - 1)]
+
+    # --- Streaks ---
+
+    def run_length(self, ordinal):
+        """Number of consecutive logged days ending at `ordinal` (0 if not logged)."""
+        i = bisect.bisect_left(self._ordinals, ordinal)
+        if i == len(self._ordinals) or self._ordinals[i] != ordinal:
+            return 0
+        # ordinals[j] - j never decreases, and is constant exactly over the run
+        # of consecutive days ending at i, so its start can be binary-searched.
+        target = ordinal - i
+        lo, hi = 0, i
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ordinals[mid] - mid < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return i - lo + 1
+
+    def current_streak(self, today):
+        """Streak ending today, or ending yesterday if today isn't logged yet."""
+        today_ordinal = today.toordinal()
+        if self._streak_cache and self._streak_cache[0] == today_ordinal:
+            return self._streak_cache[1]
+        streak = self.run_length(today_ordinal) or self.run_length(today_ordinal - 1)
+        self._streak_cache = (today_ordinal, streak)
+        return streak
@@ -0,0 +1,319 @@
+"""The per-session view of one user's diary (date key -> entry dict)."""
+
+import bisect
+import sys
+from collections import Counter, OrderedDict
+from collections.abc import MutableMapping
+
+from core.aggregates import InsightAggregates
+from core.date_index import DateIndex
+from core.rollups import MoodRollups
+
+MIN_DATE_KEY = "0001-01-01"
+MAX_DATE_KEY = "9999-12-31"
+# Windowed diaries: how many entries from before the window stay cached after a read
+OLDER_ENTRIES_KEPT = 31
+# Rough in-memory sizes for memory_bytes(), measured with sys.getsizeof
+ENTRY_OVERHEAD_BYTES = 1200  # an entry dict without its text/response strings
+SUMMARY_ROW_BYTES = 250
+
+
+class Diary(MutableMapping):
+    """One user's diary entries, keyed by "YYYY-MM-DD".
+
+    A *complete* diary holds every entry in memory (what the JSON store hands
+    out). A *lazy* diary starts empty and asks its store for the rows a page
+    actually needs - a single date, a date range, the list of logged dates -
+    caching whatever it has read. Pages use `between()` and `stats()` instead
+    of iterating over values so both kinds stay cheap.
+
+    A *windowed* diary (``window_start`` given) is a lazy diary that loads
+    every entry on or after `window_start` up front and keeps the summaries
+    of all entries, but never accumulates older entries: the last
+    OLDER_ENTRIES_KEPT of them read are cached, the rest are read from the
+    store again when asked for. Session memory then depends on the window,
+    not on the length of the history; `memory_bytes()` estimates it. A store
+    that already has the window's entries passes them as `entries` (the JSON
+    store does for users with archived years, see core.archive).
+
+    `index` (a sorted DateIndex of the logged dates), `aggregates` (the
+    InsightAggregates counters) and `rollups` (weekly/monthly MoodRollups) are
+    built on first use and kept up to date by every assignment/deletion; the
+    rollups are read from the store's bucket records if it keeps them.
+    `content_version` identifies the entries the diary holds (see
+    core.user_state); caches of derived data shared between sessions key on
+    (user, content_version).
+    """
+
+    def __init__(self, store, user_name, entries=None, window_start=None):
+        self.store = store
+        self.user_name = user_name
+        self.complete = entries is not None and window_start is None
+        self.window_start = window_start
+        self._entries = entries if entries is not None else {}
+        if window_start is not None and entries is None:
+            self._entries = dict(store.entries_between(user_name, window_start, MAX_DATE_KEY))
+        self._older = OrderedDict()  # windowed: recently read entries before the window
+        self._summaries = None  # windowed: cached summaries() rows
+        self._resident_bytes = None
+        self._missing = set()
+        self._dates = None  # lazy diaries: cached sorted list of logged dates
+        self._index = None
+        self._aggregates = None
+        self._rollups = None
+        self.content_version = None
+
+    # --- Mapping protocol ---
+
+    def __getitem__(self, date_key):
+        if date_key in self._entries:
+            return self._entries[date_key]
+        if date_key in self._older:
+            self._older.move_to_end(date_key)
+            return self._older[date_key]
+        if self.complete or date_key in self._missing or self._in_window(date_key):
+            raise KeyError(date_key)
+        entry = self.store.get_entry(self.user_name, date_key)
+        if entry is None:
+            self._missing.add(date_key)
+            raise KeyError(date_key)
+        self._hold(date_key, entry)
+        return entry
+
+    def __setitem__(self, date_key, entry):
+        old_entry = self.get(date_key)
+        self.aggregates.apply(date_key, old_entry, entry)
+        if self._rollups is not None:
+            self._rollups.apply(date_key, old_entry, entry)
+        self._hold(date_key, entry)
+        self._update_summary(date_key, entry)
+        self._missing.discard(date_key)
+        if self._dates is not None:
+            i = bisect.bisect_left(self._dates, date_key)
+            if i == len(self._dates) or self._dates[i] != date_key:
+                self._dates.insert(i, date_key)
+        if self._index is not None:
+            self._index.add(date_key)
+
+    def __delitem__(self, date_key):
+        old_entry = self[date_key]  # raises KeyError for unknown dates
+        aggregates = self.aggregates
+        aggregates.apply(date_key, old_entry, None)
+        if self._rollups is not None:
+            self._rollups.apply(date_key, old_entry, None)
+        self._release(date_key)
+        self._update_summary(date_key, None)
+        self._missing.add(date_key)
+        if self._dates is not None:
+            self._dates.remove(date_key)
+        if self._index is not None:
+            self._index.remove(date_key)
+        if aggregates.first_entry_date is None:
+            aggregates.first_entry_date = self.index.first()
+
+    def __iter__(self):
+        if self.complete:
+            return iter(self._entries)
+        return iter(self.dates())
+
+    def __len__(self):
+        if self.complete:
+            return len(self._entries)
+        return len(self.dates())
+
+    # --- Entries held in memory ---
+
+    def _in_window(self, date_key):
+        """True if `date_key` is inside the window, which is always fully loaded."""
+        return self.window_start is not None and date_key >= self.window_start
+
+    def _hold(self, date_key, entry):
+        """Keeps an entry in memory: in the LRU of older reads if it is before the window."""
+        if self.window_start is not None and date_key < self.window_start:
+            self._release(date_key)
+            self._older[date_key] = entry
+            if len(self._older) > OLDER_ENTRIES_KEPT:
+                self._release(next(iter(self._older)))
+        else:
+            old_entry = self._entries.get(date_key)
+            if old_entry is not None and self._resident_bytes is not None:
+                self._resident_bytes -= entry_size(old_entry)
+            self._entries[date_key] = entry
+        if self._resident_bytes is not None:
+            self._resident_bytes += entry_size(entry)
+
+    def _release(self, date_key):
+        entry = self._older.pop(date_key, None)
+        if entry is None:
+            entry = self._entries.pop(date_key, None)
+        if entry is not None and self._resident_bytes is not None:
+            self._resident_bytes -= entry_size(entry)
+
+    def _update_summary(self, date_key, entry):
+        if self._summaries is None:
+            return
+        i = bisect.bisect_left(self._summaries, (date_key,))
+        found = i < len(self._summaries) and self._summaries[i][0] == date_key
+        if entry is None:
+            if found:
+                del self._summaries[i]
+        elif found:
+            self._summaries[i] = summary_row(date_key, entry)
+        else:
+            self._summaries.insert(i, summary_row(date_key, entry))
+
+    def memory_bytes(self):
+        """Estimated bytes of diary data held by this session (entries + cached summaries)."""
+        if self._resident_bytes is None:
+            self._resident_bytes = sum(entry_size(e) for e in self._entries.values())
+            self._resident_bytes += sum(entry_size(e) for e in self._older.values())
+        return self._resident_bytes + SUMMARY_ROW_BYTES * len(self._summaries or ())
+
+    # --- Range queries ---
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = DateIndex(self._entries if self.complete else self.dates())
+        return self._index
+
+    def dates(self):
+        """All logged date keys, oldest first."""
+        if self.complete:
+            return sorted(self._entries)
+        if self._dates is None:
+            self._dates = list(self.store.entry_dates(self.user_name))
+        return self._dates
+
+    def between(self, start_key, end_key):
+        """Entries with start_key <= date <= end_key, oldest first."""
+        if self.complete:
+            return {d: self._entries[d] for d in self.index.keys_between(start_key, end_key)}
+        if self._in_window(start_key):
+            return {d: self._entries[d] for d in sorted(self._entries) if start_key <= d <= end_key}
+        rows = self.store.entries_between(self.user_name, start_key, end_key)
+        if self.window_start is None:
+            for date_key, entry in rows.items():
+                self._hold(date_key, entry)
+        return rows
+
+    def stats(self):
+        """Insight counters recounted from the raw entries: see `compute_stats`."""
+        if self.complete:
+            return compute_stats(self._entries)
+        return self.store.stats(self.user_name)
+
+    def summaries(self):
+        """[(date, mood, score, tags, sentiment)] for every entry, oldest first (no text)."""
+        if self.complete:
+            return summarize_entries(self._entries)
+        if self.window_start is None:
+            return self.store.entry_summaries(self.user_name)
+        if self._summaries is None:
+            self._summaries = list(self.store.entry_summaries(self.user_name))
+        return list(self._summaries)
+
+    def search(self, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+        """[(date, score)] of the best matching entries, from the store's search index."""
+        return self.store.search(self.user_name, query, tags, moods, start_key, end_key, limit)
+
+    # --- Insight aggregates ---
+
+    @property
+    def aggregates(self):
+        if self._aggregates is None:
+            self._aggregates = InsightAggregates.from_stats(self.stats())
+        return self._aggregates
+
+    def load_aggregates(self, data):
+        """Adopts persisted aggregates, unless they obviously don't match the entries."""
+        if data and data.get("total_entries") == len(self):
+            self._aggregates = InsightAggregates.from_dict(data)
+        else:
+            self._aggregates = None
+
+    @property
+    def rollups(self):
+        if self._rollups is None:
+            records = self.store.rollup_records(self.user_name) if self.store is not None else None
+            rollups = MoodRollups.from_records(records) if records else None
+            # The stored buckets can miss this session's latest edits (e.g. a queued save)
+            if rollups is None or rollups.total_entries() != len(self):
+                rollups = MoodRollups.from_summaries(self.summaries())
+            self._rollups = rollups
+        return self._rollups
+
+    def verify_aggregates(self, repair=True):
+        """Checks the aggregates against a full recount; optionally rebuilds them.
+
+        Returns the names of the fields that had drifted.
+        """
+        stats = self.stats()
+        mismatched = self.aggregates.verify(stats)
+        if mismatched and repair:
+            self._aggregates = InsightAggregates.from_stats(stats)
+        return mismatched
+
+
+def date_index_of(diary):
+    """The DateIndex of a Diary, or a fresh one for a plain dict."""
+    if isinstance(diary, Diary):
+        return diary.index
+    return DateIndex(diary)
+
+
+def calculate_streak(diary, today):
+    """The current run of consecutive logged days (see DateIndex.current_streak)."""
+    if not diary:
+        return 0
+    return date_index_of(diary).current_streak(today)
+
+
+def entries_between(diary, start_key, end_key):
+    """`Diary.between` that also accepts a plain dict."""
+    if isinstance(diary, Diary):
+        return diary.between(start_key, end_key)
+    return {d: diary[d] for d in sorted(diary) if start_key <= d <= end_key}
+
+
+def compute_stats(entries):
+    """Counts used by the insight page, computed from a dict of entries.
+
+    Returns total_entries, first_entry_date, mood_counts (emoji -> n),
+    tag_counts (tag -> n) and mood_tag_counts (emoji -> tag -> n).
+    """
+    mood_counts = Counter()
+    tag_counts = Counter()
+    mood_tag_counts = {}
+    for entry in entries.values():
+        mood = entry.get("mood")
+        tags = entry.get("tags", [])
+        mood_counts[mood] += 1
+        tag_counts.update(tags)
+        mood_tag_counts.setdefault(mood, Counter()).update(tags)
+    return {
+        "total_entries": len(entries),
+        "first_entry_date": min(entries) if entries else None,
+        "mood_counts": mood_counts,
+        "tag_counts": tag_counts,
+        "mood_tag_counts": mood_tag_counts,
+    }
+
+
+def summary_row(date_key, entry):
+    """(date, mood, score, tags, sentiment) of one entry.
+
+    `sentiment` is the stored text sentiment in [-1, 1], or None if unscored.
+    """
+    return (date_key, entry.get("mood"), entry.get("score", 3), entry.get("tags", []),
+            (entry.get("sentiment") or {}).get("sentiment"))
+
+
+def summarize_entries(entries):
+    """The summary_row() of every entry in a dict of entries, oldest first."""
+    return [summary_row(d, entries[d]) for d in sorted(entries)]
+
+
+def entry_size(entry):
+    """Rough in-memory size of an entry: a fixed overhead plus its strings."""
+    return ENTRY_OVERHEAD_BYTES + sum(sys.getsizeof(v) for v in entry.values() if isinstance(v, str))
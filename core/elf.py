@@ -0,0 +1,105 @@
+"""Mood Elf game rules, on a plain ``elf_state`` dict.
+
+The state is stored with the user data (``elf_state`` field)::
+
+    {"available_potions": {emotion: n}, "emotion_counts": {emotion: n},
+     "total_feeds": n, "evolution_threshold": n, "evolved": bool,
+     "daily_potion_count": n, "last_potion_date": "YYYY-MM-DD"}
+
+Functions change the state in place and return the notices to show the
+user as (message, icon) pairs; showing them, and saving, is up to the caller.
+"""
+
+ELF_EMOTIONS = ("happy", "sad", "angry", "calm", "excited", "tired", "anxious")
+ELF_EVOLUTION_THRESHOLD = 30  # Pet evolution threshold
+ELF_INITIAL_POTIONS = 5  # User request: 5 potions initially
+MAX_DAILY_POTION_ENTRIES = 5  # Max potions granted per day
+
+# Mood emoji to elf emotion name
+EMOJI_TO_ELF_NAME = {
+    "😀": "happy", "😢": "sad", "😡": "angry", "😌": "calm",
+    "🤩": "excited", "😴": "tired", "😥": "anxious",
+}
+
+
+def create_initial_elf_state(today):
+    """The elf state of a new user (or of one whose state was lost)."""
+    return {
+        "available_potions": {e: ELF_INITIAL_POTIONS for e in ELF_EMOTIONS},
+        "emotion_counts": {e: 0 for e in ELF_EMOTIONS},
+        "total_feeds": 0,
+        "evolution_threshold": ELF_EVOLUTION_THRESHOLD,
+        "evolved": False,
+        # Daily potion logging
+        "daily_potion_count": 0,
+        "last_potion_date": today.isoformat(),
+    }
+
+
+def reset_daily_potions(elf_state, today):
+    """Starts a new daily potion count if the last potion was granted before `today`."""
+    today_str = today.isoformat()
+    if elf_state.get("last_potion_date") != today_str:
+        elf_state["daily_potion_count"] = 0
+        elf_state["last_potion_date"] = today_str
+
+
+def evolution_type(elf_state):
+    """"EGG", or the capitalized emotion the evolved pet was fed most."""
+    if not elf_state["evolved"]:
+        return "EGG"
+    max_feed_count = -1
+    pet_type = "Happy"  # Default pet type
+    for emotion, count in elf_state["emotion_counts"].items():
+        if count > max_feed_count:
+            max_feed_count = count
+            pet_type = emotion.capitalize()
+    # Evolved without any feed (a wrongly set flag): keep the default pet
+    if max_feed_count == 0:
+        return "Happy"
+    return pet_type
+
+
+def feed(elf_state, emotion):
+    """Feeds one potion of `emotion`. Returns (notices, evolved_now)."""
+    if elf_state["evolved"]:
+        return [("The Mood Elf has already evolved! No more feeding allowed.", "✨")], False
+    emotion_name = emotion.lower()
+    notices = []
+    if elf_state["available_potions"][emotion_name] > 0:
+        elf_state["available_potions"][emotion_name] -= 1
+        elf_state["emotion_counts"][emotion_name] += 1
+        elf_state["total_feeds"] += 1
+        notices.append((f"Successfully fed {emotion_name.capitalize()} Potion! 🧪", "😋"))
+    else:
+        notices.append((f"❌ {emotion_name.capitalize()} Potion ran out! Log your mood to get more.", "😔"))
+    evolved_now = elf_state["total_feeds"] >= elf_state["evolution_threshold"]
+    if evolved_now:
+        elf_state["evolved"] = True
+        notices.append(("Your Mood Elf evolved!", "🎈"))
+    return notices, evolved_now
+
+
+def grant_potion(elf_state, mood_emoji, today):
+    """Grants a potion for a logged mood, within the daily limit.
+
+    Returns (capitalized potion name, True), or (None, False) if none was granted.
+    """
+    reset_daily_potions(elf_state, today)
+    if elf_state["daily_potion_count"] < MAX_DAILY_POTION_ENTRIES:
+        mood_name = EMOJI_TO_ELF_NAME.get(mood_emoji)
+        if mood_name:
+            elf_state["available_potions"][mood_name] += 1
+            elf_state["daily_potion_count"] += 1
+            return mood_name.capitalize(), True
+    return None, False
+
+
+def reset_evolution(elf_state):
+    """Turns the pet back into an egg; potion stock is kept. Returns the notices."""
+    elf_state.update({
+        "emotion_counts": {e: 0 for e in ELF_EMOTIONS},
+        "total_feeds": 0,
+        "evolved": False,
+    })
+    return [("Mood Elf has been reset to an Egg! Potions remain the same.", "🥚")]
@@ -0,0 +1,444 @@
+"""Random-access copy of a user's diary: entry records plus an mmap'd date index.
+
+Reading one past day from ``diary_<name>.json`` means parsing the whole file.
+An entry file keeps the same data in a layout that can be read entry by
+entry:
+
+* ``diary_<name>.entries`` - records appended one after another, each
+  ``<key>\\t<json>\\n``. The key is the date of an entry (a ``null`` value
+  records a deletion) or ``fields`` for the top-level fields.
+* ``diary_<name>.entries.idx`` - a header followed by one fixed-size slot
+  ``(offset, length)`` per calendar day from the header's ``base`` date. A
+  length of 0 means no entry. The file is memory-mapped.
+
+A single entry is one slot lookup plus one read of its record, and a month is
+31 consecutive slots, whatever the size of the diary. Saves append the new
+records and rewrite a few slots. The file is compacted (rewritten in date
+order) once most of it is superseded records.
+
+The entry file is derived data: its header records the journal position
+(`JournalLog.position()`) it is up to date with. A stale one catches up by
+applying the records since then (`JournalLog.records_since()`); it is only
+rebuilt from the whole document if they were compacted away. Integrity checks:
+
+* the header has a CRC and must match the size of both files; records
+  appended after the last header update (crash) are picked up by
+  `rebuild_index()`, which rescans the data file;
+* every record read must carry the key its slot was looked up for, otherwise
+  the index is rebuilt once and the read retried;
+* an unreadable entry file is rebuilt from the whole document by the store
+  (`JsonDiaryStore`).
+
+Run ``python -m core.entry_file --verify diary_<name>.entries`` to check every
+slot, or ``--rebuild-index`` to rescan the data file.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from core.date_index import to_key, to_ordinal
+
+ENTRIES_SUFFIX = ".entries"
+INDEX_SUFFIX = ".idx"
+FIELDS_KEY = "fields"
+MAGIC = b"MJENTRY2"
+# magic, base ordinal, slots, data size, live bytes, fields offset, fields length,
+# journal id, journal offset, crc
+HEADER = struct.Struct("<8sIIQQQIQQI")
+SLOT = struct.Struct("<QI")  # offset, length
+# Free slots kept after the last entry, so new days don't resize the index
+SLOT_MARGIN_DAYS = 366
+COMPACT_MIN_BYTES = 256 * 1024
+# Journal ids are 1 to 2**62 (0: a journal without a header), so no journal has this one
+UNKNOWN_JOURNAL_ID = 2 ** 64 - 1
+
+IndexHeader = collections.namedtuple(
+    "IndexHeader", "base slots data_size live_bytes fields_offset fields_length journal_id journal_offset"
+)
+
+
+class CorruptEntryFile(Exception):
+    """The index does not match the data file."""
+
+
+def encode_record(key, value):
+    return f"{key}\t{json.dumps(value, ensure_ascii=False)}\n".encode("utf-8")
+
+
+def pack_header(header):
+    packed = HEADER.pack(MAGIC, *header, 0)
+    return packed[:-4] + struct.pack("<I", zlib.crc32(packed[:-4]))
+
+
+def unpack_header(buffer):
+    if len(buffer) < HEADER.size:
+        raise CorruptEntryFile("index file is too short")
+    magic, *values, crc = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or zlib.crc32(buffer[:HEADER.size - 4]) != crc:
+        raise CorruptEntryFile("bad index header")
+    return IndexHeader(*values)
+
+
+class EntryFile:
+    """The entry file of one user; safe to share between threads."""
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.index_path = data_path + INDEX_SUFFIX
+        self._lock = threading.RLock()
+        self._map = None     # mmap of the index file
+        self._data = None    # data file opened for reading
+        self._header = None
+        self._index_inode = None
+
+    # --- Opening and integrity ---
+
+    def position(self):
+        """The journal position the entry file is up to date with, or None if it is missing or unreadable."""
+        with self._lock:
+            self._refresh()
+            try:
+                self._open()
+            except (OSError, ValueError, CorruptEntryFile):
+                self._close()
+                return None
+            return self._header.journal_id, self._header.journal_offset
+
+    def _refresh(self):
+        """Closes the files if another process has updated or rewritten them since they were opened."""
+        if self._map is None:
+            return
+        try:
+            changed = (os.stat(self.index_path).st_ino != self._index_inode
+                       or unpack_header(self._map) != self._header)
+        except (OSError, CorruptEntryFile):
+            changed = True
+        if changed:
+            self._close()
+
+    def _open(self):
+        if self._map is not None:
+            return
+        with open(self.index_path, "r+b") as f:
+            index_map = mmap.mmap(f.fileno(), 0)
+            self._index_inode = os.fstat(f.fileno()).st_ino
+        try:
+            header = unpack_header(index_map)
+            if len(index_map) != HEADER.size + header.slots * SLOT.size:
+                raise CorruptEntryFile("index size does not match its header")
+        except CorruptEntryFile:
+            index_map.close()
+            raise
+        self._map, self._header = index_map, header
+        self._data = open(self.data_path, "rb")
+        if os.fstat(self._data.fileno()).st_size != header.data_size:
+            # Records were appended after the last header update (crash in between)
+            self.rebuild_index()
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._header = None
+
+    def _set_header(self, **changes):
+        self._header = self._header._replace(**changes)
+        self._map[:HEADER.size] = pack_header(self._header)
+
+    def verify(self):
+        """Reads every record through the index; returns a list of problems (empty if fine)."""
+        problems = []
+        with self._lock:
+            try:
+                self._open()
+                if self._header.fields_length:
+                    self._record(FIELDS_KEY, self._header.fields_offset, self._header.fields_length)
+            except (OSError, ValueError, CorruptEntryFile) as e:
+                return [str(e)]
+            for ordinal, (offset, length) in self._slots(self._header.base, self._header.base + self._header.slots - 1):
+                try:
+                    self._record(to_key(ordinal), offset, length)
+                except (CorruptEntryFile, ValueError) as e:
+                    problems.append(f"{to_key(ordinal)}: {e}")
+        return problems
+
+    def rebuild_index(self):
+        """Rebuilds the index by scanning the data file (the last record of a key wins).
+
+        A torn last record is cut off. The journal position is kept if the
+        old header is still readable (the records it covers were all written
+        before it was).
+        """
+        with self._lock:
+            try:
+                with open(self.index_path, "rb") as f:
+                    header = unpack_header(f.read(HEADER.size))
+                journal_position = header.journal_id, header.journal_offset
+            except (OSError, CorruptEntryFile):
+                journal_position = None
+            self._close()
+            slots, fields_slot, position = {}, (0, 0), 0
+            with open(self.data_path, "r+b") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    key, _, value = line.partition(b"\t")
+                    record = (position, len(line))
+                    position += len(line)
+                    if key == FIELDS_KEY.encode():
+                        fields_slot = record
+                        continue
+                    try:
+                        ordinal = to_ordinal(key.decode())
+                    except ValueError:
+                        continue
+                    if value.strip() == b"null":
+                        slots.pop(ordinal, None)
+                    else:
+                        slots[ordinal] = record
+                f.truncate(position)
+            self._write_index(slots, position, fields_slot, journal_position)
+
+    # --- Reads ---
+
+    def get(self, date_key):
+        """The entry of one date, or None."""
+        with self._lock:
+            return self._retrying(self._get, date_key)
+
+    def between(self, start_key, end_key):
+        """{date: entry} for start_key <= date <= end_key, oldest first."""
+        with self._lock:
+            return self._retrying(self._between, start_key, end_key)
+
+    def dates(self):
+        """Every date with an entry, oldest first (from the index alone)."""
+        with self._lock:
+            self._open()
+            last = self._header.base + self._header.slots - 1
+            return [to_key(ordinal) for ordinal, _ in self._slots(self._header.base, last)]
+
+    def fields(self):
+        """The top-level fields, decoded (a fresh copy on every call)."""
+        with self._lock:
+            return self._retrying(self._fields)
+
+    def _retrying(self, read, *args):
+        self._open()
+        try:
+            return read(*args)
+        except CorruptEntryFile:
+            self.rebuild_index()
+            self._open()
+            return read(*args)
+
+    def _get(self, date_key):
+        i = to_ordinal(date_key) - self._header.base
+        if not 0 <= i < self._header.slots:
+            return None
+        offset, length = SLOT.unpack_from(self._map, HEADER.size + i * SLOT.size)
+        return self._record(date_key, offset, length) if length else None
+
+    def _between(self, start_key, end_key):
+        return {
+            to_key(ordinal): self._record(to_key(ordinal), offset, length)
+            for ordinal, (offset, length) in self._slots(to_ordinal(start_key), to_ordinal(end_key))
+        }
+
+    def _fields(self):
+        if not self._header.fields_length:
+            return {}
+        return self._record(FIELDS_KEY, self._header.fields_offset, self._header.fields_length)
+
+    def _slots(self, first, last):
+        """(ordinal, (offset, length)) of the used slots from `first` to `last` ordinal."""
+        base = self._header.base
+        first, last = max(first, base), min(last, base + self._header.slots - 1)
+        if first > last:
+            return []
+        raw = self._map[HEADER.size + (first - base) * SLOT.size:HEADER.size + (last - base + 1) * SLOT.size]
+        return [(first + i, slot) for i, slot in enumerate(SLOT.iter_unpack(raw)) if slot[1]]
+
+    def _record(self, key, offset, length):
+        self._data.seek(offset)
+        raw = self._data.read(length)
+        prefix = key.encode() + b"\t"
+        if len(raw) != length or not raw.startswith(prefix) or not raw.endswith(b"\n"):
+            raise CorruptEntryFile(f"record at {offset} is not the one of {key}")
+        return json.loads(raw[len(prefix):])
+
+    # --- Writes ---
+
+    def apply(self, fields, entries, old_position, new_position):
+        """Appends the journal records from `old_position` to `new_position` (changed
+        `fields` and `entries`, None = deleted).
+
+        Only applied if the entry file is at `old_position`; otherwise it is
+        left stale and catches up on the next read. Call with the journal's
+        file lock held.
+        """
+        with self._lock:
+            if self.position() != tuple(old_position):
+                return False
+            header = self._header
+            chunks, position = [], header.data_size
+            live_bytes = header.live_bytes
+            fields_slot = (header.fields_offset, header.fields_length)
+            current = self._fields()
+            merged = {**current, **fields}
+            if merged != current:
+                chunk = encode_record(FIELDS_KEY, merged)
+                live_bytes += len(chunk) - header.fields_length
+                fields_slot = (position, len(chunk))
+                chunks.append(chunk)
+                position += len(chunk)
+            slots = {}
+            for date_key, entry in entries.items():
+                chunk = encode_record(date_key, entry)
+                ordinal = to_ordinal(date_key)
+                live_bytes -= self._slot_length(ordinal)
+                if entry is None:
+                    slots[ordinal] = (0, 0)
+                else:
+                    slots[ordinal] = (position, len(chunk))
+                    live_bytes += len(chunk)
+                chunks.append(chunk)
+                position += len(chunk)
+            journal_id, journal_offset = new_position
+            if not chunks:
+                self._set_header(journal_id=journal_id, journal_offset=journal_offset)
+                return True
+            with open(self.data_path, "ab") as f:
+                f.write(b"".join(chunks))
+            if slots:
+                self._ensure_range(min(slots), max(slots))
+            for ordinal, slot in slots.items():
+                SLOT.pack_into(self._map, HEADER.size + (ordinal - self._header.base) * SLOT.size, *slot)
+            self._set_header(data_size=position, live_bytes=live_bytes, fields_offset=fields_slot[0],
+                             fields_length=fields_slot[1], journal_id=journal_id, journal_offset=journal_offset)
+            if position > 2 * live_bytes + COMPACT_MIN_BYTES:
+                self.compact()
+            return True
+
+    def rebuild(self, fields, entries, journal_position):
+        """Rewrites the entry file from a whole document (as of `journal_position`), in date order."""
+        with self._lock:
+            self._close()
+            self._write_all(fields, entries, journal_position)
+
+    def compact(self):
+        """Rewrites the live records in date order, dropping superseded ones."""
+        with self._lock:
+            self._open()
+            last = self._header.base + self._header.slots - 1
+            entries = self._between(to_key(self._header.base), to_key(last))
+            fields = self._fields()
+            journal_position = self._header.journal_id, self._header.journal_offset
+            self._close()
+            self._write_all(fields, entries, journal_position)
+
+    def _write_all(self, fields, entries, journal_position):
+        tmp_path = self.data_path + ".tmp"
+        slots = {}
+        with open(tmp_path, "wb") as f:
+            chunk = encode_record(FIELDS_KEY, fields)
+            f.write(chunk)
+            fields_slot, position = (0, len(chunk)), len(chunk)
+            for date_key in sorted(entries):
+                chunk = encode_record(date_key, entries[date_key])
+                f.write(chunk)
+                slots[to_ordinal(date_key)] = (position, len(chunk))
+                position += len(chunk)
+        os.replace(tmp_path, self.data_path)
+        self._write_index(slots, position, fields_slot, journal_position)
+
+    def _write_index(self, slots, data_size, fields_slot, journal_position):
+        """Writes a fresh index file for `slots` ({ordinal: (offset, length)}) and opens it.
+
+        A `journal_position` of None writes one no journal has, so the file
+        is caught up by a rebuild.
+        """
+        self._close()
+        base = min(slots) if slots else datetime.date.today().toordinal()
+        count = (max(slots) - base + 1 if slots else 0) + SLOT_MARGIN_DAYS
+        table = bytearray(count * SLOT.size)
+        for ordinal, slot in slots.items():
+            SLOT.pack_into(table, (ordinal - base) * SLOT.size, *slot)
+        live_bytes = sum(length for _, length in slots.values()) + fields_slot[1]
+        journal_id, journal_offset = journal_position or (UNKNOWN_JOURNAL_ID, 0)
+        header = IndexHeader(base, count, data_size, live_bytes, fields_slot[0], fields_slot[1],
+                             journal_id, journal_offset)
+        self._replace_index(pack_header(header) + table)
+
+    def _ensure_range(self, first, last):
+        """Grows the index so it has slots for ordinals `first` to `last`."""
+        header = self._header
+        if first >= header.base and last < header.base + header.slots:
+            return
+        base = min(first, header.base)
+        end = max(last + SLOT_MARGIN_DAYS, header.base + header.slots)
+        table = bytearray((end - base) * SLOT.size)
+        start = (header.base - base) * SLOT.size
+        table[start:start + header.slots * SLOT.size] = self._map[HEADER.size:]
+        header = header._replace(base=base, slots=end - base)
+        self._close()
+        self._replace_index(pack_header(header) + table)
+
+    def _replace_index(self, content):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, self.index_path)
+        self._open()
+
+    def _slot_length(self, ordinal):
+        i = ordinal - self._header.base
+        if not 0 <= i < self._header.slots:
+            return 0
+        return SLOT.unpack_from(self._map, HEADER.size + i * SLOT.size)[1]
+
+
+_entry_files = {}
+_entry_files_lock = threading.Lock()
+
+
+def get_entry_file(data_path):
+    """Returns the process-wide EntryFile for a data path (shared by all sessions)."""
+    with _entry_files_lock:
+        entry_file = _entry_files.get(data_path)
+        if entry_file is None:
+            entry_file = _entry_files[data_path] = EntryFile(data_path)
+        return entry_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or repair a diary entry file.")
+    parser.add_argument("data_path", help="path of a diary_<name>.entries file")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--verify", action="store_true", help="read every record through the index")
+    action.add_argument("--rebuild-index", action="store_true", help="rebuild the index from the data file")
+    args = parser.parse_args()
+    entry_file = EntryFile(args.data_path)
+    if args.rebuild_index:
+        entry_file.rebuild_index()
+        print(f"Rebuilt the index: {len(entry_file.dates())} entries.")
+        return
+    problems = entry_file.verify()
+    for problem in problems:
+        print(problem)
+    print("OK" if not problems else f"{len(problems)} problem(s)")
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
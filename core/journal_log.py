@@ -0,0 +1,391 @@
+"""Append-only journal for user data files.
+
+A user document lives in two places on disk:
+
+* ``diary_<name>.json`` - the snapshot, in the same format the app has always
+  written (so old files load unchanged). With a `CompactCodec`
+  (core.compact_format) it is ``diary_<name>.mjd`` instead, and a JSON
+  snapshot left from before is converted on first load.
+* ``diary_<name>.journal`` - one JSON record per line, appended on every save.
+
+Saving only appends the records that changed, so the cost of a save depends on
+the size of the change and not on the size of the history. Once the journal
+grows past ``COMPACT_EVERY_RECORDS`` records it is folded back into the
+snapshot on a background thread.
+
+Record types::
+
+    {"op": "set", "key": "total_points", "value": 20}
+    {"op": "entry", "date": "2024-05-01", "value": {...}}   # value None = delete
+    {"op": "batch", "records": [...]}                       # applied all-or-nothing
+    {"op": "journal", "id": 1234, "after": [987, 5120]}     # first line of a journal file
+
+The ``journal`` record names the file (a random id) and the journal file it
+follows, with that file's final size (None: it follows the snapshot alone).
+So (journal id, offset) is a position in the stream of records that survives
+compactions: `position()` is the current end, `records_since()` what came
+after an earlier one. Derived files (core.entry_file) catch up from there.
+Journals written before these records have id 0.
+
+Every append is a single line (several changes become one "batch" record)
+followed by an fsync. A crash mid-append leaves at most one torn last line,
+which is skipped on load, so a save is either fully applied or not at all.
+
+Several server processes can share the files: appends and the compaction's
+renames hold ``diary_<name>.lock`` exclusively and loads hold it shared
+(core.concurrency), and one process at a time compacts.
+"""
+
+import copy
+import json
+import os
+import random
+import threading
+
+from core.concurrency import LOCK_SUFFIX, get_lock
+
+COMPACT_EVERY_RECORDS = 200
+JOURNAL_SUFFIX = ".journal"
+COMPACTING_SUFFIX = ".journal.compacting"
+COMPACTION_LOCK_SUFFIX = ".compaction" + LOCK_SUFFIX
+MIGRATED_SUFFIX = ".migrated"
+JOURNAL_OP = "journal"
+# Position of a user file without journal files: the snapshot alone
+SNAPSHOT_POSITION = (0, 0)
+
+
+class JsonCodec:
+    """Snapshot codec for JournalLog: the pretty-printed JSON the app has always written."""
+
+    suffix = ".json"
+    # Parsed documents take several times their size on disk as Python objects
+    parsed_size_factor = 4
+
+    def dumps(self, doc):
+        return json.dumps(doc, ensure_ascii=False, indent=4).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+JSON_CODEC = JsonCodec()
+
+
+def apply_record(doc, record):
+    """Applies one journal record to a user document (in place)."""
+    op = record.get("op")
+    if op == "batch":
+        for sub_record in record["records"]:
+            apply_record(doc, sub_record)
+    elif op == "entry":
+        diary = doc.setdefault("diary", {})
+        if record.get("value") is None:
+            diary.pop(record["date"], None)
+        else:
+            diary[record["date"]] = record["value"]
+    elif op == "set":
+        doc[record["key"]] = record["value"]
+
+
+def collect_changes(records):
+    """(fields, entries) set by a run of records, the last one winning; a deleted entry is None."""
+    fields, entries = {}, {}
+    for record in records:
+        op = record.get("op")
+        if op == "batch":
+            sub_fields, sub_entries = collect_changes(record["records"])
+            fields.update(sub_fields)
+            entries.update(sub_entries)
+        elif op == "entry":
+            entries[record["date"]] = record.get("value")
+        elif op == "set":
+            fields[record["key"]] = record["value"]
+    return fields, entries
+
+
+def read_records(path, offset=0):
+    """Yields the records of a journal file from byte `offset`, skipping a torn last line."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                # Only the last line can be half-written (crash during append).
+                continue
+
+
+def read_journal_header(path):
+    """(id, after, size) of a journal file, or None if there is none.
+
+    A journal without a ``journal`` record (written before them) has id 0
+    and follows nothing known.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        line = f.readline()
+        size = os.fstat(f.fileno()).st_size
+    try:
+        record = json.loads(line) if line.endswith(b"\n") else {}
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        record = {}
+    if record.get("op") != JOURNAL_OP:
+        return 0, None, size
+    after = record.get("after")
+    return record["id"], tuple(after) if after else None, size
+
+
+def fsync_dir(path):
+    """Makes a rename of `path` durable by syncing its directory (POSIX only)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalLog:
+    """Snapshot + append-only journal for a single user data file.
+
+    `codec` reads and writes the snapshot (JSON by default). With another
+    codec, a JSON snapshot at the same base path is the *legacy* snapshot:
+    it is converted on first load and renamed to ``*.json.migrated``.
+    """
+
+    def __init__(self, snapshot_path, compact_every=COMPACT_EVERY_RECORDS, codec=JSON_CODEC):
+        base = os.path.splitext(snapshot_path)[0]
+        self.snapshot_path = snapshot_path
+        self.journal_path = base + JOURNAL_SUFFIX
+        self.compacting_path = base + COMPACTING_SUFFIX
+        self.codec = codec
+        self.legacy_path = None if codec.suffix == JSON_CODEC.suffix else base + JSON_CODEC.suffix
+        self.compact_every = compact_every
+        # Shared with other processes; always taken before self._lock
+        self.file_lock = get_lock(base + LOCK_SUFFIX)
+        self._compaction_lock = get_lock(base + COMPACTION_LOCK_SUFFIX)
+        self._lock = threading.Lock()
+        self._compacting = False
+        self._tail_records = 0
+        # Last written value of every top-level field except "diary", used to
+        # skip fields that did not change since the previous save.
+        self._fields = None
+
+    def exists(self):
+        paths = (self.snapshot_path, self.journal_path, self.compacting_path, self.legacy_path)
+        return any(p and os.path.exists(p) for p in paths)
+
+    def stamp(self):
+        """(mtime_ns, size) of the snapshot and journal files; changes on every write."""
+        stamp = []
+        for path in (self.snapshot_path, self.compacting_path, self.journal_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def load(self):
+        """Returns the user document: snapshot replayed with the journal tail.
+
+        Raises the codec's error (json.JSONDecodeError for JSON) if the
+        snapshot itself is corrupt.
+        """
+        self.migrate_legacy()
+        with self.file_lock.hold(shared=True), self._lock:
+            doc = self._read_snapshot()
+            tail = 0
+            for path in (self.compacting_path, self.journal_path):
+                for record in read_records(path):
+                    if record.get("op") != JOURNAL_OP:
+                        apply_record(doc, record)
+                        tail += 1
+            self._tail_records = tail
+            self._fields = copy.deepcopy({k: v for k, v in doc.items() if k != "diary"})
+        if tail >= self.compact_every:
+            self.compact_in_background()
+        return doc
+
+    def append(self, fields, entries=None):
+        """Appends the changed fields and the given entries as journal records.
+
+        `fields` holds the top-level values (points, fortune, elf state...);
+        only the ones that differ from the last save are written. `entries`
+        maps date keys to entry dicts (or None for a deleted entry).
+        """
+        with self.file_lock.hold():
+            if self._fields is None:
+                self.load()
+            with self._lock:
+                records = []
+                for key, value in fields.items():
+                    if key == "diary" or self._fields.get(key, object()) == value:
+                        continue
+                    records.append({"op": "set", "key": key, "value": value})
+                    self._fields[key] = copy.deepcopy(value)
+                for date_key, value in (entries or {}).items():
+                    records.append({"op": "entry", "date": date_key, "value": value})
+                if not records:
+                    return 0
+                record = records[0] if len(records) == 1 else {"op": "batch", "records": records}
+                if not os.path.exists(self.journal_path):
+                    self._start_journal()
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._tail_records += len(records)
+                needs_compaction = self._tail_records >= self.compact_every
+        if needs_compaction:
+            self.compact_in_background()
+        return len(records)
+
+    def compact_in_background(self):
+        threading.Thread(target=self.compact, name="journal-compaction", daemon=True).start()
+
+    def compact(self):
+        """Folds the journal into the snapshot.
+
+        The live journal is first renamed to ``*.journal.compacting`` so saves
+        can keep appending to a fresh journal while the snapshot is rebuilt.
+        Replaying a record twice is harmless, so a crash at any point leaves
+        the data loadable.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        try:
+            # One compaction of the file at a time, across processes; saves go on meanwhile
+            with self._compaction_lock.hold():
+                # Before the snapshot's temporary file is ours to write
+                self.migrate_legacy()
+                with self.file_lock.hold(), self._lock:
+                    if not os.path.exists(self.compacting_path) and os.path.exists(self.journal_path):
+                        os.replace(self.journal_path, self.compacting_path)
+                        # Started now, so it records where the compacted one ended
+                        self._start_journal()
+                    self._tail_records = 0
+                if not os.path.exists(self.compacting_path):
+                    return
+                doc = self._read_snapshot()
+                for record in read_records(self.compacting_path):
+                    apply_record(doc, record)
+                tmp_doc_path = self._write_tmp_snapshot(doc)
+                # Swap under the lock so a concurrent load() never sees the new
+                # snapshot without the compacted records, or the old one without them.
+                with self.file_lock.hold(), self._lock:
+                    os.replace(tmp_doc_path, self.snapshot_path)
+                    fsync_dir(self.snapshot_path)
+                    os.remove(self.compacting_path)
+        finally:
+            self._compacting = False
+
+    def position(self):
+        """(journal id, size) of the end of the records; SNAPSHOT_POSITION without journal files.
+
+        Call with the file lock held to get a position no append is racing.
+        """
+        for path in (self.journal_path, self.compacting_path):
+            header = read_journal_header(path)
+            if header is not None:
+                return header[0], header[2]
+        return SNAPSHOT_POSITION
+
+    def records_since(self, position):
+        """The records appended after `position` (from `position()`), oldest first.
+
+        None if some of them are no longer in the journal files: a compaction
+        folded them into the snapshot. Call with the file lock held.
+        """
+        journal_id, offset = position
+        compacting = read_journal_header(self.compacting_path)
+        journal = read_journal_header(self.journal_path)
+        if compacting is not None and compacting[0] == journal_id and offset <= compacting[2]:
+            parts = [(self.compacting_path, offset), (self.journal_path, 0)]
+        elif journal is not None and journal[0] == journal_id and offset <= journal[2]:
+            parts = [(self.journal_path, offset)]
+        elif journal is not None and compacting is None and (
+                journal[1] == tuple(position) or (journal[1] is None and tuple(position) == SNAPSHOT_POSITION)):
+            # Everything up to `position` is in the snapshot, and this journal follows it
+            parts = [(self.journal_path, 0)]
+        else:
+            return None
+        return [r for path, start in parts for r in read_records(path, start) if r.get("op") != JOURNAL_OP]
+
+    def _start_journal(self):
+        """Creates the journal file with its ``journal`` record (call with the file lock held)."""
+        compacting = read_journal_header(self.compacting_path)
+        header = {
+            "op": JOURNAL_OP,
+            # Never 0, the id of journals without a header
+            "id": random.getrandbits(62) + 1,
+            "after": [compacting[0], compacting[2]] if compacting is not None else None,
+        }
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _write_tmp_snapshot(self, doc):
+        tmp_doc_path = self.snapshot_path + ".tmp"
+        with open(tmp_doc_path, "wb") as f:
+            f.write(self.codec.dumps(doc))
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_doc_path
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path, "rb") as f:
+            return self.codec.loads(f.read())
+
+    def _needs_migration(self):
+        return bool(self.legacy_path) and not os.path.exists(self.snapshot_path) and os.path.exists(self.legacy_path)
+
+    def migrate_legacy(self):
+        """Converts the legacy JSON snapshot, if any, to the codec's format.
+
+        Holds the file lock exclusively, so it is converted once even when
+        several processes (or a load and a compaction) find it at a time.
+        """
+        if not self._needs_migration():
+            return
+        with self.file_lock.hold():
+            # Converted by someone else while we waited
+            if not self._needs_migration():
+                return
+            with open(self.legacy_path, "rb") as f:
+                doc = JSON_CODEC.loads(f.read())
+            os.replace(self._write_tmp_snapshot(doc), self.snapshot_path)
+            # Kept (renamed) rather than deleted, so a downgrade can still find the data
+            os.replace(self.legacy_path, self.legacy_path + MIGRATED_SUFFIX)
+            fsync_dir(self.snapshot_path)
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(snapshot_path, codec=JSON_CODEC):
+    """Returns the process-wide JournalLog for a data file (shared by all sessions)."""
+    with _journals_lock:
+        journal = _journals.get(snapshot_path)
+        if journal is None:
+            journal = _journals[snapshot_path] = JournalLog(snapshot_path, codec=codec)
+        return journal
@@ -0,0 +1,174 @@
+"""Emotion keyword matching with a compiled Aho-Corasick automaton.
+
+The lexicon is a JSON file (see data/emotion_lexicon.json)::
+
+    {"schema": 1,
+     "emotions": {"tired": {"en": {"exhausted": 1.0, "worn out": 0.9}, "de": {...}}, ...}}
+
+Every term of every language is compiled into one automaton, so scanning an
+entry is a single pass over its text: O(len(text) + matches) no matter how
+many terms the lexicon holds. Matches must sit on word boundaries ("calm"
+does not match inside "calmly"); terms written in CJK scripts, which don't
+separate words with spaces, skip that check.
+"""
+
+import functools
+import json
+import re
+import unicodedata
+from collections import deque
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Case-folded text with runs of whitespace collapsed to one space."""
+    return _WHITESPACE.sub(" ", text.casefold())
+
+
+def is_word_char(ch):
+    return ch.isalnum() or ch == "_" or unicodedata.category(ch) == "Mn"
+
+
+def is_cjk(ch):
+    """CJK ideographs, kana and hangul: scripts written without spaces between words."""
+    return "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af" or "\uf900" <= ch <= "\ufaff"
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher; each pattern carries an arbitrary payload."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]        # (pattern length, payload) ending at this node
+        self._out_link = [0]    # nearest node on the fail chain with outputs (0 = none)
+        for pattern, payload in patterns:
+            self._add(pattern, payload)
+        self._build()
+
+    def _add(self, pattern, payload):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._out_link.append(0)
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._out[node].append((len(pattern), payload))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail
+                self._out_link[child] = fail if self._out[fail] else self._out_link[fail]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def iter_matches(self, text):
+        """Yields (start, end, payload) for every pattern occurrence in `text`."""
+        goto, fail, out, out_link = self._goto, self._fail, self._out, self._out_link
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            hit = node if out[node] else out_link[node]
+            while hit:
+                for length, payload in out[hit]:
+                    yield i + 1 - length, i + 1, payload
+                hit = out_link[hit]
+
+
+class EmotionMatcher:
+    """Finds lexicon terms in free text and scores emotions by summed weight."""
+
+    def __init__(self, lexicon):
+        payloads = {}
+        self.languages = set()
+        for emotion, by_language in lexicon["emotions"].items():
+            for language, terms in by_language.items():
+                self.languages.add(language)
+                for term, weight in terms.items():
+                    term = normalize_text(term).strip()
+                    if not term:
+                        continue
+                    # A term listed under several languages ("triste": es, fr) counts once, at its highest weight
+                    known = payloads.get((term, emotion))
+                    if known is None or float(weight) > known[1]:
+                        payloads[(term, emotion)] = (emotion, float(weight), term, language)
+        self.emotions = list(lexicon["emotions"])
+        self.term_count = len(payloads)
+        self._automaton = AhoCorasick((term, payload) for (term, _), payload in payloads.items())
+
+    def matches(self, text):
+        """[(emotion, weight, term, language)] for the whole-word hits in `text`.
+
+        Overlapping hits are resolved leftmost-longest, so "feeling down"
+        counts once rather than also as "down".
+        """
+        return [payload for _, _, payload in self.spans(normalize_text(text))]
+
+    def spans(self, text):
+        """(start, end, payload) of the hits in already-normalized `text` (see `matches`)."""
+        hits = []
+        for start, end, payload in self._automaton.iter_matches(text):
+            term = payload[2]
+            if not is_cjk(term[0]) and start > 0 and is_word_char(text[start - 1]):
+                continue
+            if not is_cjk(term[-1]) and end < len(text) and is_word_char(text[end]):
+                continue
+            hits.append((start, -end, payload))
+        hits.sort(key=lambda hit: hit[:2])
+        found = []
+        taken_until = 0
+        for start, neg_end, payload in hits:
+            if start < taken_until:
+                # Same span with another payload (term listed under two emotions) still counts.
+                if found and (start, -neg_end) == found[-1][0]:
+                    found.append(((start, -neg_end), payload))
+                continue
+            found.append(((start, -neg_end), payload))
+            taken_until = -neg_end
+        return [(start, end, payload) for (start, end), payload in found]
+
+    def scores(self, text):
+        """{emotion: summed weight of its matched terms}."""
+        totals = {}
+        for emotion, weight, _, _ in self.matches(text):
+            totals[emotion] = totals.get(emotion, 0.0) + weight
+        return totals
+
+    def best_emotion(self, text, allowed=None):
+        """Highest-scoring emotion (restricted to `allowed`, in whose order ties are broken), or None."""
+        totals = self.scores(text)
+        candidates = allowed if allowed is not None else self.emotions
+        best, best_score = None, 0.0
+        for emotion in candidates:
+            score = totals.get(emotion, 0.0)
+            if score > best_score:
+                best, best_score = emotion, score
+        return best
+
+
+def load_lexicon(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def get_emotion_matcher(path):
+    """Compiles the lexicon at `path` once per process."""
+    return EmotionMatcher(load_lexicon(path))
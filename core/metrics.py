@@ -0,0 +1,143 @@
+"""Process-wide timing and size metrics, exported in the Prometheus text format.
+
+`Metrics` keeps counters, gauges and histograms keyed by name and labels;
+`write()` renders them to a file atomically, for node_exporter's textfile
+collector or any scraper that reads files. Users appear as `user_label()`
+hashes: names never reach the metrics file.
+
+Nothing here is called unless metrics are enabled (see app.py).
+"""
+
+import contextlib
+import hashlib
+import os
+import sys
+import threading
+import time
+
+PREFIX = "mood_journal"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def user_label(user_name):
+    """A stable, anonymous label for a user."""
+    return hashlib.sha256(user_name.encode("utf-8")).hexdigest()[:12]
+
+
+def thread_written_bytes():
+    """Bytes the calling thread has passed to write() so far, or None where not available (non-Linux)."""
+    try:
+        with open("/proc/thread-self/io", "rb") as f:
+            for line in f:
+                if line.startswith(b"wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def approx_size(value, _depth=0):
+    """Rough in-memory size of `value` in bytes, following containers a few levels deep.
+
+    Objects with a ``memory_bytes()`` method (a Diary) report their own size.
+    """
+    memory_bytes = getattr(value, "memory_bytes", None)
+    if callable(memory_bytes):
+        return memory_bytes()
+    size = sys.getsizeof(value)
+    if _depth < 4:
+        if isinstance(value, dict):
+            size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(approx_size(v, _depth + 1) for v in value)
+    return size
+
+
+class Metrics:
+    """Counters, gauges and histograms; safe to update from any thread."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._last_write = 0.0
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        """Observes the wall time of the block in the `name` histogram, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, list(counts)) for key, counts in self._histograms.items())
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            declare(name, "gauge")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), counts in histograms:
+            declare(name, "histogram")
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {counts[-1]}")
+            lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {counts[-2]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, min_interval=0.0):
+        """Writes render() to `path` (atomically), unless the last write was under `min_interval` seconds ago."""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_write and now - self._last_write < min_interval:
+                return False
+            self._last_write = now
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+        return True
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
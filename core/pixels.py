@@ -0,0 +1,98 @@
+"""Year-in-pixels: a whole year of moods drawn as one PNG with Pillow.
+
+The image is a 12 x 31 grid (one row per month, one cell per day). A cell is
+colored by the entry's score or by its mood emoji. `YearPixels` remembers the
+color it painted into every cell, so bringing it to a new version of the
+diary repaints only the cells whose color changed and then re-encodes the PNG.
+"""
+
+import calendar
+import datetime
+import io
+import threading
+
+from PIL import Image, ImageDraw, ImageFont
+
+CELL = 18
+GAP = 2
+LEFT = 36   # room for month labels
+TOP = 18    # room for day numbers
+BACKGROUND = "#fffaf4"
+EMPTY_COLOR = "#ece6df"
+LABEL_COLOR = "#6d5f56"
+
+# score 1 (low) .. 5 (high)
+SCORE_COLORS = {1: "#6b8fc9", 2: "#a9bfe0", 3: "#e8dcc8", 4: "#f5c97a", 5: "#f29a4a"}
+
+
+def cell_box(month, day):
+    """(x0, y0, x1, y1) of a day's cell."""
+    x = LEFT + (day - 1) * (CELL + GAP)
+    y = TOP + (month - 1) * (CELL + GAP)
+    return x, y, x + CELL - 1, y + CELL - 1
+
+
+class YearPixels:
+    """The year image of one user, kept in memory and updated cell by cell.
+
+    `mode` is "score" or "mood"; in mood mode `mood_colors` maps emojis to
+    colors. One instance may serve every session of the user: `png_at()`
+    repaints and encodes under a lock and returns immutable bytes.
+    """
+
+    def __init__(self, year, mode="score", mood_colors=None):
+        self.year = year
+        self.mode = mode
+        self.mood_colors = mood_colors or {}
+        self.version = None
+        self.png = b""
+        self._colors = {}  # date key -> painted color
+        self._lock = threading.Lock()
+        self._image = self._blank()
+
+    def _blank(self):
+        width = LEFT + 31 * (CELL + GAP)
+        height = TOP + 12 * (CELL + GAP)
+        image = Image.new("RGB", (width, height), BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.load_default()
+        for day in range(1, 32, 5):
+            draw.text((cell_box(1, day)[0] + 2, 2), str(day), fill=LABEL_COLOR, font=font)
+        for month in range(1, 13):
+            draw.text((2, cell_box(month, 1)[1] + 3), calendar.month_abbr[month], fill=LABEL_COLOR, font=font)
+            for day in range(1, calendar.monthrange(self.year, month)[1] + 1):
+                draw.rectangle(cell_box(month, day), fill=EMPTY_COLOR)
+        return image
+
+    def color_of(self, entry):
+        if self.mode == "mood":
+            return self.mood_colors.get(entry.get("mood"), EMPTY_COLOR)
+        return SCORE_COLORS.get(round(entry.get("score", 3)), EMPTY_COLOR)
+
+    def png_at(self, version, entries):
+        """PNG bytes of the image for the diary content `version`.
+
+        `entries()` returns this year's entries (date -> entry); it is only
+        called if the image was last drawn for another version. The bytes
+        are those of `version` even if another session repaints right after.
+        """
+        with self._lock:
+            if version != self.version or not self.png:
+                self._repaint(entries())
+                self.version = version
+            return self.png
+
+    def _repaint(self, entries):
+        """Repaints the cells whose color changed; returns how many. Call with the lock held."""
+        colors = {d: self.color_of(e) for d, e in entries.items() if d.startswith(f"{self.year}-")}
+        changed = [d for d in colors.keys() | self._colors.keys() if colors.get(d) != self._colors.get(d)]
+        draw = ImageDraw.Draw(self._image)
+        for date_key in changed:
+            date_obj = datetime.date.fromisoformat(date_key)
+            draw.rectangle(cell_box(date_obj.month, date_obj.day), fill=colors.get(date_key, EMPTY_COLOR))
+        self._colors = colors
+        if changed or not self.png:
+            buffer = io.BytesIO()
+            self._image.save(buffer, format="PNG", optimize=False)
+            self.png = buffer.getvalue()
+        return len(changed)
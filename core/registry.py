@@ -0,0 +1,175 @@
+"""User registry: display names -> stable user IDs, and sharded data directories.
+
+Files used to be named after `user_key(name)` in one flat directory. That
+directory grows with every user, and names that normalize alike ("A b" and
+"a_b") share one file. The registry gives each user a stable integer ID
+instead:
+
+* ``users.db`` (SQLite, in the data root) maps `canonical_name()` - the name
+  with case and runs of whitespace folded, nothing else - to the ID; lookups
+  are one indexed query, then cached in memory;
+* a user's files live in ``<root>/<shard>/`` and are named after ``u<id>``
+  (``diary_u42.json``, ``search_u42.json``, ...). The shard is a hash of the
+  ID, which spreads users over `SHARDS` directories.
+
+`migrate_flat_layout` moves the files of the old flat layout into shards.
+A moved user is registered under its old file key only (``legacy_key``); the
+first name that logs in and normalizes to that key claims it. Any later name
+with the same key gets a new user.
+
+    python -m core.registry --source . --root user_data
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+REGISTRY_FILE = "users.db"
+SHARDS = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE,          -- canonical_name(); NULL until a migrated user logs in
+    legacy_key TEXT UNIQUE,    -- flat-layout file key of a migrated user
+    created TEXT NOT NULL
+);
+"""
+
+# Per-user files of the flat layout, see JsonDiaryStore / core.archive
+FLAT_FILE = re.compile(
+    r"^(?P<kind>diary|search|rollups)_(?P<key>.+?)"
+    r"(?P<suffix>\.json|\.json\.migrated|\.mjd|\.journal|\.journal\.compacting|\.entries|\.entries\.idx|\.version)$"
+)
+FLAT_ARCHIVE = re.compile(r"^archive_(?P<key>.+)_(?P<year>\d{4})\.mjd$")
+
+
+def canonical_name(user_name):
+    """The registry key of a display name: case-folded, whitespace collapsed."""
+    return " ".join(user_name.split()).casefold()
+
+
+def shard_of(user_id):
+    """Name of the shard directory of a user ID ("00" - "ff")."""
+    digest = hashlib.blake2b(str(user_id).encode("ascii"), digest_size=4).digest()
+    return f"{int.from_bytes(digest, 'little') % SHARDS:02x}"
+
+
+def file_key(user_id):
+    return f"u{user_id}"
+
+
+class UserRegistry:
+    """The users table of one registry database; one connection per thread."""
+
+    def __init__(self, db_path=REGISTRY_FILE):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        self._ids = {}  # canonical name -> id; IDs never change, so never stale
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, user_name, legacy_key=None):
+        """The ID of a registered user, or None.
+
+        An unclaimed migrated user whose `legacy_key` matches is claimed by
+        this name.
+        """
+        name = canonical_name(user_name)
+        user_id = self._ids.get(name)
+        if user_id is not None:
+            return user_id
+        conn = self._conn()
+        row = conn.execute("SELECT id FROM users WHERE name = ?", (name,)).fetchone()
+        if row is None and legacy_key is not None:
+            with conn:
+                conn.execute(
+                    "UPDATE users SET name = ? WHERE legacy_key = ? AND name IS NULL", (name, legacy_key)
+                )
+            row = conn.execute("SELECT id FROM users WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        self._ids[name] = row[0]
+        return row[0]
+
+    def register(self, user_name, legacy_key=None):
+        """The ID of a user, registering the name if it is new."""
+        user_id = self.lookup(user_name, legacy_key)
+        if user_id is not None:
+            return user_id
+        conn = self._conn()
+        with conn:
+            # OR IGNORE: another process may have registered the name meanwhile
+            conn.execute(
+                "INSERT OR IGNORE INTO users (name, created) VALUES (?, ?)",
+                (canonical_name(user_name), datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+        return self.lookup(user_name)
+
+    def adopt_legacy(self, legacy_key):
+        """The ID of the migrated user with a flat-layout file key, registering it if new."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO users (legacy_key, created) VALUES (?, ?)",
+                (legacy_key, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+        return conn.execute("SELECT id FROM users WHERE legacy_key = ?", (legacy_key,)).fetchone()[0]
+
+    def names(self):
+        """Every registered name; the legacy key for unclaimed migrated users."""
+        rows = self._conn().execute("SELECT COALESCE(name, legacy_key) FROM users ORDER BY id")
+        return [r[0] for r in rows]
+
+
+def migrate_flat_layout(source_dir, root, registry):
+    """Moves the per-user files in `source_dir` to their shard under `root`.
+
+    Safe to run again after an interruption: users keep their ID and the
+    files left behind are moved on the next run. Returns the moved file keys.
+    """
+    moves = []
+    for file_name in os.listdir(source_dir):
+        match = FLAT_FILE.match(file_name) or FLAT_ARCHIVE.match(file_name)
+        if match:
+            moves.append((file_name, match))
+    keys = sorted({m["key"] for _, m in moves if m.re is FLAT_FILE and m["kind"] == "diary"})
+    ids = {key: registry.adopt_legacy(key) for key in keys}
+    for file_name, match in moves:
+        user_id = ids.get(match["key"])
+        if user_id is None:
+            continue  # e.g. the search file of a user without a diary
+        if match.re is FLAT_FILE:
+            new_name = f"{match['kind']}_{file_key(user_id)}{match['suffix']}"
+        else:
+            new_name = f"archive_{file_key(user_id)}_{match['year']}.mjd"
+        directory = os.path.join(root, shard_of(user_id))
+        os.makedirs(directory, exist_ok=True)
+        os.replace(os.path.join(source_dir, file_name), os.path.join(directory, new_name))
+    return keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat diary_<name>.* files into the sharded layout.")
+    parser.add_argument("--source", default=".", help="directory holding the flat diary_<name>.* files")
+    parser.add_argument("--root", default="user_data", help="data root of the sharded layout")
+    args = parser.parse_args()
+    registry = UserRegistry(os.path.join(args.root, REGISTRY_FILE))
+    keys = migrate_flat_layout(args.source, args.root, registry)
+    print(f"Moved {len(keys)} user(s): {', '.join(keys) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Weekly and monthly mood rollups, maintained entry by entry.
+
+Each bucket (ISO week "2024-W05" or month "2024-05") holds the entry count,
+the score sum, a mood distribution and tag frequencies. `apply()` moves one
+entry between its old and new value in O(tags), so a multi-year trend chart
+never touches raw entries.
+
+Stores persist the rollups one bucket per record, keyed ``"<kind>:<period>"``
+(`bucket_records`). A save rewrites only the buckets of the dates it changed,
+recounted from the stored entries (`recount_buckets`). So its cost doesn't
+grow with the history, and concurrent saves merged per entry (core.concurrency)
+still leave correct buckets.
+"""
+
+import calendar
+import datetime
+
+
+def week_key(date_key):
+    year, week, _ = datetime.date.fromisoformat(date_key).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def month_key(date_key):
+    return date_key[:7]
+
+
+def period_start(kind, key):
+    """First day of a "weekly"/"monthly" bucket key, for chart axes."""
+    if kind == "weekly":
+        year, week = key.split("-W")
+        return datetime.date.fromisocalendar(int(year), int(week), 1)
+    year, month = key.split("-")
+    return datetime.date(int(year), int(month), 1)
+
+
+PERIODS = {"weekly": week_key, "monthly": month_key}
+
+
+def period_range(kind, key):
+    """(first, last) date keys of a bucket."""
+    start = period_start(kind, key)
+    if kind == "weekly":
+        end = start + datetime.timedelta(days=6)
+    else:
+        end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    return start.isoformat(), end.isoformat()
+
+
+def record_key(kind, key):
+    return f"{kind}:{key}"
+
+
+def bucket_records(summaries):
+    """{record key: bucket} of every bucket of Diary.summaries() rows."""
+    rollups = MoodRollups.from_summaries(summaries)
+    return {record_key(kind, key): bucket for kind, periods in rollups.buckets.items() for key, bucket in periods.items()}
+
+
+def recount_buckets(date_keys, summaries_between):
+    """{record key: bucket} of the buckets holding `date_keys`; None for a bucket left empty.
+
+    `summaries_between(first, last)` returns the stored summary rows of a date range.
+    """
+    records = {}
+    for kind, period_of in PERIODS.items():
+        for key in {period_of(d) for d in date_keys}:
+            rollups = MoodRollups.from_summaries(summaries_between(*period_range(kind, key)))
+            records[record_key(kind, key)] = rollups.buckets[kind].get(key)
+    return records
+
+
+class MoodRollups:
+
+    def __init__(self, buckets=None):
+        # kind -> period key -> {"count", "score_sum", "moods", "tags"}
+        self.buckets = {kind: {} for kind in PERIODS}
+        for kind, periods in (buckets or {}).items():
+            self.buckets[kind] = {k: _copy_bucket(b) for k, b in periods.items()}
+
+    @classmethod
+    def from_summaries(cls, summaries):
+        """Full rebuild from Diary.summaries() rows: (date, mood, score, tags, ...)."""
+        rollups = cls()
+        for date_key, mood, score, tags, *_ in summaries:
+            rollups._count(date_key, mood, score, tags, +1)
+        return rollups
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data)
+
+    @classmethod
+    def from_records(cls, records):
+        """From a store's bucket records (see bucket_records)."""
+        buckets = {kind: {} for kind in PERIODS}
+        for name, bucket in records.items():
+            kind, key = name.split(":", 1)
+            buckets[kind][key] = bucket
+        return cls(buckets)
+
+    def to_dict(self):
+        return {kind: {k: _copy_bucket(b) for k, b in periods.items()} for kind, periods in self.buckets.items()}
+
+    def total_entries(self):
+        return sum(b["count"] for b in self.buckets["monthly"].values())
+
+    # --- Incremental updates ---
+
+    def apply(self, date_key, old_entry, new_entry):
+        """Replaces `old_entry` with `new_entry` at `date_key` (either may be None)."""
+        if old_entry is not None:
+            self._count(date_key, old_entry.get("mood"), old_entry.get("score", 3), old_entry.get("tags", []), -1)
+        if new_entry is not None:
+            self._count(date_key, new_entry.get("mood"), new_entry.get("score", 3), new_entry.get("tags", []), +1)
+
+    def _count(self, date_key, mood, score, tags, delta):
+        for kind, period_of in PERIODS.items():
+            periods = self.buckets[kind]
+            key = period_of(date_key)
+            bucket = periods.setdefault(key, {"count": 0, "score_sum": 0, "moods": {}, "tags": {}})
+            bucket["count"] += delta
+            bucket["score_sum"] += delta * score
+            _bump(bucket["moods"], mood, delta)
+            for tag in tags:
+                _bump(bucket["tags"], tag, delta)
+            if bucket["count"] <= 0:
+                del periods[key]
+
+    # --- Queries ---
+
+    def series(self, kind, start_key=None, end_key=None):
+        """[(period key, bucket + "mean_score")] for one kind, oldest first."""
+        rows = []
+        for key in sorted(self.buckets[kind]):
+            if (start_key and key < start_key) or (end_key and key > end_key):
+                continue
+            bucket = self.buckets[kind][key]
+            rows.append((key, dict(bucket, mean_score=bucket["score_sum"] / bucket["count"])))
+        return rows
+
+
+def _bump(counts, key, delta):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+
+def _copy_bucket(bucket):
+    return {"count": bucket["count"], "score_sum": bucket["score_sum"],
+            "moods": dict(bucket["moods"]), "tags": dict(bucket["tags"])}
@@ -0,0 +1,234 @@
+"""Full-text search over diary entries with an inverted index.
+
+Every entry becomes one document: the tokens of its text (with positions,
+for phrase queries) and of its tag names, plus the filter terms
+``tag:<tag>`` and ``mood:<emoji>``. An index maps each token to its posting
+list ``{date: [positions]}``.
+
+Indexes are maintained entry by entry when the journal is saved and persisted
+by the store (see `JsonDiaryStore.search` / `SqliteDiaryStore.search`), so a
+search only reads the posting lists of the query terms - never the diary.
+Both backends expose the same small read interface used by `run_query()`::
+
+    postings(token)     -> {date: [positions]}
+    doc_lengths(dates)  -> {date: number of text tokens}
+    collection_stats()  -> (number of documents, total length)
+
+Queries are free text; "double quoted" parts are phrases, and so are runs of
+CJK characters (indexed one character per token). Results are ranked with
+BM25.
+"""
+
+import math
+import re
+
+from core.lexicon import is_cjk, normalize_text
+
+_WORD = re.compile(r"\w+")
+_PHRASE = re.compile(r'"([^"]*)"')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _split_word(word):
+    """Splits CJK characters out of a word: each one is a token of its own."""
+    if not any(is_cjk(ch) for ch in word):
+        return [word]
+    tokens, run = [], ""
+    for ch in word:
+        if is_cjk(ch):
+            if run:
+                tokens.append(run)
+                run = ""
+            tokens.append(ch)
+        else:
+            run += ch
+    if run:
+        tokens.append(run)
+    return tokens
+
+
+def tokenize(text):
+    """Case-folded word tokens of `text`, in order."""
+    tokens = []
+    for match in _WORD.finditer(normalize_text(text or "")):
+        tokens.extend(_split_word(match.group()))
+    return tokens
+
+
+def tag_term(tag):
+    return f"tag:{tag}"
+
+
+def mood_term(mood):
+    return f"mood:{mood}"
+
+
+def document_terms(entry):
+    """({term: [positions]}, text length) for one entry.
+
+    Tag-name tokens are placed after the text with a gap so a phrase never
+    spans text and tags; filter terms have no positions.
+    """
+    text_tokens = tokenize(entry.get("text", ""))
+    terms = {}
+    for position, token in enumerate(text_tokens):
+        terms.setdefault(token, []).append(position)
+    position = len(text_tokens) + 1
+    for tag in entry.get("tags", []):
+        for token in tokenize(tag):
+            terms.setdefault(token, []).append(position)
+            position += 1
+        position += 1
+        terms.setdefault(tag_term(tag), [])
+    if entry.get("mood"):
+        terms.setdefault(mood_term(entry["mood"]), [])
+    return terms, len(text_tokens)
+
+
+def parse_query(query):
+    """(loose terms, phrases) of a query; each phrase is a list of tokens."""
+    phrases = []
+    for quoted in _PHRASE.findall(query):
+        tokens = tokenize(quoted)
+        if tokens:
+            phrases.append(tokens)
+    terms = []
+    for match in _WORD.finditer(normalize_text(_PHRASE.sub(" ", query))):
+        tokens = _split_word(match.group())
+        if len(tokens) > 1:
+            phrases.append(tokens)  # "很累", "café去" - adjacent characters
+        else:
+            terms.extend(tokens)
+    return terms, phrases
+
+
+class SearchIndex:
+    """In-memory inverted index, plus the forward documents it was built from.
+
+    The forward documents ({date: {"terms", "length"}}) are what gets
+    persisted; they let `set_entry` drop an entry's old postings without
+    reading the old entry. This is the JSON backend's index.
+    """
+
+    def __init__(self, documents=None):
+        self.documents = {}
+        self._postings = {}
+        self._total_length = 0
+        for date_key, document in (documents or {}).items():
+            self._add(date_key, document)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def set_entry(self, date_key, entry):
+        """Re-indexes one entry (None removes it); returns its new forward document."""
+        self._remove(date_key)
+        if entry is None:
+            return None
+        terms, length = document_terms(entry)
+        document = {"terms": terms, "length": length}
+        self._add(date_key, document)
+        return document
+
+    def _add(self, date_key, document):
+        self.documents[date_key] = document
+        self._total_length += document["length"]
+        for term, positions in document["terms"].items():
+            self._postings.setdefault(term, {})[date_key] = positions
+
+    def _remove(self, date_key):
+        document = self.documents.pop(date_key, None)
+        if document is None:
+            return
+        self._total_length -= document["length"]
+        for term in document["terms"]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(date_key, None)
+                if not posting:
+                    del self._postings[term]
+
+    # --- Read interface used by run_query() ---
+
+    def postings(self, token):
+        return self._postings.get(token, {})
+
+    def doc_lengths(self, dates):
+        return {d: self.documents[d]["length"] for d in dates if d in self.documents}
+
+    def collection_stats(self):
+        return len(self.documents), self._total_length
+
+
+def _phrase_dates(index, phrase):
+    """Dates whose text contains `phrase` (consecutive positions)."""
+    lists = [index.postings(token) for token in phrase]
+    if not all(lists):
+        return set()
+    candidates = set(lists[0]).intersection(*lists[1:])
+    found = set()
+    for date_key in candidates:
+        later = [set(posting[date_key]) for posting in lists[1:]]
+        if any(all(start + i + 1 in positions for i, positions in enumerate(later))
+               for start in lists[0][date_key]):
+            found.add(date_key)
+    return found
+
+
+def run_query(index, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+    """[(date, score)] of the best matches for `query`, best first.
+
+    All `tags` must be on an entry; `moods` match any of the given emojis. An
+    empty query lists the entries matching the filters, newest first.
+    """
+    terms, phrases = parse_query(query or "")
+    if not terms and not phrases and not tags and not moods:
+        return []
+
+    # Candidate set: filters and phrases are required, loose terms are ranked.
+    required = []
+    for tag in tags:
+        required.append(set(index.postings(tag_term(tag))))
+    if moods:
+        required.append(set().union(*(index.postings(mood_term(m)) for m in moods)))
+    for phrase in phrases:
+        required.append(_phrase_dates(index, phrase))
+    term_postings = {t: index.postings(t) for t in dict.fromkeys(terms + [t for p in phrases for t in p])}
+    if required:
+        candidates = set.intersection(*required)
+        if terms:
+            candidates = {d for d in candidates if any(d in term_postings[t] for t in terms)}
+    else:
+        candidates = set().union(*(term_postings[t] for t in terms))
+    if start_key or end_key:
+        candidates = {d for d in candidates
+                      if (not start_key or d >= start_key) and (not end_key or d <= end_key)}
+    if not candidates:
+        return []
+
+    scores = dict.fromkeys(candidates, 0.0)
+    if term_postings:
+        doc_count, total_length = index.collection_stats()
+        avg_length = (total_length / doc_count) if doc_count else 0.0
+        lengths = index.doc_lengths(candidates)
+        for posting in term_postings.values():
+            if not posting:
+                continue
+            idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for date_key in candidates:
+                positions = posting.get(date_key)
+                if not positions:
+                    continue
+                tf = len(positions)
+                norm = 1 - BM25_B + BM25_B * (lengths.get(date_key, 0) / avg_length if avg_length else 0)
+                scores[date_key] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    return ranked[:limit]
+
+
+def highlight_terms(query):
+    """Tokens worth highlighting in a result snippet."""
+    terms, phrases = parse_query(query or "")
+    return set(terms).union(*phrases) if phrases else set(terms)
@@ -0,0 +1,150 @@
+"""Offline sentiment and emotion scoring for diary text.
+
+Scoring runs locally on the CPU from the emotion lexicon
+(data/emotion_lexicon.json): every matched term contributes its weight times
+its emotion's valence, flipped and damped when a negator ("not", "nicht",
+"不", ...) precedes it and boosted after an intensifier ("very", "很", ...).
+The signed sum is squashed into [-1, 1].
+
+Results carry the hash of the text they were computed from, so an entry whose
+text did not change is never rescored (`score_entry`), and identical texts
+share one in-process cache slot. `backfill` scores a whole history, in a
+process pool when it is large.
+"""
+
+import functools
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from core.lexicon import EmotionMatcher, is_cjk, load_lexicon, normalize_text
+
+SCORER_VERSION = 1
+NEGATION_DAMPING = -0.6  # "not happy" is mildly negative, not the opposite of happy
+INTENSIFIER_BOOST = 1.3
+CACHE_SIZE = 4096
+# Fewer entries to score than this are scored in the calling process: the
+# pool's start-up would cost more than it saves
+PROCESS_POOL_MIN_ENTRIES = 2000
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def is_current(sentiment, text):
+    """True if a stored sentiment result was computed from `text` by this scorer version."""
+    return bool(sentiment) and sentiment.get("version") == SCORER_VERSION and sentiment.get("hash") == text_hash(text)
+
+
+def text_score(sentiment):
+    """Sentiment in [-1, 1] mapped onto the 1-5 scale of MOOD_SCORES."""
+    return 3 + 2 * sentiment
+
+
+class SentimentScorer:
+
+    def __init__(self, lexicon, cache_size=CACHE_SIZE):
+        self.matcher = EmotionMatcher(lexicon)
+        self.valence = lexicon.get("valence", {})
+        self.negators = {w for words in lexicon.get("negators", {}).values() for w in words}
+        self.intensifiers = {w for words in lexicon.get("intensifiers", {}).values() for w in words}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # The scorer is shared by every session of the process
+        self._cache_lock = threading.Lock()
+
+    def score(self, text):
+        """{"version", "hash", "sentiment", "emotions"} for a piece of text."""
+        key = text_hash(text)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return dict(cached)
+        # Scored outside the lock: two sessions may score one text twice, but don't wait for each other
+        result = self._score(text, key)
+        with self._cache_lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return dict(result)
+
+    def score_entry(self, entry, text=None):
+        """The entry's stored sentiment if still current for `text`, else a fresh score."""
+        text = entry.get("text", "") if text is None else text
+        stored = entry.get("sentiment")
+        if is_current(stored, text):
+            return stored
+        return self.score(text)
+
+    def _score(self, text, key):
+        normalized = normalize_text(text)
+        total = 0.0
+        weights = 0.0
+        emotions = {}
+        for start, _, (emotion, weight, term, _) in self.matcher.spans(normalized):
+            modifier = self._modifier(normalized, start, term)
+            total += self.valence.get(emotion, 0.0) * weight * modifier
+            weights += weight
+            if modifier > 0:
+                emotions[emotion] = round(emotions.get(emotion, 0.0) + weight * modifier, 3)
+        sentiment = total / (weights + 1.0) if weights else 0.0
+        return {"version": SCORER_VERSION, "hash": key, "sentiment": round(sentiment, 4), "emotions": emotions}
+
+    def _modifier(self, text, start, term):
+        if is_cjk(term[0]):
+            before = text[max(0, start - 2):start]
+            words = [before[-2:], before[-1:]]
+        else:
+            words = text[max(0, start - 40):start].split()[-3:]
+        modifier = 1.0
+        if words and words[-1] in self.intensifiers:
+            modifier *= INTENSIFIER_BOOST
+        if any(w in self.negators for w in words):
+            modifier *= NEGATION_DAMPING
+        return modifier
+
+
+@functools.lru_cache(maxsize=None)
+def get_sentiment_scorer(lexicon_path):
+    """One scorer (and lexicon automaton) per process."""
+    return SentimentScorer(load_lexicon(lexicon_path))
+
+
+def needs_scoring(entry):
+    return not is_current(entry.get("sentiment"), entry.get("text", ""))
+
+
+def _score_in_worker(args):
+    lexicon_path, text = args
+    return get_sentiment_scorer(lexicon_path).score(text)
+
+
+def backfill(entries, lexicon_path, workers=None, use_processes=None):
+    """Scores every entry whose sentiment is missing or stale.
+
+    `entries` maps date keys to entries; returns {date: sentiment} for the
+    ones that were (re)scored. Scoring is pure-Python CPU work, so threads
+    would only take turns on the GIL: it runs in a pool of processes, or in
+    the calling process. By default (`use_processes` None) the pool is used
+    for PROCESS_POOL_MIN_ENTRIES entries or more on a machine with several
+    CPUs.
+    """
+    todo = [(d, e.get("text", "")) for d, e in entries.items() if needs_scoring(e)]
+    if not todo:
+        return {}
+    workers = workers or min(8, os.cpu_count() or 1)
+    if use_processes is None:
+        use_processes = workers > 1 and len(todo) >= PROCESS_POOL_MIN_ENTRIES
+    if not use_processes:
+        scorer = get_sentiment_scorer(lexicon_path)
+        return {d: scorer.score(text) for d, text in todo}
+    jobs = [(lexicon_path, text) for _, text in todo]
+    # Spawned, not forked: the app's server process runs threads that hold locks
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(_score_in_worker, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    return {d: result for (d, _), result in zip(todo, results)}
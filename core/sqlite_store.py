@@ -0,0 +1,406 @@
+"""SQLite (WAL mode) storage backend, plus a one-shot migrator for JSON files.
+
+Usage of the migrator::
+
+    python -m core.sqlite_store --source . --db mood_journal.db
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+from core.concurrency import versioned_fields
+from core.diary import Diary, summarize_entries
+from core.registry import REGISTRY_FILE, UserRegistry
+from core.rollups import bucket_records, recount_buckets
+from core.search import document_terms, run_query
+from core.store import DiaryStore, JsonDiaryStore, user_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mood TEXT,
+    score INTEGER,
+    text TEXT,
+    response TEXT,
+    extra TEXT,
+    PRIMARY KEY (user, date)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_mood ON entries (user, mood);
+
+-- An entry's tags in their order, repeats included
+CREATE TABLE IF NOT EXISTS entry_tags (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (user, date, position)
+);
+CREATE INDEX IF NOT EXISTS idx_entry_tags_tag ON entry_tags (user, tag);
+
+-- Inverted search index (see core.search), maintained by save()
+CREATE TABLE IF NOT EXISTS search_docs (
+    user TEXT NOT NULL,
+    date TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (user, date)
+);
+
+CREATE TABLE IF NOT EXISTS search_postings (
+    user TEXT NOT NULL,
+    token TEXT NOT NULL,
+    date TEXT NOT NULL,
+    positions TEXT NOT NULL,
+    PRIMARY KEY (user, token, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_postings_date ON search_postings (user, date);
+
+-- MoodRollups buckets by record key (see core.rollups), maintained by save()
+CREATE TABLE IF NOT EXISTS rollups (
+    user TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    PRIMARY KEY (user, period)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS elf_state (
+    user TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_state (
+    user TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (user, key)
+);
+"""
+
+# Entry keys that have their own column; anything else round-trips through `extra`.
+ENTRY_COLUMNS = ("mood", "score", "text", "response")
+# Key in `extra` listing the column keys (and "tags") the entry didn't have,
+# so they stay absent instead of coming back as None / [].
+ABSENT_KEY = "_absent"
+
+# Max host parameters per "IN (...)" query
+IN_CHUNK = 500
+
+
+def _add_tag_positions(conn):
+    """Moves an entry_tags table from before tag positions (one row per distinct tag) to the new schema.
+
+    The rows keep their insertion (rowid) order, which was the tags' order.
+    """
+    with conn:
+        # Another process may be migrating: check again once writers wait
+        conn.execute("BEGIN IMMEDIATE")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(entry_tags)")]
+        if not columns or "position" in columns:
+            return
+        conn.execute("ALTER TABLE entry_tags RENAME TO entry_tags_unordered")
+        conn.execute("DROP INDEX IF EXISTS idx_entry_tags_tag")
+        conn.execute(
+            "CREATE TABLE entry_tags (user TEXT NOT NULL, date TEXT NOT NULL, position INTEGER NOT NULL, "
+            "tag TEXT NOT NULL, PRIMARY KEY (user, date, position))"
+        )
+        conn.execute(
+            "INSERT INTO entry_tags (user, date, position, tag) "
+            "SELECT user, date, ROW_NUMBER() OVER (PARTITION BY user, date ORDER BY rowid) - 1, tag "
+            "FROM entry_tags_unordered"
+        )
+        conn.execute("DROP TABLE entry_tags_unordered")
+
+
+class SqliteSearchIndex:
+    """The read interface core.search.run_query() needs, answered from the search tables."""
+
+    def __init__(self, conn, key):
+        self.conn = conn
+        self.key = key
+
+    def postings(self, token):
+        rows = self.conn.execute(
+            "SELECT date, positions FROM search_postings WHERE user = ? AND token = ?", (self.key, token)
+        )
+        return {d: json.loads(positions) for d, positions in rows}
+
+    def doc_lengths(self, dates):
+        dates = list(dates)
+        lengths = {}
+        for i in range(0, len(dates), IN_CHUNK):
+            chunk = dates[i:i + IN_CHUNK]
+            lengths.update(self.conn.execute(
+                f"SELECT date, length FROM search_docs WHERE user = ? AND date IN ({','.join('?' * len(chunk))})",
+                (self.key, *chunk),
+            ))
+        return lengths
+
+    def collection_stats(self):
+        return self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM search_docs WHERE user = ?", (self.key,)
+        ).fetchone()
+
+
+class SqliteDiaryStore(DiaryStore):
+    """All users in one database; one connection per thread."""
+
+    def __init__(self, db_path="mood_journal.db"):
+        # Absolute, so connections opened later (or saves flushed at exit)
+        # don't follow a change of working directory.
+        self.db_path = os.path.abspath(db_path)
+        self._local = threading.local()
+        conn = self._conn()
+        _add_tag_positions(conn)
+        conn.executescript(SCHEMA)
+        self._search_checked = set()  # users whose entries are known to be indexed
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- DiaryStore ---
+
+    def exists(self, user_name):
+        key = user_key(user_name)
+        row = self._conn().execute(
+            "SELECT 1 FROM user_state WHERE user = ? UNION ALL SELECT 1 FROM entries WHERE user = ? LIMIT 1",
+            (key, key),
+        ).fetchone()
+        return row is not None
+
+    def load(self, user_name, window_start=None):
+        return self._fields(self._conn(), user_key(user_name)), Diary(self, user_name, window_start=window_start)
+
+    def _fields(self, conn, key):
+        fields = {k: json.loads(v) for k, v in conn.execute("SELECT key, value FROM user_state WHERE user = ?", (key,))}
+        row = conn.execute("SELECT state FROM elf_state WHERE user = ?", (key,)).fetchone()
+        if row:
+            fields["elf_state"] = json.loads(row[0])
+        return fields
+
+    def version(self, user_name):
+        return self._version(self._conn(), user_key(user_name))
+
+    def _version(self, conn, key):
+        row = conn.execute("SELECT value FROM user_state WHERE user = ? AND key = 'version'", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_name, fields, entries, base=None):
+        key = user_key(user_name)
+        conn = self._conn()
+        with conn:
+            if base is not None:
+                # The write lock from the start: the version check and the write are
+                # atomic for every connection, in this process or another
+                conn.execute("BEGIN IMMEDIATE")
+                fields = versioned_fields(fields, base, self._version(conn, key), lambda: self._fields(conn, key))
+            for name, value in fields.items():
+                if name == "diary":
+                    continue
+                if name == "elf_state":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO elf_state (user, state) VALUES (?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False)),
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO user_state (user, key, value) VALUES (?, ?, ?)",
+                        (key, name, json.dumps(value, ensure_ascii=False)),
+                    )
+            for date_key, entry in entries.items():
+                conn.execute("DELETE FROM entry_tags WHERE user = ? AND date = ?", (key, date_key))
+                if entry is None:
+                    conn.execute("DELETE FROM entries WHERE user = ? AND date = ?", (key, date_key))
+                    continue
+                extra = {k: v for k, v in entry.items() if k not in ENTRY_COLUMNS and k != "tags"}
+                absent = [k for k in (*ENTRY_COLUMNS, "tags") if k not in entry]
+                if absent:
+                    extra[ABSENT_KEY] = absent
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (user, date, mood, score, text, response, extra) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, date_key, *(entry.get(c) for c in ENTRY_COLUMNS),
+                     json.dumps(extra, ensure_ascii=False) if extra else None),
+                )
+                conn.executemany(
+                    "INSERT INTO entry_tags (user, date, position, tag) VALUES (?, ?, ?, ?)",
+                    [(key, date_key, i, tag) for i, tag in enumerate(entry.get("tags", []))],
+                )
+            self._index_entries(conn, key, entries)
+            # Not built yet: rollup_records() builds them from every entry, these included
+            if entries and self._has_rollups(conn, key):
+                self._write_rollups(conn, key, recount_buckets(entries, lambda first, last: summarize_entries(
+                    self.entries_between(user_name, first, last))))
+
+    def _index_entries(self, conn, key, entries):
+        """Replaces the search postings of `entries` (date -> entry or None)."""
+        for date_key, entry in entries.items():
+            conn.execute("DELETE FROM search_postings WHERE user = ? AND date = ?", (key, date_key))
+            conn.execute("DELETE FROM search_docs WHERE user = ? AND date = ?", (key, date_key))
+            if entry is None:
+                continue
+            terms, length = document_terms(entry)
+            conn.execute("INSERT INTO search_docs (user, date, length) VALUES (?, ?, ?)", (key, date_key, length))
+            conn.executemany(
+                "INSERT INTO search_postings (user, token, date, positions) VALUES (?, ?, ?, ?)",
+                [(key, term, date_key, json.dumps(positions)) for term, positions in terms.items()],
+            )
+
+    def rollup_records(self, user_name):
+        key = user_key(user_name)
+        conn = self._conn()
+        if not self._has_rollups(conn, key):
+            with conn:
+                # Writers wait: no save lands between the count and the write
+                conn.execute("BEGIN IMMEDIATE")
+                if not self._has_rollups(conn, key):
+                    self._write_rollups(conn, key, bucket_records(self.entry_summaries(user_name)))
+        return {period: json.loads(bucket) for period, bucket in
+                conn.execute("SELECT period, bucket FROM rollups WHERE user = ?", (key,))}
+
+    def _has_rollups(self, conn, key):
+        return conn.execute("SELECT 1 FROM rollups WHERE user = ? LIMIT 1", (key,)).fetchone() is not None
+
+    def _write_rollups(self, conn, key, records):
+        for period, bucket in records.items():
+            if bucket is None:
+                conn.execute("DELETE FROM rollups WHERE user = ? AND period = ?", (key, period))
+            else:
+                conn.execute("INSERT OR REPLACE INTO rollups (user, period, bucket) VALUES (?, ?, ?)",
+                             (key, period, json.dumps(bucket, ensure_ascii=False)))
+
+    def _ensure_search_index(self, key):
+        """Indexes entries saved before the search tables existed (once per user and process)."""
+        if key in self._search_checked:
+            return
+        conn = self._conn()
+        missing = [r[0] for r in conn.execute(
+            "SELECT e.date FROM entries e LEFT JOIN search_docs s ON s.user = e.user AND s.date = e.date "
+            "WHERE e.user = ? AND s.date IS NULL", (key,)
+        )]
+        for i in range(0, len(missing), IN_CHUNK):
+            chunk = missing[i:i + IN_CHUNK]
+            entries = self._select_entries(f"user = ? AND date IN ({','.join('?' * len(chunk))})", (key, *chunk))
+            with conn:
+                self._index_entries(conn, key, entries)
+        self._search_checked.add(key)
+
+    # --- Row-level reads ---
+
+    def _select_entries(self, where, params):
+        conn = self._conn()
+        rows = conn.execute(
+            f"SELECT date, mood, score, text, response, extra FROM entries WHERE {where} ORDER BY date", params
+        ).fetchall()
+        if not rows:
+            return {}
+        entries = {}
+        for date_key, mood, score, text, response, extra in rows:
+            entry = {"mood": mood, "text": text, "response": response, "score": score, "tags": []}
+            if extra:
+                extra = json.loads(extra)
+                for k in extra.pop(ABSENT_KEY, ()):
+                    del entry[k]
+                entry.update(extra)
+            entries[date_key] = entry
+        tag_rows = conn.execute(
+            f"SELECT date, tag FROM entry_tags WHERE {where} ORDER BY date, position", params
+        )
+        for date_key, tag in tag_rows:
+            if date_key in entries:
+                entries[date_key]["tags"].append(tag)
+        return entries
+
+    def get_entry(self, user_name, date_key):
+        return self._select_entries("user = ? AND date = ?", (user_key(user_name), date_key)).get(date_key)
+
+    def entries_between(self, user_name, start_key, end_key):
+        return self._select_entries("user = ? AND date BETWEEN ? AND ?", (user_key(user_name), start_key, end_key))
+
+    def entry_dates(self, user_name):
+        rows = self._conn().execute("SELECT date FROM entries WHERE user = ? ORDER BY date", (user_key(user_name),))
+        return [r[0] for r in rows]
+
+    def entry_summaries(self, user_name):
+        key = user_key(user_name)
+        conn = self._conn()
+        tags = {}
+        for date_key, tag in conn.execute(
+            "SELECT date, tag FROM entry_tags WHERE user = ? ORDER BY date, position", (key,)
+        ):
+            tags.setdefault(date_key, []).append(tag)
+        rows = conn.execute("SELECT date, mood, score, extra FROM entries WHERE user = ? ORDER BY date", (key,))
+        summaries = []
+        for d, mood, score, extra in rows:
+            sentiment = (json.loads(extra).get("sentiment") or {}).get("sentiment") if extra else None
+            summaries.append((d, mood, 3 if score is None else score, tags.get(d, []), sentiment))
+        return summaries
+
+    def search(self, user_name, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+        key = user_key(user_name)
+        self._ensure_search_index(key)
+        return run_query(SqliteSearchIndex(self._conn(), key), query, tags, moods, start_key, end_key, limit)
+
+    def stats(self, user_name):
+        key = user_key(user_name)
+        conn = self._conn()
+        total, first_date = conn.execute("SELECT COUNT(*), MIN(date) FROM entries WHERE user = ?", (key,)).fetchone()
+        mood_counts = Counter(dict(conn.execute(
+            "SELECT mood, COUNT(*) FROM entries WHERE user = ? GROUP BY mood", (key,)
+        ).fetchall()))
+        tag_counts = Counter(dict(conn.execute(
+            "SELECT tag, COUNT(*) FROM entry_tags WHERE user = ? GROUP BY tag", (key,)
+        ).fetchall()))
+        mood_tag_counts = {}
+        for mood, tag, n in conn.execute(
+            "SELECT e.mood, t.tag, COUNT(*) FROM entry_tags t "
+            "JOIN entries e ON e.user = t.user AND e.date = t.date "
+            "WHERE t.user = ? GROUP BY e.mood, t.tag", (key,)
+        ):
+            mood_tag_counts.setdefault(mood, Counter())[tag] = n
+        return {
+            "total_entries": total,
+            "first_entry_date": first_date,
+            "mood_counts": mood_counts,
+            "tag_counts": tag_counts,
+            "mood_tag_counts": mood_tag_counts,
+        }
+
+
+def migrate_json_files(source_dir, store, overwrite=False):
+    """Imports every ``diary_*.json`` user in `source_dir` into `store`.
+
+    Users already present in the target store are skipped unless `overwrite`.
+    Returns the list of imported user keys. A `source_dir` with a user
+    registry (core.registry) is read as a sharded data root.
+    """
+    registry_path = os.path.join(source_dir, REGISTRY_FILE)
+    registry = UserRegistry(registry_path) if os.path.exists(registry_path) else None
+    source = JsonDiaryStore(source_dir, registry=registry)
+    imported = []
+    for name in source.user_names():
+        if store.exists(name) and not overwrite:
+            continue
+        fields, diary = source.load(name)
+        store.save(name, fields, dict(diary))
+        imported.append(name)
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import diary_*.json files into an SQLite store.")
+    parser.add_argument("--source", default=".", help="directory holding the diary_*.json files")
+    parser.add_argument("--db", default="mood_journal.db", help="SQLite database to create or update")
+    parser.add_argument("--overwrite", action="store_true", help="re-import users that already exist")
+    args = parser.parse_args()
+    users = migrate_json_files(args.source, SqliteDiaryStore(args.db), overwrite=args.overwrite)
+    print(f"Imported {len(users)} user(s): {', '.join(users) or '-'}")
@@ -0,0 +1,459 @@
+"""Storage backends for user data.
+
+A user's data is a set of top-level fields (total_points, fortune_*,
+elf_state, ...) plus the diary entries. Backends implement `DiaryStore`:
+
+* `JsonDiaryStore` - one ``diary_<name>.json`` snapshot + append-only journal
+  per user (see core.journal_log). Diaries are loaded completely; with a
+  `UserStateCache` (core.user_cache) the parsed entries are shared by every
+  session of the user. Row reads (windowed diaries) go through an entry file
+  with a date index (core.entry_file) instead of parsing the whole file. The
+  search index lives next to it in ``search_<name>.json`` + journal, and the
+  mood rollups' buckets in ``rollups_<name>.json`` + journal. With
+  `archive_after_days`, old years move to compressed per-year archives
+  (core.archive) and the user file keeps only the recent entries. With a
+  `UserRegistry` (core.registry) the files are named after stable user IDs
+  and sharded into subdirectories of the root.
+* `SqliteDiaryStore` (core.sqlite_store) - one WAL-mode database for all
+  users. Diaries are lazy and read only the rows a page asks for.
+
+Both take saves from several sessions and processes at once: a save with a
+`base` is merged with the saves it didn't know of (core.concurrency).
+"""
+
+import bisect
+import copy
+import datetime
+import glob
+import os
+import threading
+from collections import ChainMap
+
+from core.archive import ARCHIVE_CACHE_BUDGET_BYTES, YearArchives, archive_cutoff_year
+from core.compact_format import CompactCodec
+from core.concurrency import VERSION_SUFFIX, read_version, versioned_fields, write_version
+from core.diary import MIN_DATE_KEY, Diary, compute_stats, summarize_entries
+from core.entry_file import ENTRIES_SUFFIX, get_entry_file
+from core.journal_log import JSON_CODEC, collect_changes, get_journal
+from core.registry import file_key, shard_of
+from core.rollups import bucket_records, recount_buckets
+from core.search import SearchIndex, run_query
+from core.user_cache import OverlayDict, SharedUserState, UserStateCache
+
+
+def user_key(user_name):
+    """Normalized user name used for file names and database keys."""
+    return user_name.strip().lower().replace(" ", "_")
+
+
+def get_user_data_file(user_name, root="."):
+    """Generates a unique file name based on user name."""
+    if not user_name:
+        return None
+    return os.path.join(root, f"diary_{user_key(user_name)}.json")
+
+
+class DiaryStore:
+    """Interface every storage backend implements."""
+
+    def storage_key(self, user_name, register=True):
+        """Key of a user's data in this store (file names, database rows, caches).
+
+        With `register` False, None for a user the store has never seen.
+        """
+        return user_key(user_name)
+
+    def exists(self, user_name):
+        """True if anything has been saved for this user."""
+        raise NotImplementedError
+
+    def load(self, user_name, window_start=None):
+        """Returns (fields, diary): the top-level fields and a `Diary`.
+
+        With `window_start` the diary is windowed (see `Diary`): it only
+        holds the entries on or after that date key.
+        """
+        raise NotImplementedError
+
+    def save(self, user_name, fields, entries, base=None):
+        """Persists top-level `fields` and the changed `entries` (date -> entry, None deletes).
+
+        With a `base` (``{"session", "version", "fields"}``, see core.user_state)
+        the save is optimistic: `fields["version"]["writer"]` names it, and
+        if the stored version is no longer ``base["version"]`` the fields are
+        merged with the stored ones (core.concurrency.merge_fields).
+        """
+        raise NotImplementedError
+
+    def version(self, user_name):
+        """The stored version of a user ({"number", "writer", "merged"}), or None.
+
+        Cheap enough to poll on every rerun.
+        """
+        return None
+
+    # --- Row-level reads used by lazy diaries ---
+
+    def get_entry(self, user_name, date_key):
+        raise NotImplementedError
+
+    def entries_between(self, user_name, start_key, end_key):
+        raise NotImplementedError
+
+    def entry_dates(self, user_name):
+        raise NotImplementedError
+
+    def stats(self, user_name):
+        raise NotImplementedError
+
+    def entry_summaries(self, user_name):
+        """[(date, mood, score, tags, sentiment)] for every entry, oldest first - no text."""
+        raise NotImplementedError
+
+    def search(self, user_name, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+        """[(date, score)] of the entries matching `query`, best first (see core.search)."""
+        raise NotImplementedError
+
+    def rollup_records(self, user_name):
+        """The user's MoodRollups buckets by record key (core.rollups), or None if the store keeps none."""
+        return None
+
+
+class JsonDiaryStore(DiaryStore):
+    """One snapshot + journal pair per user in `root`.
+
+    `cache` (a UserStateCache) keeps one parsed copy of each user's data for
+    the whole process; without it every load parses the files again.
+    `codec` is the snapshot format: JSON by default, or a CompactCodec
+    (core.compact_format) for ``diary_<name>.mjd`` files.
+
+    With `archive_after_days`, loading a user moves every year that ended
+    more than that many days ago into its archive file (core.archive).
+    Users with archived years get a diary windowed on the first day after
+    them, so only pages that need old dates read the archives, through
+    `archive_cache`.
+
+    Without a `registry` a user's files are ``<root>/diary_<user_key>...``;
+    with one they are ``<root>/<shard>/diary_u<id>...`` (see core.registry).
+    """
+
+    def __init__(self, root=".", cache=None, codec=JSON_CODEC, archive_after_days=None, archive_cache=None,
+                 registry=None):
+        # Absolute, so saves flushed later (e.g. at exit) don't follow a
+        # change of working directory.
+        self.root = os.path.abspath(root)
+        self.cache = cache
+        self.codec = codec
+        self.registry = registry
+        self.archive_after_days = archive_after_days
+        self.archive_cache = archive_cache if archive_cache is not None else UserStateCache(ARCHIVE_CACHE_BUDGET_BYTES)
+        # Archives are always compact, whatever the snapshot format
+        self.archive_codec = codec if isinstance(codec, CompactCodec) else CompactCodec()
+        self._archives = {}  # storage key -> YearArchives
+        self._search_indexes = {}  # search file path -> (SearchIndex, stamp of the search journal)
+        self._search_lock = threading.Lock()
+        self._archive_lock = threading.Lock()
+        self._shard_dirs = set()  # shard directories known to exist
+
+    def _user_id(self, user_name):
+        """Registry ID of a user, registering the name if it is new."""
+        return self.registry.register(user_name, legacy_key=user_key(user_name))
+
+    def storage_key(self, user_name, register=True):
+        if self.registry is None:
+            return user_key(user_name)
+        if register:
+            return file_key(self._user_id(user_name))
+        user_id = self.registry.lookup(user_name, legacy_key=user_key(user_name))
+        return None if user_id is None else file_key(user_id)
+
+    def user_dir(self, user_name):
+        """Directory of a user's files (created on first use)."""
+        if self.registry is None:
+            return self.root
+        directory = os.path.join(self.root, shard_of(self._user_id(user_name)))
+        if directory not in self._shard_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._shard_dirs.add(directory)
+        return directory
+
+    def data_file(self, user_name):
+        return os.path.join(self.user_dir(user_name), f"diary_{self.storage_key(user_name)}{self.codec.suffix}")
+
+    def journal(self, user_name):
+        return get_journal(self.data_file(user_name), self.codec)
+
+    def entry_file(self, user_name):
+        return get_entry_file(os.path.splitext(self.data_file(user_name))[0] + ENTRIES_SUFFIX)
+
+    def version_file(self, user_name):
+        return os.path.splitext(self.data_file(user_name))[0] + VERSION_SUFFIX
+
+    def search_file(self, user_name):
+        return os.path.join(self.user_dir(user_name), f"search_{self.storage_key(user_name)}.json")
+
+    def rollups_file(self, user_name):
+        return os.path.join(self.user_dir(user_name), f"rollups_{self.storage_key(user_name)}.json")
+
+    def archives(self, user_name):
+        key = self.storage_key(user_name)
+        with self._archive_lock:
+            archives = self._archives.get(key)
+            if archives is None:
+                archives = self._archives[key] = YearArchives(
+                    self.user_dir(user_name), key, self.archive_codec, self.archive_cache)
+            return archives
+
+    def user_names(self):
+        """Normalized names of every user with a data file in `root` (or in the registry)."""
+        if self.registry is not None:
+            return self.registry.names()
+        prefix = "diary_"
+        # Not yet migrated JSON snapshots count too
+        suffixes = {self.codec.suffix, JSON_CODEC.suffix}
+        return sorted({
+            os.path.basename(p)[len(prefix):-len(suffix)]
+            for suffix in suffixes
+            for p in glob.glob(os.path.join(self.root, prefix + "*" + suffix))
+        })
+
+    def exists(self, user_name):
+        # Asking must not register the name (e.g. a typo at onboarding)
+        if self.storage_key(user_name, register=False) is None:
+            return False
+        return self.journal(user_name).exists()
+
+    def load(self, user_name, window_start=None):
+        if self.archive_after_days is not None:
+            self.archive_old_entries(user_name)
+        boundary = self.archives(user_name).boundary()
+        if window_start is not None:
+            # Fields and the window are read from the entry file; nothing else is parsed
+            fields = self._entry_file(user_name).fields()
+            return fields, Diary(self, user_name, window_start=window_start)
+        if self.cache is None:
+            doc = self.journal(user_name).load()
+            entries = doc.pop("diary", {})
+        else:
+            shared = self._shared_state(user_name)
+            # Fields are small and edited in place by the app: each session gets
+            # its own copy. Entries are shared; the session's edits stay in the overlay.
+            doc, entries = copy.deepcopy(shared.fields), OverlayDict(shared.entries)
+        # With archived years, the user file holds exactly the window after them
+        return doc, Diary(self, user_name, entries, window_start=boundary)
+
+    def save(self, user_name, fields, entries, base=None):
+        # One writer per user at a time, in this process and in any other
+        with self.journal(user_name).file_lock.hold():
+            if base is not None:
+                stored = self.version(user_name)
+                fields = versioned_fields(fields, base, stored, lambda: self._stored_fields(user_name))
+            hot_entries = entries
+            boundary = self.archives(user_name).boundary()
+            if boundary and entries:
+                cold_entries = {d: e for d, e in entries.items() if d < boundary}
+                if cold_entries:
+                    # Archive files are immutable: the touched years are written anew
+                    self.archives(user_name).update(cold_entries)
+                    hot_entries = {d: e for d, e in entries.items() if d >= boundary}
+            self._save_hot(user_name, fields, hot_entries)
+            if entries:
+                # Written after the diary record: a crash in between only leaves
+                # the entry unsearchable until it is saved again.
+                with self._search_lock:
+                    index = self._search_index(user_name)
+                    documents = {d: index.set_entry(d, entry) for d, entry in entries.items()}
+                    log = get_journal(self.search_file(user_name))
+                    log.append({}, documents)
+                    # The user's lock is held: nobody else wrote since the index was checked
+                    self._search_indexes[log.snapshot_path] = (index, log.stamp())
+                rollups_log = get_journal(self.rollups_file(user_name))
+                # Not built yet: rollup_records() builds it from every entry, these included
+                if rollups_log.exists():
+                    rollups_log.append({}, recount_buckets(entries, lambda first, last: summarize_entries(
+                        self.entries_between(user_name, first, last))))
+            if base is not None:
+                # Last, so watchers only hear of the save once it is readable
+                write_version(self.version_file(user_name), fields["version"])
+
+    def version(self, user_name):
+        return read_version(self.version_file(user_name))
+
+    def rollup_records(self, user_name):
+        log = get_journal(self.rollups_file(user_name))
+        if not log.exists():
+            # Once per user (or while there are no entries); saves keep it current after that
+            with self.journal(user_name).file_lock.hold():
+                if not log.exists():
+                    log.append({}, bucket_records(self.entry_summaries(user_name)))
+        return log.load().get("diary", {})
+
+    def _stored_fields(self, user_name):
+        """The user's fields as on disk now (written by any process)."""
+        if self.cache is not None:
+            return self._shared_state(user_name).fields
+        doc = self.journal(user_name).load()
+        doc.pop("diary", None)
+        return doc
+
+    def _save_hot(self, user_name, fields, entries):
+        """Writes to the user file (journal, shared cache and entry file)."""
+        log = self.journal(user_name)
+        old_stamp, old_position = log.stamp(), log.position()
+        log.append(fields, entries)
+        stamp = log.stamp()
+        if self.cache is not None:
+            self.cache.update(self.storage_key(user_name), old_stamp, stamp, self._parsed_size(stamp), fields, entries)
+        # Only kept in step if it was current; a stale one catches up on the next row read
+        self.entry_file(user_name).apply(fields, entries, old_position, log.position())
+
+    def archive_old_entries(self, user_name, today=None):
+        """Moves the years that ended over `archive_after_days` ago to archives.
+
+        Returns the number of entries moved. Archives are written before the
+        entries are removed from the user file; after a crash in between,
+        the next call moves the leftovers again.
+        """
+        cutoff_year = archive_cutoff_year(today or datetime.date.today(), self.archive_after_days)
+        dates = self._entry_file(user_name).dates()
+        if not dates or int(dates[0][:4]) > cutoff_year:
+            return 0
+        # The move is one write for other processes: they see it whole or not at all
+        with self.journal(user_name).file_lock.hold():
+            entry_file = self._entry_file(user_name)
+            dates = entry_file.dates()
+            if not dates or int(dates[0][:4]) > cutoff_year:
+                return 0
+            old_entries = entry_file.between(MIN_DATE_KEY, f"{cutoff_year:04d}-12-31")
+            self.archives(user_name).update(old_entries)
+            self._save_hot(user_name, {}, dict.fromkeys(old_entries))
+        # Shrinks the snapshot now rather than after COMPACT_EVERY_RECORDS saves
+        self.journal(user_name).compact_in_background()
+        return len(old_entries)
+
+    def search(self, user_name, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+        journal = self.journal(user_name)
+        # Needs the lock exclusively: not from within the shared hold below
+        journal.migrate_legacy()
+        # The user's lock first, as in save(): building the index reads the diary
+        with journal.file_lock.hold(shared=True), self._search_lock:
+            return run_query(self._search_index(user_name), query, tags, moods, start_key, end_key, limit)
+
+    def _search_index(self, user_name):
+        """The user's SearchIndex, loaded from its journal (or built once from the diary).
+
+        Reloaded when the journal's stamp changes, e.g. after another process saved.
+        """
+        path = self.search_file(user_name)
+        log = get_journal(path)
+        # Stamped before reading: a write racing the load makes the next check miss
+        stamp = log.stamp()
+        cached = self._search_indexes.get(path)
+        if cached is not None and cached[1] == stamp:
+            return cached[0]
+        if log.exists():
+            # Stored like diary entries: date -> forward document
+            index = SearchIndex(log.load().get("diary", {}))
+        else:
+            index = SearchIndex()
+            documents = {d: index.set_entry(d, entry) for d, entry in self._all_entries(user_name).items()}
+            if documents:
+                log.append({}, documents)
+            stamp = log.stamp()
+        self._search_indexes[path] = (index, stamp)
+        return index
+
+    # Row reads (get_entry, entries_between, entry_dates) go through the entry
+    # file; whole-diary reads use the parsed document, shared if there is a cache.
+
+    def _entry_file(self, user_name):
+        """The user's EntryFile, caught up with the journal.
+
+        A stale one applies the records saved since its position (by other
+        processes, or compacted into a new journal); it is rebuilt from the
+        whole document only if it is missing, unreadable or behind the
+        snapshot.
+        """
+        log = self.journal(user_name)
+        entry_file = self.entry_file(user_name)
+        if entry_file.position() == log.position():
+            return entry_file
+        # The entry file is shared by every process: one updates it at a time
+        with log.file_lock.hold():
+            position, current = log.position(), entry_file.position()
+            if current == position:
+                return entry_file
+            records = log.records_since(current) if current is not None else None
+            if records is not None and entry_file.apply(*collect_changes(records), current, position):
+                return entry_file
+            if self.cache is not None:
+                shared = self._shared_state(user_name)
+                fields, entries = shared.fields, shared.entries
+            else:
+                fields = log.load()
+                entries = fields.pop("diary", {})
+            entry_file.rebuild(fields, entries, position)
+        return entry_file
+
+    def _shared_state(self, user_name):
+        """The cached SharedUserState of a user, (re)parsed if the files changed."""
+        key = self.storage_key(user_name)
+        log = self.journal(user_name)
+        # Stamped before reading: a write racing the load makes the next get() miss.
+        stamp = log.stamp()
+        shared = self.cache.get(key, stamp)
+        if shared is None:
+            doc = log.load()
+            entries = doc.pop("diary", {})
+            shared = SharedUserState(doc, entries, stamp, self._parsed_size(stamp))
+            self.cache.put(key, shared)
+        return shared
+
+    def _parsed_size(self, stamp):
+        # The journal is JSON whatever the snapshot codec; close enough for a budget
+        return self.codec.parsed_size_factor * sum(size for _, size in filter(None, stamp))
+
+    def _entries(self, user_name):
+        if self.cache is not None:
+            return self._shared_state(user_name).entries
+        return self.journal(user_name).load().get("diary", {})
+
+    def _all_entries(self, user_name):
+        """The user file's entries, plus the archived years' if there are any."""
+        entries = self._entries(user_name)
+        archived = self.archives(user_name).all_entries()
+        return ChainMap(entries, *archived) if archived else entries
+
+    # Dates before the archive boundary are answered by the archives alone
+
+    def get_entry(self, user_name, date_key):
+        archives = self.archives(user_name)
+        boundary = archives.boundary()
+        if boundary and date_key < boundary:
+            return archives.get(date_key)
+        return self._entry_file(user_name).get(date_key)
+
+    def entries_between(self, user_name, start_key, end_key):
+        archives = self.archives(user_name)
+        boundary = archives.boundary()
+        rows = {}
+        if boundary and start_key < boundary:
+            rows.update(archives.between(start_key, end_key))
+            start_key = boundary
+        if start_key <= end_key:
+            rows.update(self._entry_file(user_name).between(start_key, end_key))
+        return rows
+
+    def entry_dates(self, user_name):
+        archives = self.archives(user_name)
+        boundary = archives.boundary()
+        dates = self._entry_file(user_name).dates()
+        if not boundary:
+            return dates
+        return archives.dates() + dates[bisect.bisect_left(dates, boundary):]
+
+    def stats(self, user_name):
+        return compute_stats(self._all_entries(user_name))
+
+    def entry_summaries(self, user_name):
+        return summarize_entries(self._all_entries(user_name))
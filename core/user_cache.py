@@ -0,0 +1,242 @@
+"""Process-wide cache of parsed user data, shared by every session of a user.
+
+Several tabs or devices of one user used to parse ``diary_<name>.json`` each
+and hold a private copy. `UserStateCache` keeps one parsed copy per user
+(a `SharedUserState`) and hands sessions a reference to it:
+
+* the entries are shared read-only; a session's `Diary` wraps them in an
+  `OverlayDict`, which keeps the session's own edits and deletions privately;
+* the small top-level fields (points, elf state, ...) are copied per session.
+
+A cached state is stamped with the (mtime, size) of the user's files and is
+dropped when the files no longer match, e.g. after another process wrote
+them. Saves made through the store update the cached copy copy-on-write, so
+sessions that already hold the old copy are not affected: the new copy is a
+`LayeredDict` layer of the saved entries over the old one, not a copy of the
+whole diary. Memory is bounded by an LRU budget on the estimated size of the
+cached users.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+
+# Parsed user data shared by all sessions of a process (JSON backend)
+USER_CACHE_BUDGET_BYTES = 64 * 1024 * 1024
+
+
+class _Deleted:
+    """Marks a deleted key in a layer or overlay; stays the same object through copy and pickle."""
+
+    def __reduce__(self):
+        return "_DELETED"
+
+
+_DELETED = _Deleted()
+
+
+class SharedUserState:
+    """One user's parsed fields and entries, plus the file stamp they match."""
+
+    __slots__ = ("fields", "entries", "stamp", "size")
+
+    def __init__(self, fields, entries, stamp, size):
+        self.fields = fields
+        self.entries = entries
+        self.stamp = stamp
+        self.size = size
+
+    def updated(self, fields, entries, stamp, size):
+        """A new state with `fields` and `entries` (None = deleted) applied.
+
+        Costs about the number of changed entries: they are layered over the
+        current ones (see `LayeredDict`), which stay as they are.
+        """
+        current = self.entries if isinstance(self.entries, LayeredDict) else LayeredDict(self.entries)
+        return SharedUserState({**self.fields, **fields}, current.updated(entries), stamp, size)
+
+
+class UserStateCache:
+    """LRU of SharedUserState by user key, bounded by total estimated size."""
+
+    def __init__(self, budget_bytes=USER_CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self.metrics = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "updates": 0}
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, key, stamp):
+        """The cached state of `key` if it still matches `stamp`, else None."""
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                self.metrics["misses"] += 1
+                return None
+            if state.stamp != stamp:
+                self.metrics["stale"] += 1
+                self._drop(key)
+                return None
+            self._states.move_to_end(key)
+            self.metrics["hits"] += 1
+            return state
+
+    def put(self, key, state):
+        with self._lock:
+            if key in self._states:
+                self._drop(key)
+            self._states[key] = state
+            self.size_bytes += state.size
+            self._evict(keep=key)
+
+    def update(self, key, old_stamp, new_stamp, size, fields, entries):
+        """Applies a save to the cached state, if it was current before the save.
+
+        A state that was already stale (someone else wrote the files) is
+        dropped instead.
+        """
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                return
+            if state.stamp != old_stamp:
+                self._drop(key)
+                return
+            self._drop(key)
+            state = state.updated(fields, entries, new_stamp, size)
+            self._states[key] = state
+            self.size_bytes += state.size
+            self.metrics["updates"] += 1
+            self._evict(keep=key)
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._states:
+                self._drop(key)
+
+    def _drop(self, key):
+        self.size_bytes -= self._states.pop(key).size
+
+    def _evict(self, keep):
+        while self.size_bytes > self.budget_bytes and len(self._states) > 1:
+            key = next(iter(self._states))
+            if key == keep:
+                break
+            self._drop(key)
+            self.metrics["evictions"] += 1
+
+
+class LayeredDict(Mapping):
+    """A read-only dict made of a base dict plus the layers of later saves.
+
+    `updated()` returns a new LayeredDict that shares this one's layers and
+    adds one with just the changes. A layer is merged into the one below
+    once it is half as big (into new dicts: the old ones may be shared), so
+    there are O(log n) layers and an entry is copied O(log n) times.
+    """
+
+    __slots__ = ("_layers", "_len")
+
+    def __init__(self, base, layers=(), length=None):
+        # Bottom to top; the base has no deletion markers
+        self._layers = (base, *layers)
+        self._len = len(base) if length is None else length
+
+    def updated(self, entries):
+        """A new LayeredDict with `entries` (None = deleted) applied."""
+        length = self._len
+        for date_key, entry in entries.items():
+            length += (entry is not None) - (date_key in self)
+        layer = {date_key: _DELETED if entry is None else entry for date_key, entry in entries.items()}
+        layers = list(self._layers)
+        while len(layers) > 1 and 2 * len(layer) >= len(layers[-1]):
+            layer = {**layers.pop(), **layer}
+        if 2 * len(layer) >= len(layers[0]):
+            base = {**layers.pop(), **layer}
+            for date_key, entry in layer.items():
+                if entry is _DELETED:
+                    del base[date_key]
+            return LayeredDict(base, length=length)
+        return LayeredDict(layers[0], (*layers[1:], layer), length)
+
+    def __getitem__(self, key):
+        for layer in reversed(self._layers):
+            if key in layer:
+                value = layer[key]
+                if value is _DELETED:
+                    raise KeyError(key)
+                return value
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        for layer in reversed(self._layers):
+            if key in layer:
+                return layer[key] is not _DELETED
+        return False
+
+    def __iter__(self):
+        layers = self._layers
+        for i, layer in enumerate(layers):
+            above = layers[i + 1:]
+            for key, value in layer.items():
+                if value is not _DELETED and not any(key in upper for upper in above):
+                    yield key
+
+    def __len__(self):
+        return self._len
+
+
+class OverlayDict(MutableMapping):
+    """A read-only shared dict plus this session's private changes.
+
+    Writes and deletions go to the overlay; the base is never modified, so
+    it can be shared by every session of a user.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.overlay = {}
+        self._hidden = 0  # base keys overridden or deleted by the overlay
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            value = self.overlay[key]
+            if value is _DELETED:
+                raise KeyError(key)
+            return value
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        if key in self.base and key not in self.overlay:
+            self._hidden += 1
+        self.overlay[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.base:
+            if key not in self.overlay:
+                self._hidden += 1
+            self.overlay[key] = _DELETED
+        else:
+            del self.overlay[key]
+
+    def __contains__(self, key):
+        if key in self.overlay:
+            return self.overlay[key] is not _DELETED
+        return key in self.base
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.overlay:
+                yield key
+        for key, value in self.overlay.items():
+            if value is not _DELETED:
+                yield key
+
+    def __len__(self):
+        deleted = sum(1 for value in self.overlay.values() if value is _DELETED)
+        return len(self.base) - self._hidden + len(self.overlay) - deleted
@@ -0,0 +1,128 @@
+"""Loading and saving the state of one user: the top-level fields plus the diary.
+
+The app keeps this state in ``st.session_state``. Here it is any mapping with
+the keys ``diary``, ``total_points``, ``fortune_drawn``, ``fortune_result``,
+``elf_state`` and ``sync``.
+
+``sync`` is what a session needs to save optimistically (core.concurrency):
+its ``session`` ID and save counter ``seq``, the version it ``loaded``, and
+the ``base`` of its next save - the version and fields of its last save.
+"""
+
+import copy
+import json
+
+from core.compact_format import CompactFormatError
+from core.concurrency import new_session_id
+from core.diary import Diary
+from core.elf import create_initial_elf_state, reset_daily_potions
+
+
+def load_user_state(store, user_name, today, window_start=None):
+    """The state of `user_name` as stored in `store`.
+
+    A new user, or one whose data file can't be read, only gets an empty
+    diary, a new elf and `sync`; the other keys are left out.
+    """
+    state = _load_stored_state(store, user_name, today, window_start)
+    state["sync"] = new_sync(user_name, state, today, state.pop("version", None))
+    return state
+
+
+def _load_stored_state(store, user_name, today, window_start):
+    if store.exists(user_name):
+        try:
+            data, diary = store.load(user_name, window_start)
+        except (json.JSONDecodeError, CompactFormatError):
+            pass
+        else:
+            diary.load_aggregates(data.get("insight_aggregates"))
+            diary.content_version = content_version(data.get("version"))
+            fortune_drawn = data.get("fortune_date") == today.isoformat()
+            elf_state = data.get("elf_state") or create_initial_elf_state(today)
+            reset_daily_potions(elf_state, today)
+            return {
+                "diary": diary,
+                "total_points": data.get("total_points", 0),
+                "fortune_drawn": fortune_drawn,
+                "fortune_result": data.get("fortune_result") if fortune_drawn else None,
+                "elf_state": elf_state,
+                "version": data.get("version"),
+            }
+    return {"diary": Diary(store, user_name, {}), "elf_state": create_initial_elf_state(today)}
+
+
+def new_sync(user_name, state, today, version):
+    """The sync record of a session that just loaded `state` at `version`."""
+    return {
+        "session": new_session_id(),
+        "seq": 0,
+        "loaded": version,
+        "base": {"version": version, "fields": copy.deepcopy(mergeable_fields(user_name, state, today))},
+    }
+
+
+def content_version(version):
+    """Cache key of the entries of a diary loaded at, or last saved as, `version`.
+
+    Unlike a counter it can't collide: a writer ID is unique to one save of
+    one session, and a merged save stores other entries than its session
+    holds, so it gets another key than the session's own.
+    """
+    if version is None:
+        return None
+    return version.get("writer"), bool(version.get("merged"))
+
+
+def mergeable_fields(user_name, state, today):
+    """The fields a concurrent save can merge; the insight counters are rebuilt from the entries instead."""
+    return {
+        "total_points": state.get("total_points", 0),
+        "user_name": user_name,
+        "fortune_drawn": state.get("fortune_drawn", False),
+        "fortune_result": state.get("fortune_result", None),
+        "fortune_date": today.isoformat(),
+        "elf_state": state["elf_state"],
+    }
+
+
+def user_fields(user_name, state, today):
+    """The top-level fields saved for a user."""
+    diary = state["diary"]
+    return {
+        **mergeable_fields(user_name, state, today),
+        # Insight counters, updated entry by entry
+        "insight_aggregates": diary.aggregates.to_dict(),
+        # The rollups are kept by the store, bucket by bucket; this empties the copy older files hold
+        "mood_rollups": None,
+    }
+
+
+def save_user_state(store, user_name, state, today, changed_dates=()):
+    """Saves the fields of `state`, plus the diary entries in `changed_dates`.
+
+    Only the changed records are written, so a save costs time proportional
+    to the change rather than to the whole history. With a ``sync`` record
+    the save is optimistic: merged if someone else saved since (see
+    core.concurrency).
+    """
+    diary = state["diary"]
+    fields = user_fields(user_name, state, today)
+    entries = {d: diary.get(d) for d in changed_dates}
+    sync = state.get("sync")
+    if sync is None:
+        if changed_dates:
+            diary.content_version = content_version({"writer": new_session_id()})
+        store.save(user_name, fields, entries)
+        return
+    sync["seq"] += 1
+    writer = f"{sync['session']}:{sync['seq']}"
+    if changed_dates:
+        # Only this session has these entries, whatever the save gets merged with
+        diary.content_version = content_version({"writer": writer})
+    fields["version"] = {"writer": writer}
+    base = dict(sync["base"], session=sync["session"])
+    # The next save starts from this one, whether or not it had to be merged
+    sync["base"] = {"version": {"writer": writer, "merged": False},
+                    "fields": copy.deepcopy(mergeable_fields(user_name, state, today))}
+    store.save(user_name, fields, entries, base=base)
@@ -0,0 +1,203 @@
+"""Write-behind wrapper for a DiaryStore.
+
+`save()` returns immediately: the change is merged into a per-user pending
+batch and written by a background worker once the batch is `flush_delay`
+seconds old. Ten rapid feed clicks therefore become one write. Later values
+of a field or entry replace earlier ones within a batch. Optimistic saves
+(core.concurrency) are batched per user and session, so a batch is one
+session's change from the base of its first save; the batches of one user
+are written one at a time, each session's in order.
+
+Pending batches are flushed before any read of the same user, when a
+session's diary is garbage collected (`flush_when_released`) and at process
+exit. With an `observer` (core.metrics.Metrics), the time and bytes of every
+write are recorded per user.
+"""
+
+import atexit
+import copy
+import logging
+import threading
+import time
+import weakref
+
+from core.metrics import thread_written_bytes, user_label
+from core.store import DiaryStore
+
+FLUSH_DELAY_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindStore(DiaryStore):
+    """Queues saves for `store` and writes them from a background thread."""
+
+    def __init__(self, store, flush_delay=FLUSH_DELAY_SECONDS, observer=None):
+        self.store = store
+        self.flush_delay = flush_delay
+        self.observer = observer
+        self._pending = {}  # (user key, session or None) -> batch dict
+        self._user_locks = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.metrics = {"updates": 0, "writes": 0, "merged": 0, "errors": 0}
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    # --- Writes ---
+
+    def save(self, user_name, fields, entries, base=None):
+        key = (self.store.storage_key(user_name), base["session"] if base is not None else None)
+        fields = copy.deepcopy(fields)
+        entries = copy.deepcopy(entries)
+        with self._cond:
+            self.metrics["updates"] += 1
+            batch = self._pending.get(key)
+            if batch is None:
+                self._pending[key] = {
+                    "user_name": user_name,
+                    "fields": fields,
+                    "entries": entries,
+                    # Kept from the first save: the batch changes the state from there
+                    "base": copy.deepcopy(base),
+                    "updates": 1,
+                    "deadline": time.monotonic() + self.flush_delay,
+                }
+                self._cond.notify()
+            else:
+                batch["fields"].update(fields)
+                batch["entries"].update(entries)
+                batch["updates"] += 1
+            closed = self._closed
+        if closed:
+            self.flush(user_name)
+
+    def flush(self, user_name=None):
+        """Writes the pending batches of one user (or of every user) right now."""
+        if user_name is not None:
+            # An unknown user has nothing pending: save() registers the name
+            user = self.store.storage_key(user_name, register=False)
+            if user is not None:
+                with self._cond:
+                    keys = [key for key in self._pending if key[0] == user]
+                for key in keys:
+                    self._write(key)
+            return
+        with self._cond:
+            keys = list(self._pending)
+        for key in keys:
+            self._write(key)
+
+    def flush_when_released(self, owner, user_name):
+        """Flushes `user_name` once `owner` (e.g. a session's diary) is garbage collected."""
+        weakref.finalize(owner, self.flush, user_name)
+
+    def pending_updates(self):
+        with self._cond:
+            return sum(batch["updates"] for batch in self._pending.values())
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _write(self, key):
+        # Holding the user's lock while popping keeps batches of one user in order
+        # even when the worker and a flush() race.
+        with self._cond:
+            lock = self._user_locks.setdefault(key[0], threading.Lock())
+        with lock:
+            with self._cond:
+                batch = self._pending.pop(key, None)
+            if batch is None:
+                return
+            start = time.perf_counter()
+            written_before = thread_written_bytes() if self.observer is not None else None
+            try:
+                self.store.save(batch["user_name"], batch["fields"], batch["entries"], base=batch["base"])
+            except Exception:
+                logger.exception("Write-behind save failed for %s; will retry", key[0])
+                with self._cond:
+                    self.metrics["errors"] += 1
+                    self._requeue(key, batch)
+                return
+            with self._cond:
+                self.metrics["writes"] += 1
+                self.metrics["merged"] += batch["updates"] - 1
+            if self.observer is not None:
+                user = user_label(batch["user_name"])
+                self.observer.observe("save_seconds", time.perf_counter() - start, user=user)
+                if written_before is not None:
+                    self.observer.inc("saved_bytes_total", thread_written_bytes() - written_before, user=user)
+
+    def _requeue(self, key, batch):
+        newer = self._pending.get(key)
+        if newer is not None:
+            batch["fields"].update(newer["fields"])
+            batch["entries"].update(newer["entries"])
+            batch["updates"] += newer["updates"]
+        batch["deadline"] = time.monotonic() + self.flush_delay
+        self._pending[key] = batch
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [k for k, b in self._pending.items() if b["deadline"] <= now]
+                if not due:
+                    self._cond.wait(min(b["deadline"] for b in self._pending.values()) - now)
+                    continue
+            for key in due:
+                self._write(key)
+
+    def version(self, user_name):
+        # Not flushed: watchers poll it on every rerun, and a session's own
+        # pending saves are no news to it
+        return self.store.version(user_name)
+
+    # --- Reads: flush the user's pending batches first so reads see them ---
+
+    def exists(self, user_name):
+        self.flush(user_name)
+        return self.store.exists(user_name)
+
+    def load(self, user_name, window_start=None):
+        self.flush(user_name)
+        fields, diary = self.store.load(user_name, window_start)
+        diary.store = self
+        return fields, diary
+
+    def get_entry(self, user_name, date_key):
+        self.flush(user_name)
+        return self.store.get_entry(user_name, date_key)
+
+    def entries_between(self, user_name, start_key, end_key):
+        self.flush(user_name)
+        return self.store.entries_between(user_name, start_key, end_key)
+
+    def entry_dates(self, user_name):
+        self.flush(user_name)
+        return self.store.entry_dates(user_name)
+
+    def stats(self, user_name):
+        self.flush(user_name)
+        return self.store.stats(user_name)
+
+    def entry_summaries(self, user_name):
+        self.flush(user_name)
+        return self.store.entry_summaries(user_name)
+
+    def search(self, user_name, query, tags=(), moods=(), start_key=None, end_key=None, limit=20):
+        self.flush(user_name)
+        return self.store.search(user_name, query, tags, moods, start_key, end_key, limit)
+
+    def rollup_records(self, user_name):
+        self.flush(user_name)
+        return self.store.rollup_records(user_name)
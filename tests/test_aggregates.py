@@ -0,0 +1,55 @@
+import random
+
+from core.aggregates import InsightAggregates
+from core.diary import compute_stats
+
+MOODS = ["😀", "😢", "😴"]
+TAGS = ["Work", "Rest", "Family"]
+
+
+def test_apply_matches_a_full_recount():
+    rng = random.Random(0)
+    entries = {}
+    aggregates = InsightAggregates()
+    for _ in range(500):
+        date_key = f"2024-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}"
+        new_entry = None
+        if rng.random() > 0.25:
+            new_entry = {"mood": rng.choice(MOODS), "tags": rng.sample(TAGS, rng.randint(0, 2))}
+        aggregates.apply(date_key, entries.get(date_key), new_entry)
+        if new_entry is None:
+            entries.pop(date_key, None)
+        else:
+            entries[date_key] = new_entry
+        if aggregates.first_entry_date is None and entries:
+            # Set by the caller, which knows the dates
+            aggregates.first_entry_date = min(entries)
+    assert aggregates.verify(compute_stats(entries)) == []
+
+
+def test_verify_reports_drift():
+    entries = {"2024-01-01": {"mood": "😀", "tags": ["Work"]}, "2024-01-02": {"mood": "😢", "tags": []}}
+    aggregates = InsightAggregates.from_stats(compute_stats(entries))
+    assert aggregates.verify(compute_stats(entries)) == []
+    aggregates.tag_counts["Work"] += 1
+    aggregates.total_entries = 5
+    assert aggregates.verify(compute_stats(entries)) == ["tag_counts", "total_entries"]
+
+
+def test_round_trip_and_queries():
+    entries = {
+        "2024-01-01": {"mood": "😢", "tags": ["Work", "Rest"]},
+        "2024-01-02": {"mood": "😀", "tags": ["Work"]},
+        "2024-01-03": {"mood": "😢", "tags": ["Work"]},
+    }
+    aggregates = InsightAggregates.from_dict(InsightAggregates.from_stats(compute_stats(entries)).to_dict())
+    assert aggregates.top_mood() == "😢"
+    assert aggregates.top_tags(1) == [("Work", 3)]
+    assert aggregates.top_tags(5, mood="😀") == [("Work", 1)]
+    assert aggregates.first_entry_date == "2024-01-01"
+    assert InsightAggregates().top_mood() is None
+
+
+def test_top_mood_ties_go_to_the_smallest_emoji():
+    aggregates = InsightAggregates(mood_counts={"😢": 2, "😀": 2, "😴": 1})
+    assert aggregates.top_mood() == min("😢", "😀")
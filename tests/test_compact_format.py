@@ -0,0 +1,57 @@
+import pytest
+
+from core.compact_format import CompactCodec, CompactFormatError, decode_document, encode_document
+
+MOODS = ["😀", "😢"]
+TAGS = ["Work 💻", "Rest 🛋️"]
+
+
+def round_trip(doc):
+    codec = CompactCodec(MOODS, TAGS)
+    return codec.loads(codec.dumps(doc))
+
+
+def test_app_entries_round_trip():
+    doc = {
+        "total_points": 20,
+        "elf_state": {"available_potions": {"happy": 1}},
+        "diary": {
+            "2024-01-01": {"mood": "😀", "text": "a good day", "response": "Nice!", "score": 5, "tags": ["Work 💻"]},
+            "2024-01-02": {"mood": "😢", "text": "", "response": "", "score": 1, "tags": []},
+            "2024-03-15": {"mood": "🤯", "text": "new mood, new tag", "response": "Hm", "score": 3,
+                           "tags": ["Chores", "Chores", "Rest 🛋️"]},
+        },
+    }
+    assert round_trip(doc) == doc
+
+
+def test_missing_score_round_trips():
+    doc = {"diary": {"2024-01-01": {"mood": "😀", "text": "t", "response": "r", "score": None, "tags": []}}}
+    assert round_trip(doc) == doc
+
+
+@pytest.mark.parametrize("entry", [
+    {},
+    {"score": 2.5},
+    {"score": True},
+    {"text": None, "mood": None},
+    {"mood": "😀", "sentiment": {"version": 1, "sentiment": -0.25}},
+])
+def test_unusual_entries_round_trip(entry):
+    doc = {"diary": {"2024-02-29": entry}}
+    decoded = round_trip(doc)
+    assert decoded == doc
+    assert type(decoded["diary"]["2024-02-29"].get("score")) is type(entry.get("score"))
+
+
+def test_empty_document():
+    assert decode_document(encode_document({})) == {"diary": {}}
+
+
+def test_refuses_other_data():
+    with pytest.raises(CompactFormatError):
+        decode_document(b'{"diary": {}}')
+    data = bytearray(encode_document({"diary": {}}))
+    data[4] = 99  # schema version
+    with pytest.raises(CompactFormatError):
+        decode_document(bytes(data))
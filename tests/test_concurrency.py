@@ -0,0 +1,48 @@
+from core.concurrency import merge_fields, next_version, same_version
+
+
+def test_a_field_only_one_side_changed_takes_that_change():
+    base = {"total_points": 10, "fortune_text": "old"}
+    mine = {"total_points": 10, "fortune_text": "mine"}
+    theirs = {"total_points": 12, "fortune_text": "old"}
+    assert merge_fields(base, mine, theirs) == {"total_points": 12, "fortune_text": "mine"}
+
+
+def test_numbers_both_sides_changed_add_up():
+    # Two tabs each spent a potion and earned points
+    base = {"total_points": 10, "elf_state": {"available_potions": {"happy": 3}}}
+    mine = {"total_points": 15, "elf_state": {"available_potions": {"happy": 2}}}
+    theirs = {"total_points": 11, "elf_state": {"available_potions": {"happy": 2}}}
+    assert merge_fields(base, mine, theirs) == {"total_points": 16, "elf_state": {"available_potions": {"happy": 1}}}
+
+
+def test_dicts_merge_key_by_key():
+    base = {"elf_state": {"name": "Elfie", "level": 1}}
+    mine = {"elf_state": {"name": "Pip", "level": 1}}
+    theirs = {"elf_state": {"name": "Elfie", "level": 2, "evolved": True}}
+    assert merge_fields(base, mine, theirs) == {"elf_state": {"name": "Pip", "level": 2, "evolved": True}}
+
+
+def test_other_values_both_sides_changed_keep_mine():
+    base = {"fortune_text": "old", "flag": False}
+    mine = {"fortune_text": "mine", "flag": True}
+    theirs = {"fortune_text": "theirs", "flag": 1}
+    assert merge_fields(base, mine, theirs) == {"fortune_text": "mine", "flag": True}
+
+
+def test_fields_missing_from_base_become_none():
+    merged = merge_fields({}, {"aggregates": {"total_entries": 3}}, {"aggregates": {"total_entries": 4}})
+    assert merged == {"aggregates": None}
+
+
+def test_fields_only_theirs_has_are_kept():
+    assert merge_fields({"a": 1}, {"a": 1}, {"a": 1, "b": 2}) == {"a": 1, "b": 2}
+
+
+def test_versions():
+    first = next_version(None, "tab1", False)
+    assert first == {"number": 1, "writer": "tab1", "merged": False}
+    assert next_version(first, "tab2", True)["number"] == 2
+    assert same_version(first, {"number": 5, "writer": "tab1", "merged": False})
+    assert not same_version(first, {"writer": "tab1", "merged": True})
+    assert same_version(None, None)
@@ -0,0 +1,99 @@
+from core import entry_file as entry_file_module
+from core.entry_file import EntryFile, encode_record
+from core.store import JsonDiaryStore
+
+
+def entry(text):
+    return {"mood": "😀", "text": text, "response": "", "score": 3, "tags": []}
+
+
+ENTRIES = {"2023-12-31": entry("last year"), "2024-01-01": entry("new year"), "2024-02-29": entry("leap day")}
+
+
+def built(tmp_path, entries=ENTRIES, position=(7, 100)):
+    entry_file = EntryFile(str(tmp_path / "diary_al.entries"))
+    entry_file.rebuild({"total_points": 4}, entries, position)
+    return entry_file
+
+
+def test_rebuild_then_read(tmp_path):
+    entry_file = built(tmp_path)
+    assert entry_file.position() == (7, 100)
+    assert entry_file.get("2024-02-29") == entry("leap day")
+    assert entry_file.get("2024-02-28") is None
+    assert entry_file.get("1999-01-01") is None
+    assert entry_file.between("2024-01-01", "2024-12-31") == {k: v for k, v in ENTRIES.items() if k >= "2024"}
+    assert entry_file.dates() == sorted(ENTRIES)
+    assert entry_file.fields() == {"total_points": 4}
+    assert entry_file.verify() == []
+    # Another instance reads the same files
+    assert EntryFile(entry_file.data_path).between("2000-01-01", "2100-01-01") == ENTRIES
+
+
+def test_rebuild_empty(tmp_path):
+    entry_file = built(tmp_path, entries={})
+    assert entry_file.dates() == []
+    assert entry_file.get("2024-01-01") is None
+
+
+def test_apply_appends_a_save(tmp_path):
+    entry_file = built(tmp_path)
+    assert entry_file.apply({"total_points": 5}, {"2024-01-01": None, "2030-06-01": entry("far")}, (7, 100), (7, 180))
+    assert entry_file.position() == (7, 180)
+    assert entry_file.get("2024-01-01") is None
+    assert entry_file.get("2030-06-01") == entry("far")
+    assert entry_file.fields() == {"total_points": 5}
+    assert entry_file.dates() == ["2023-12-31", "2024-02-29", "2030-06-01"]
+
+
+def test_apply_at_another_position_is_refused(tmp_path):
+    entry_file = built(tmp_path)
+    assert not entry_file.apply({}, {"2024-01-01": entry("lost")}, (7, 90), (7, 180))
+    assert entry_file.get("2024-01-01") == entry("new year")
+    assert entry_file.position() == (7, 100)
+
+
+def test_records_after_the_last_header_update_are_recovered(tmp_path):
+    entry_file = built(tmp_path)
+    # A crash between appending the records and updating the index
+    with open(entry_file.data_path, "ab") as f:
+        f.write(encode_record("2024-03-01", entry("after the crash")))
+        f.write(b'2024-03-02\t{"text": "torn')
+    reopened = EntryFile(entry_file.data_path)
+    assert reopened.get("2024-03-01") == entry("after the crash")
+    assert reopened.get("2024-03-02") is None
+    assert reopened.position() == (7, 100)
+    assert reopened.verify() == []
+
+
+def test_unreadable_index_has_no_position(tmp_path):
+    entry_file = built(tmp_path)
+    with open(entry_file.index_path, "r+b") as f:
+        f.write(b"MJENTRY1")
+    assert EntryFile(entry_file.data_path).position() is None
+
+
+def test_store_catches_up_from_the_journal_tail(tmp_path, monkeypatch):
+    store = JsonDiaryStore(str(tmp_path))
+    store.save("al", {"total_points": 1}, {"2024-01-01": entry("one")})
+    assert store.get_entry("al", "2024-01-01") == entry("one")
+    rebuilds = []
+    rebuild = entry_file_module.EntryFile.rebuild
+    monkeypatch.setattr(entry_file_module.EntryFile, "rebuild",
+                        lambda self, *args: rebuilds.append(args) or rebuild(self, *args))
+    # Written behind the entry file's back, as by another process
+    journal = store.journal("al")
+    journal.append({}, {"2024-01-02": entry("two")})
+    assert store.get_entry("al", "2024-01-02") == entry("two")
+    # Caught up with the journal, which is then compacted: the records after it are in a new journal
+    journal.compact()
+    journal.append({"total_points": 2}, {"2024-01-01": None})
+    assert store.get_entry("al", "2024-01-01") is None
+    assert store.entry_file("al").fields()["total_points"] == 2
+    assert rebuilds == []
+    # Records compacted away before it caught up: rebuilt from the document
+    journal.append({}, {"2024-01-03": entry("three")})
+    journal.compact()
+    assert store.entries_between("al", "2024-01-01", "2024-12-31") == {
+        "2024-01-02": entry("two"), "2024-01-03": entry("three")}
+    assert len(rebuilds) == 1
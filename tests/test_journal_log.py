@@ -0,0 +1,88 @@
+import os
+
+from core.compact_format import CompactCodec
+from core.journal_log import JournalLog, collect_changes
+
+
+def entry(text, score=3):
+    return {"mood": "😀", "text": text, "response": "", "score": score, "tags": []}
+
+
+def new_log(tmp_path, **kwargs):
+    return JournalLog(str(tmp_path / "diary_al.json"), compact_every=10 ** 6, **kwargs)
+
+
+def test_load_replays_the_journal(tmp_path):
+    log = new_log(tmp_path)
+    log.append({"total_points": 5}, {"2024-01-01": entry("one"), "2024-01-02": entry("two")})
+    log.append({"total_points": 6}, {"2024-01-01": None, "2024-01-03": entry("three")})
+    # A fresh reader has nothing but the files
+    doc = new_log(tmp_path).load()
+    assert doc == {"total_points": 6, "diary": {"2024-01-02": entry("two"), "2024-01-03": entry("three")}}
+
+
+def test_unchanged_fields_are_not_written_again(tmp_path):
+    log = new_log(tmp_path)
+    assert log.append({"total_points": 5, "elf_state": {"level": 1}}) == 2
+    assert log.append({"total_points": 5, "elf_state": {"level": 1}}) == 0
+    assert log.append({"total_points": 5, "elf_state": {"level": 2}}) == 1
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    log = new_log(tmp_path)
+    log.append({"total_points": 1}, {"2024-01-01": entry("kept")})
+    with open(log.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "entry", "date": "2024-01-02", "val')
+    assert new_log(tmp_path).load() == {"total_points": 1, "diary": {"2024-01-01": entry("kept")}}
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    log = new_log(tmp_path)
+    for day in range(1, 6):
+        log.append({"total_points": day}, {f"2024-01-0{day}": entry(f"day {day}")})
+    before = new_log(tmp_path).load()
+    log.compact()
+    assert not os.path.exists(log.compacting_path)
+    assert new_log(tmp_path)._read_snapshot() == before
+    assert new_log(tmp_path).load() == before
+    log.append({}, {"2024-01-06": entry("after")})
+    assert new_log(tmp_path).load()["diary"]["2024-01-06"] == entry("after")
+
+
+def test_another_codec_migrates_the_legacy_snapshot(tmp_path):
+    legacy = new_log(tmp_path)
+    legacy.append({"total_points": 2}, {"2024-01-01": entry("old")})
+    legacy.compact()
+    log = JournalLog(str(tmp_path / "diary_al.mjd"), codec=CompactCodec(["😀"], []))
+    assert log.load() == {"total_points": 2, "diary": {"2024-01-01": entry("old")}}
+    assert not os.path.exists(tmp_path / "diary_al.json")
+    assert os.path.exists(tmp_path / "diary_al.json.migrated")
+
+
+def test_records_since_follows_compactions(tmp_path):
+    log = new_log(tmp_path)
+    log.append({}, {"2024-01-01": entry("one")})
+    start = log.position()
+    log.append({}, {"2024-01-02": entry("two")})
+    assert collect_changes(log.records_since(start)) == ({}, {"2024-01-02": entry("two")})
+    end = log.position()
+    log.compact()
+    # Nothing new, though the journal file is a new one
+    assert log.records_since(end) == []
+    log.append({"total_points": 1}, {"2024-01-02": None})
+    assert collect_changes(log.records_since(end)) == ({"total_points": 1}, {"2024-01-02": None})
+    # Records compacted into the snapshot can't be replayed
+    assert log.records_since(start) is None
+
+
+def test_collect_changes_last_record_wins():
+    records = [
+        {"op": "set", "key": "total_points", "value": 1},
+        {"op": "batch", "records": [
+            {"op": "entry", "date": "2024-01-01", "value": entry("a")},
+            {"op": "set", "key": "total_points", "value": 2},
+        ]},
+        {"op": "entry", "date": "2024-01-01", "value": None},
+        {"op": "unknown"},
+    ]
+    assert collect_changes(records) == ({"total_points": 2}, {"2024-01-01": None})
@@ -0,0 +1,69 @@
+import itertools
+import random
+
+from core.lexicon import AhoCorasick, EmotionMatcher, normalize_text
+
+
+def naive_matches(patterns, text):
+    return sorted((i, i + len(p), payload) for p, payload in patterns
+                  for i in range(len(text) - len(p) + 1) if text.startswith(p, i))
+
+
+def test_aho_corasick_finds_overlapping_and_nested_patterns():
+    patterns = [("he", 1), ("she", 2), ("his", 3), ("hers", 4)]
+    automaton = AhoCorasick(patterns)
+    assert sorted(automaton.iter_matches("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+    assert list(automaton.iter_matches("")) == []
+    assert list(AhoCorasick([]).iter_matches("anything")) == []
+
+
+def test_aho_corasick_matches_a_naive_search():
+    rng = random.Random(0)
+    words = ["".join(p) for n in (1, 2, 3) for p in itertools.product("abc", repeat=n)]
+    for _ in range(50):
+        patterns = [(word, i) for i, word in enumerate(rng.sample(words, 8))]
+        text = "".join(rng.choice("abcd") for _ in range(40))
+        assert sorted(AhoCorasick(patterns).iter_matches(text)) == naive_matches(patterns, text)
+
+
+def test_same_pattern_twice_reports_both_payloads():
+    automaton = AhoCorasick([("sad", "a"), ("sad", "b")])
+    assert sorted(automaton.iter_matches("so sad")) == [(3, 6, "a"), (3, 6, "b")]
+
+
+LEXICON = {"emotions": {
+    "sad": {"en": {"down": 0.6, "sad": 1.0}, "es": {"triste": 1.0}, "fr": {"triste": 0.8}},
+    "tired": {"en": {"exhausted": 1.0, "feeling down": 0.5}},
+    "happy": {"en": {"glad": 1.0}, "ja": {"嬉しい": 1.0}},
+}}
+
+
+def test_matcher_counts_whole_words_only():
+    matcher = EmotionMatcher(LEXICON)
+    assert matcher.scores("Sad, so SAD") == {"sad": 2.0}
+    assert matcher.scores("saddest downtown") == {}
+    # Scripts without spaces match inside words
+    assert matcher.scores("今日は嬉しいです") == {"happy": 1.0}
+
+
+def test_matcher_resolves_overlaps_leftmost_longest():
+    matcher = EmotionMatcher(LEXICON)
+    assert [m[2] for m in matcher.matches("feeling down today")] == ["feeling down"]
+    assert matcher.scores("feeling down, down") == {"tired": 0.5, "sad": 0.6}
+
+
+def test_a_term_listed_under_two_languages_counts_once():
+    matcher = EmotionMatcher(LEXICON)
+    assert matcher.scores("je suis triste") == {"sad": 1.0}
+    assert matcher.term_count == 7
+
+
+def test_best_emotion():
+    matcher = EmotionMatcher(LEXICON)
+    assert matcher.best_emotion("exhausted and sad") == "sad"
+    assert matcher.best_emotion("exhausted and sad", allowed=["tired", "happy"]) == "tired"
+    assert matcher.best_emotion("nothing here") is None
+
+
+def test_normalize_text():
+    assert normalize_text("  Straße\n\tNOW ") == " strasse now "
@@ -0,0 +1,72 @@
+import random
+
+from core.diary import summarize_entries
+from core.rollups import MoodRollups, bucket_records, period_range, period_start, recount_buckets, week_key
+
+MOODS = ["😀", "😢", "😴"]
+TAGS = ["Work", "Rest", "Family"]
+
+
+def random_entry(rng):
+    return {"mood": rng.choice(MOODS), "score": rng.randint(1, 5), "tags": rng.sample(TAGS, rng.randint(0, 2))}
+
+
+def test_period_keys():
+    # ISO weeks: Jan 1st 2021 is in the last week of 2020
+    assert week_key("2021-01-01") == "2020-W53"
+    assert period_start("weekly", "2020-W53").isoformat() == "2020-12-28"
+    assert period_range("weekly", "2024-W05") == ("2024-01-29", "2024-02-04")
+    assert period_range("monthly", "2024-02") == ("2024-02-01", "2024-02-29")
+
+
+def test_buckets():
+    entries = {
+        "2024-01-01": {"mood": "😀", "score": 5, "tags": ["Work"]},
+        "2024-01-02": {"mood": "😢", "score": 1, "tags": ["Work", "Rest"]},
+        "2024-02-01": {"mood": "😀", "score": 4, "tags": []},
+    }
+    rollups = MoodRollups.from_summaries(summarize_entries(entries))
+    assert rollups.buckets["monthly"]["2024-01"] == {
+        "count": 2, "score_sum": 6, "moods": {"😀": 1, "😢": 1}, "tags": {"Work": 2, "Rest": 1}}
+    assert [(key, row["mean_score"]) for key, row in rollups.series("monthly")] == [("2024-01", 3.0), ("2024-02", 4.0)]
+    assert [key for key, _ in rollups.series("monthly", start_key="2024-02")] == ["2024-02"]
+    assert rollups.total_entries() == 3
+
+
+def test_apply_matches_a_full_rebuild():
+    rng = random.Random(0)
+    entries = {}
+    rollups = MoodRollups()
+    for _ in range(500):
+        date_key = f"2024-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}"
+        new_entry = None if rng.random() < 0.25 else random_entry(rng)
+        rollups.apply(date_key, entries.get(date_key), new_entry)
+        if new_entry is None:
+            entries.pop(date_key, None)
+        else:
+            entries[date_key] = new_entry
+    assert rollups.to_dict() == MoodRollups.from_summaries(summarize_entries(entries)).to_dict()
+
+
+def test_recount_buckets_of_changed_dates():
+    rng = random.Random(1)
+    entries = {f"2024-01-{day:02d}": random_entry(rng) for day in range(1, 32)}
+    records = bucket_records(summarize_entries(entries))
+    entries["2024-01-10"] = random_entry(rng)
+    del entries["2024-01-31"]
+
+    def summaries_between(first, last):
+        return summarize_entries({d: e for d, e in entries.items() if first <= d <= last})
+
+    records.update(recount_buckets(["2024-01-10", "2024-01-31"], summaries_between))
+    rebuilt = bucket_records(summarize_entries(entries))
+    assert {k: v for k, v in records.items() if v is not None} == rebuilt
+    assert MoodRollups.from_records(rebuilt).to_dict() == MoodRollups.from_summaries(summarize_entries(entries)).to_dict()
+
+
+def test_emptied_bucket_is_dropped():
+    rollups = MoodRollups()
+    entry = {"mood": "😀", "score": 3, "tags": ["Work"]}
+    rollups.apply("2024-01-01", None, entry)
+    rollups.apply("2024-01-01", entry, None)
+    assert rollups.to_dict() == {"weekly": {}, "monthly": {}}
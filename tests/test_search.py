@@ -0,0 +1,88 @@
+from core.search import SearchIndex, highlight_terms, parse_query, run_query, tokenize
+
+
+def entry(text, mood="😀", tags=()):
+    return {"mood": mood, "text": text, "tags": list(tags)}
+
+
+def index_of(entries):
+    index = SearchIndex()
+    for date_key, value in entries.items():
+        index.set_entry(date_key, value)
+    return index
+
+
+def dates(results):
+    return [date_key for date_key, _ in results]
+
+
+def test_tokenize_and_parse_query():
+    assert tokenize("Went  RUNNING, then café!") == ["went", "running", "then", "café"]
+    assert tokenize("今天很累") == ["今", "天", "很", "累"]
+    assert parse_query('walk "long walk" 很累') == (["walk"], [["long", "walk"], ["很", "累"]])
+    assert highlight_terms('walk "long walk"') == {"walk", "long"}
+
+
+def test_bm25_ranks_more_frequent_terms_and_shorter_entries_first():
+    index = index_of({
+        "2024-01-01": entry("walk by the river"),
+        "2024-01-02": entry("walk walk the river"),
+        "2024-01-03": entry("a long day at work and then a short walk home after dinner with friends"),
+        "2024-01-04": entry("stayed in"),
+    })
+    results = run_query(index, "walk")
+    assert dates(results) == ["2024-01-02", "2024-01-01", "2024-01-03"]
+    assert all(score > 0 for _, score in results)
+
+
+def test_rare_terms_weigh_more():
+    index = index_of({
+        "2024-01-01": entry("work work"),
+        "2024-01-02": entry("work river"),
+        "2024-01-03": entry("work"),
+    })
+    results = run_query(index, "work river")
+    assert dates(results)[0] == "2024-01-02"
+    assert len(results) == 3
+
+
+def test_phrases_need_consecutive_words():
+    index = index_of({
+        "2024-01-01": entry("a long walk"),
+        "2024-01-02": entry("walk for long"),
+    })
+    assert dates(run_query(index, '"long walk"')) == ["2024-01-01"]
+    # Tags are indexed after the text: a phrase never spans both
+    index.set_entry("2024-01-03", entry("long", tags=["walk"]))
+    assert dates(run_query(index, '"long walk"')) == ["2024-01-01"]
+
+
+def test_filters_and_date_range():
+    index = index_of({
+        "2024-01-01": entry("walk", mood="😀", tags=["Exercise"]),
+        "2024-01-02": entry("walk", mood="😢", tags=["Exercise", "Work"]),
+        "2024-02-01": entry("walk", mood="😢"),
+    })
+    assert dates(run_query(index, "walk", tags=["Exercise", "Work"])) == ["2024-01-02"]
+    assert set(dates(run_query(index, "walk", moods=["😢"]))) == {"2024-01-02", "2024-02-01"}
+    assert dates(run_query(index, "walk", start_key="2024-01-02", end_key="2024-01-31")) == ["2024-01-02"]
+    # An empty query lists the filtered entries, newest first
+    assert dates(run_query(index, "", moods=["😢"])) == ["2024-02-01", "2024-01-02"]
+    assert run_query(index, "") == []
+
+
+def test_set_entry_replaces_and_removes():
+    index = index_of({"2024-01-01": entry("river walk"), "2024-01-02": entry("river")})
+    index.set_entry("2024-01-01", entry("stayed in"))
+    assert dates(run_query(index, "walk")) == []
+    assert index.set_entry("2024-01-02", None) is None
+    assert run_query(index, "river") == []
+    assert len(index) == 1
+    assert index.collection_stats() == (1, 2)
+
+
+def test_index_from_its_forward_documents():
+    index = index_of({"2024-01-01": entry("river walk", tags=["Nature"]), "2024-01-02": entry("walk")})
+    reloaded = SearchIndex(index.documents)
+    assert run_query(reloaded, "walk", tags=["Nature"]) == run_query(index, "walk", tags=["Nature"])
+    assert run_query(reloaded, "walk") == run_query(index, "walk")
@@ -0,0 +1,104 @@
+import copy
+import pickle
+import random
+
+import pytest
+
+from core.user_cache import LayeredDict, OverlayDict, SharedUserState, UserStateCache
+
+
+def test_overlay_keeps_changes_out_of_the_base():
+    base = {"a": 1, "b": 2}
+    overlay = OverlayDict(base)
+    overlay["b"] = 20
+    overlay["c"] = 3
+    del overlay["a"]
+    assert dict(overlay) == {"b": 20, "c": 3}
+    assert len(overlay) == 2
+    assert "a" not in overlay and overlay.get("a") is None
+    assert base == {"a": 1, "b": 2}
+    with pytest.raises(KeyError):
+        del overlay["a"]
+
+
+def test_overlay_delete_then_set_again():
+    overlay = OverlayDict({"a": 1})
+    del overlay["a"]
+    overlay["a"] = 5
+    overlay["x"] = 1
+    del overlay["x"]
+    assert dict(overlay) == {"a": 5}
+    assert len(overlay) == 1
+
+
+def test_overlay_survives_copy_and_pickle():
+    overlay = OverlayDict({"a": 1, "b": 2})
+    del overlay["a"]
+    overlay["c"] = 3
+    assert dict(copy.deepcopy(overlay)) == {"b": 2, "c": 3}
+    assert dict(pickle.loads(pickle.dumps(overlay))) == {"b": 2, "c": 3}
+
+
+def test_layered_dict_matches_a_plain_dict():
+    rng = random.Random(0)
+    expected = {f"2024-01-{day:02d}": day for day in range(1, 21)}
+    layered = LayeredDict(dict(expected))
+    states = []
+    for step in range(200):
+        changes = {}
+        for _ in range(rng.choice([1, 1, 2, 8])):
+            key = f"2024-01-{rng.randint(1, 31):02d}"
+            changes[key] = None if rng.random() < 0.3 else step
+        layered = layered.updated(changes)
+        for key, value in changes.items():
+            if value is None:
+                expected.pop(key, None)
+            else:
+                expected[key] = value
+        states.append((layered, dict(expected)))
+    # Every earlier state is unchanged by the updates after it
+    for layered, expected in states:
+        assert dict(layered) == expected
+        assert len(layered) == len(expected)
+        assert sorted(layered) == sorted(expected)
+        assert all((f"2024-01-{day:02d}" in layered) == (f"2024-01-{day:02d}" in expected) for day in range(1, 32))
+
+
+def test_layered_dict_keeps_few_layers():
+    layered = LayeredDict({str(i): i for i in range(1000)})
+    for i in range(1000):
+        layered = layered.updated({str(i): -i})
+        assert len(layered._layers) <= 12
+    assert dict(layered) == {str(i): -i for i in range(1000)}
+
+
+def test_shared_state_updates_copy_on_write():
+    state = SharedUserState({"total_points": 1}, {"2024-01-01": "a", "2024-01-02": "b"}, "stamp1", 10)
+    session = OverlayDict(state.entries)
+    new_state = state.updated({"total_points": 2}, {"2024-01-01": None, "2024-01-03": "c"}, "stamp2", 12)
+    assert new_state.fields == {"total_points": 2}
+    assert dict(new_state.entries) == {"2024-01-02": "b", "2024-01-03": "c"}
+    assert dict(session) == {"2024-01-01": "a", "2024-01-02": "b"}
+    assert state.fields == {"total_points": 1}
+
+
+def test_cache_update_applies_only_to_a_current_state():
+    cache = UserStateCache(budget_bytes=100)
+    cache.put("al", SharedUserState({}, {"2024-01-01": "a"}, "s1", 10))
+    cache.update("al", "s1", "s2", 10, {}, {"2024-01-02": "b"})
+    assert cache.get("al", "s1") is None
+    cache.put("al", SharedUserState({}, {"2024-01-01": "a"}, "s1", 10))
+    cache.update("al", "s1", "s2", 10, {}, {"2024-01-02": "b"})
+    assert dict(cache.get("al", "s2").entries) == {"2024-01-01": "a", "2024-01-02": "b"}
+    # Someone else wrote the files: the state is dropped rather than updated
+    cache.update("al", "s1", "s3", 10, {}, {})
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = UserStateCache(budget_bytes=25)
+    for key in ("a", "b", "c"):
+        cache.put(key, SharedUserState({}, {}, key, 10))
+    assert cache.get("a", "a") is None
+    assert cache.get("c", "c") is not None
+    assert cache.metrics["evictions"] == 1